@@ -1,23 +1,227 @@
-from django.contrib import admin
-from .models import Usuario, Amistad, Mensaje
+import os
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.http import QueryDict
+from django.shortcuts import redirect
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from django.utils.translation import gettext as _
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.core.exceptions import PermissionDenied
+from .forms import RosterForm
+from . import shards
+from .models import Usuario, Amistad, Mensaje, Foro, Comentario, Etiqueta
+from .perfiles import obtener_tarjetas
+from .roster import (
+    ROSTER_ADMIN_MAX_CONTRASENAS, contar_contrasenas, guardar_pendiente, importar_en_segundo_plano, importar_roster,
+)
+
+
+class PaginadorEstimado(Paginator):
+    """
+    Paginator para el changelist de tablas grandes: no hace COUNT(*) exacto.
+
+    Sin filtros estima el total (reltuples en PostgreSQL, el id máximo en SQLite, que sale del
+    índice de la clave primaria). Con filtros cuenta, pero solo hasta CONTEO_MAXIMO filas.
+    """
+    CONTEO_MAXIMO = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if queryset.query.where:
+            return queryset[:self.CONTEO_MAXIMO].count()
+
+        conexion = connections[queryset.db]
+        if conexion.vendor == 'postgresql':
+            with conexion.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+                fila = cursor.fetchone()
+            if fila and fila[0] > 0:
+                return int(fila[0])
+        elif conexion.vendor == 'sqlite':
+            return queryset.model._default_manager.using(queryset.db).aggregate(maximo=Max('pk'))['maximo'] or 0
+        return queryset.count()
+
+
+class AdminTablaGrande(admin.ModelAdmin):
+    """
+    Changelist sin COUNT(*) completos, para los modelos que llegan a millones de filas.
+
+    Sin date_hierarchy: cada nivel es un SELECT DISTINCT de fechas que recorre la tabla entera.
+    Las fechas se filtran con DateFieldListFilter (hoy, 7 días, este mes, este año), que son
+    rangos sobre el índice y no consultan nada para armar las opciones.
+    """
+    paginator = PaginadorEstimado
+    show_full_result_count = False
+    list_per_page = 50
+
 
 @admin.register(Usuario)
-class UsuarioAdmin(admin.ModelAdmin):
+class UsuarioAdmin(AdminTablaGrande):
     list_display = ('nombres', 'apellidos', 'email_institucional', 'is_active', 'is_staff', 'date_joined')
     search_fields = ('nombres', 'apellidos', 'email_institucional')
-    list_filter = ('is_active', 'is_staff', 'date_joined')
+    list_filter = ('is_active', 'is_staff', ('date_joined', admin.DateFieldListFilter))
     ordering = ('date_joined',)
 
+    def get_urls(self):
+        return [
+            path('importar-roster/', self.admin_site.admin_view(self.importar_roster_view),
+                 name='App_usuario_importar_roster'),
+        ] + super().get_urls()
+
+    def importar_roster_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        form = RosterForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            archivo = form.cleaned_data['archivo']
+            formato = 'jsonl' if archivo.name.endswith(('.jsonl', '.ndjson')) else 'csv'
+            validar = form.cleaned_data['validar']
+            ruta = guardar_pendiente(archivo, formato)
+            with open(ruta, 'rb') as copia:
+                contrasenas = contar_contrasenas(copia, formato)
+            if not validar and contrasenas > ROSTER_ADMIN_MAX_CONTRASENAS:
+                # Cada hash tarda a propósito: con muchos la petición se quedaría colgada
+                importar_en_segundo_plano(ruta, formato)
+                self.message_user(
+                    request, f'El roster trae {contrasenas} contraseñas: se importa en segundo plano con '
+                             f'manage.py importar_roster. El resultado queda en {ruta}.log', messages.INFO)
+                return redirect('admin:App_usuario_changelist')
+            # Pocas contraseñas: se hashean en este worker, sin pool de procesos
+            try:
+                with open(ruta, 'rb') as copia:
+                    resultado = importar_roster(copia, formato=formato, procesos=1, validar=validar)
+            finally:
+                os.remove(ruta)
+            for linea, mensaje in resultado.errores[:20]:
+                messages.warning(request, f'Línea {linea}: {mensaje}')
+            nivel = messages.WARNING if resultado.invalidas else messages.SUCCESS
+            self.message_user(request, str(resultado), nivel)
+            return redirect('admin:App_usuario_changelist')
+
+        contexto = {**self.admin_site.each_context(request), 'opts': self.model._meta, 'form': form,
+                    'title': 'Importar roster'}
+        return TemplateResponse(request, 'admin/App/usuario/importar_roster.html', contexto)
+
 @admin.register(Amistad)
-class AmistadAdmin(admin.ModelAdmin):
+class AmistadAdmin(AdminTablaGrande):
     list_display = ('user1', 'user2', 'estado', 'fecha_amistad')
+    list_select_related = ('user1', 'user2')
     search_fields = ('user1__email_institucional', 'user2__email_institucional')
-    list_filter = ('estado', 'fecha_amistad')
+    list_filter = ('estado', ('fecha_amistad', admin.DateFieldListFilter))
+    autocomplete_fields = ('user1', 'user2')
     ordering = ('fecha_amistad',)
 
+class ShardFilter(admin.SimpleListFilter):
+    """Mensaje está repartido en varias bases: el changelist muestra un shard a la vez"""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shards.aliases()]
+
+    def choices(self, changelist):
+        # Sin "Todos": siempre hay un shard elegido (el primero por defecto)
+        actual = self.value() or shards.aliases()[0]
+        for alias, titulo in self.lookup_choices:
+            yield {
+                'selected': actual == alias,
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': titulo,
+            }
+
+    @staticmethod
+    def alias(valor):
+        return valor if valor in shards.aliases() else shards.aliases()[0]
+
+    def queryset(self, request, queryset):
+        return queryset.using(self.alias(self.value()))
+
+
 @admin.register(Mensaje)
-class MensajeAdmin(admin.ModelAdmin):
-    list_display = ('remitente', 'destinatario', 'contenido', 'fecha_enviado')
-    search_fields = ('remitente__email_institucional', 'destinatario__email_institucional', 'contenido')
-    list_filter = ('fecha_enviado',)
+class MensajeAdmin(AdminTablaGrande):
+    # Los usuarios están en otra base que los mensajes: sin JOINs, se muestran con su tarjeta
+    list_display = ('remitente_tarjeta', 'destinatario_tarjeta', 'contenido', 'fecha_enviado')
+    list_filter = (ShardFilter, ('fecha_enviado', admin.DateFieldListFilter))
+    search_fields = ('contenido',)
+    autocomplete_fields = ('remitente', 'destinatario')
     ordering = ('fecha_enviado',)
+
+    def get_changelist_instance(self, request):
+        # Las tarjetas de toda la página en un get_many (y una consulta para las que falten), no dos por fila
+        changelist = super().get_changelist_instance(request)
+        mensajes = list(changelist.result_list)  # Queda en la caché del queryset que recorre la plantilla
+        tarjetas = obtener_tarjetas([
+            usuario_id for mensaje in mensajes for usuario_id in (mensaje.remitente_id, mensaje.destinatario_id)
+        ])
+        for mensaje in mensajes:
+            mensaje.tarjetas = tarjetas
+        return changelist
+
+    @staticmethod
+    def _nombre(mensaje, usuario_id):
+        tarjetas = getattr(mensaje, 'tarjetas', None)
+        if tarjetas is None:  # Fuera del changelist
+            tarjetas = obtener_tarjetas([usuario_id])
+        tarjeta = tarjetas.get(usuario_id)
+        return tarjeta.nombre_completo if tarjeta else f'#{usuario_id}'
+
+    @admin.display(description='remitente')
+    def remitente_tarjeta(self, mensaje):
+        return self._nombre(mensaje, mensaje.remitente_id)
+
+    @admin.display(description='destinatario')
+    def destinatario_tarjeta(self, mensaje):
+        return self._nombre(mensaje, mensaje.destinatario_id)
+
+    def action_checkbox(self, mensaje):
+        # Django pone str(mensaje) en el aria-label, y eso trae de default los dos usuarios de cada fila
+        descripcion = f'Mensaje de {self.remitente_tarjeta(mensaje)} a {self.destinatario_tarjeta(mensaje)}'
+        attrs = {'class': 'action-select',
+                 'aria-label': format_html(_('Select this object for an action - {}'), descripcion)}
+        return forms.CheckboxInput(attrs, lambda value: False).render(helpers.ACTION_CHECKBOX_NAME, str(mensaje.pk))
+
+    def get_queryset(self, request):
+        # Sin filtro se ve el primer shard (ShardFilter lo cambia)
+        return super().get_queryset(request).using(ShardFilter.alias(request.GET.get('shard')))
+
+    def get_object(self, request, object_id, from_field=None):
+        # Los ids se repiten entre shards: el de la vista de cambio es el que estaba filtrado en la lista
+        filtros = QueryDict(request.GET.get('_changelist_filters', ''))
+        queryset = self.get_queryset(request).using(ShardFilter.alias(filtros.get('shard')))
+        return queryset.filter(pk=object_id).first()
+
+@admin.register(Etiqueta)
+class EtiquetaAdmin(admin.ModelAdmin):
+    list_display = ('nombre',)
+    search_fields = ('nombre',)
+    ordering = ('nombre',)
+    # Los seguidores pueden ser miles: mejor un campo de ids que un <select multiple>
+    raw_id_fields = ('seguidores',)
+
+@admin.register(Foro)
+class ForoAdmin(AdminTablaGrande):
+    list_display = ('titulo', 'creador', 'vistas', 'fecha_creacion')
+    list_select_related = ('creador',)
+    search_fields = ('titulo', 'creador__email_institucional')
+    list_filter = ('etiquetas', ('fecha_creacion', admin.DateFieldListFilter))
+    autocomplete_fields = ('creador', 'etiquetas')
+    raw_id_fields = ('likes',)
+    ordering = ('-fecha_creacion',)
+
+@admin.register(Comentario)
+class ComentarioAdmin(AdminTablaGrande):
+    list_display = ('autor', 'foro', 'contenido', 'fecha_creacion')
+    list_select_related = ('autor', 'foro')
+    search_fields = ('autor__email_institucional', 'foro__titulo')
+    list_filter = (('fecha_creacion', admin.DateFieldListFilter),)
+    autocomplete_fields = ('autor', 'foro')
+    raw_id_fields = ('parent',)
+    ordering = ('-fecha_creacion',)
@@ -0,0 +1,62 @@
+"""
+SQLite con WAL y pragmas configurables en cada conexión nueva.
+
+    DATABASES = {'default': {
+        'ENGINE': 'App.backends.sqlite_wal',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {'pragmas': {'busy_timeout': 10000}},  # se combina con PRAGMAS
+    }}
+
+Un pragma en None no se aplica (p. ej. mmap_size sobre un sistema de archivos de red).
+
+journal_mode no va en cada conexión: queda guardado en el archivo y lo fija una sola vez la
+migración 0045 (y CapaSQLite y CacheSQLite en los archivos que crean). Si cada conexión lo
+pidiera, cualquier manage.py pasaría a WAL una base recién copiada y le dejaría los -wal/-shm.
+
+Con WAL los lectores no bloquean al escritor ni el escritor a los lectores: solo dos
+escrituras a la vez se esperan (hasta busy_timeout ms) en lugar de fallar con
+"database is locked".
+"""
+import re
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+PRAGMAS = {
+    'journal_mode': 'wal',
+    # En WAL, NORMAL no corrompe la base si se cae el proceso; solo puede perder la última
+    # transacción si se cae el sistema operativo
+    'synchronous': 'normal',
+    'busy_timeout': 5000,  # ms
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negativo = KiB
+    'temp_store': 'memory',
+}
+
+_NOMBRE = re.compile(r'^[a-z_]+$')
+_VALOR = re.compile(r'^-?\d+$|^[a-z_]+$', re.IGNORECASE)
+
+
+def aplicar_pragmas(conexion, pragmas):
+    """Ejecuta los pragmas en una conexión sqlite3 (no se pueden parametrizar: se validan)"""
+    for nombre, valor in pragmas.items():
+        if not _NOMBRE.match(nombre) or not _VALOR.match(str(valor)):
+            raise ImproperlyConfigured(f'Pragma de SQLite inválido: {nombre} = {valor!r}')
+        conexion.execute(f'PRAGMA {nombre} = {valor}')
+
+
+PRAGMAS_CONEXION = {nombre: valor for nombre, valor in PRAGMAS.items() if nombre != 'journal_mode'}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        parametros = super().get_connection_params()
+        # sqlite3.connect() no acepta opciones desconocidas
+        pragmas = {**PRAGMAS_CONEXION, **parametros.pop('pragmas', {})}
+        self.pragmas = {nombre: valor for nombre, valor in pragmas.items() if valor is not None}
+        return parametros
+
+    def get_new_connection(self, conn_params):
+        conexion = super().get_new_connection(conn_params)
+        aplicar_pragmas(conexion, self.pragmas)
+        return conexion
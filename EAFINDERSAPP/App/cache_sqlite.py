@@ -0,0 +1,161 @@
+"""
+Caché de Django sobre un archivo SQLite, compartida por todos los workers de la misma máquina:
+
+    CACHES = {'default': {
+        'BACKEND': 'App.cache_sqlite.CacheSQLite',
+        'LOCATION': BASE_DIR / 'cache.sqlite3',
+        'OPTIONS': {'MAX_ENTRIES': 200000},
+    }}
+
+A diferencia de FileBasedCache (un archivo por clave, y cada set lista el directorio entero para
+saber si hay que podar) y de DatabaseCache (un COUNT(*) y dos consultas por clave en cada set),
+get_many es un solo SELECT, set_many un solo executemany en una transacción y delete_many un solo
+DELETE. Las claves vencidas se barren cada `limpieza` segundos, y solo entonces se cuenta si hay
+más de MAX_ENTRIES (se borra 1/CULL_FREQUENCY, las que vencen antes).
+
+Cada hilo tiene su conexión (Django ya crea un backend por hilo) y la conserva entre peticiones.
+"""
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .backends.sqlite_wal.base import PRAGMAS, aplicar_pragmas
+
+ESQUEMA = '''
+    CREATE TABLE IF NOT EXISTS cache (
+        clave TEXT PRIMARY KEY,
+        valor BLOB NOT NULL,
+        expira REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS cache_expira ON cache (expira);
+'''
+NUNCA = float('inf')  # expira de las claves con timeout=None
+_MAX_PARAMETROS = 500  # Claves por IN (...)
+
+_conexiones = threading.local()  # ruta -> conexión de este hilo
+
+
+class CacheSQLite(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        opciones = params.get('OPTIONS', {})
+        self.ruta = str(location)
+        self.limpieza = opciones.get('LIMPIEZA', 60)
+        self.pragmas = {**PRAGMAS, **opciones.get('PRAGMAS', {})}
+        self._proxima_limpieza = 0
+
+    def _db(self):
+        por_ruta = getattr(_conexiones, 'por_ruta', None)
+        if por_ruta is None:
+            por_ruta = _conexiones.por_ruta = {}
+        conexion = por_ruta.get(self.ruta)
+        if conexion is None:
+            # isolation_level=None: cada sentencia se confirma sola salvo las transacciones a mano
+            conexion = sqlite3.connect(self.ruta, isolation_level=None)
+            aplicar_pragmas(conexion, {nombre: valor for nombre, valor in self.pragmas.items() if valor is not None})
+            conexion.executescript(ESQUEMA)
+            por_ruta[self.ruta] = conexion
+        return conexion
+
+    def _clave(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _expira(self, timeout):
+        expira = self.get_backend_timeout(timeout)
+        return NUNCA if expira is None else expira
+
+    def get(self, key, default=None, version=None):
+        fila = self._db().execute(
+            'SELECT valor FROM cache WHERE clave = ? AND expira > ?', (self._clave(key, version), time.time())
+        ).fetchone()
+        return default if fila is None else pickle.loads(fila[0])
+
+    def get_many(self, keys, version=None):
+        claves = {self._clave(key, version): key for key in keys}
+        resultado = {}
+        ahora = time.time()
+        lista = list(claves)
+        for inicio in range(0, len(lista), _MAX_PARAMETROS):
+            trozo = lista[inicio:inicio + _MAX_PARAMETROS]
+            filas = self._db().execute(
+                f'SELECT clave, valor FROM cache WHERE clave IN ({", ".join("?" * len(trozo))}) AND expira > ?',
+                (*trozo, ahora),
+            )
+            for clave, valor in filas:
+                resultado[claves[clave]] = pickle.loads(valor)
+        return resultado
+
+    def has_key(self, key, version=None):
+        return self._db().execute(
+            'SELECT 1 FROM cache WHERE clave = ? AND expira > ?', (self._clave(key, version), time.time())
+        ).fetchone() is not None
+
+    def _escribir(self, filas):
+        conexion = self._db()
+        conexion.execute('BEGIN IMMEDIATE')
+        try:
+            conexion.executemany('INSERT OR REPLACE INTO cache (clave, valor, expira) VALUES (?, ?, ?)', filas)
+            self._podar(conexion)
+        except BaseException:
+            conexion.execute('ROLLBACK')
+            raise
+        conexion.execute('COMMIT')
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expira = self._expira(timeout)
+        self._escribir([
+            (self._clave(key, version), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expira)
+            for key, value in data.items()
+        ])
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Solo pisa una fila vencida
+        cursor = self._db().execute(
+            'INSERT INTO cache (clave, valor, expira) VALUES (?, ?, ?) '
+            'ON CONFLICT (clave) DO UPDATE SET valor = excluded.valor, expira = excluded.expira '
+            'WHERE cache.expira <= ?',
+            (self._clave(key, version), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._expira(timeout), time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        cursor = self._db().execute(
+            'UPDATE cache SET expira = ? WHERE clave = ? AND expira > ?',
+            (self._expira(timeout), self._clave(key, version), time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        return self._db().execute('DELETE FROM cache WHERE clave = ?', (self._clave(key, version),)).rowcount > 0
+
+    def delete_many(self, keys, version=None):
+        lista = [self._clave(key, version) for key in keys]
+        for inicio in range(0, len(lista), _MAX_PARAMETROS):
+            trozo = lista[inicio:inicio + _MAX_PARAMETROS]
+            self._db().execute(f'DELETE FROM cache WHERE clave IN ({", ".join("?" * len(trozo))})', trozo)
+
+    def clear(self):
+        self._db().execute('DELETE FROM cache')
+
+    def _podar(self, conexion):
+        """Dentro de la transacción de un set: de vez en cuando barre lo vencido y el exceso"""
+        ahora = time.time()
+        if ahora < self._proxima_limpieza:
+            return
+        self._proxima_limpieza = ahora + self.limpieza
+        conexion.execute('DELETE FROM cache WHERE expira <= ?', (ahora,))
+        total = conexion.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if total > self._max_entries:
+            conexion.execute(
+                'DELETE FROM cache WHERE clave IN (SELECT clave FROM cache ORDER BY expira LIMIT ?)',
+                (total // self._cull_frequency if self._cull_frequency else total,),
+            )
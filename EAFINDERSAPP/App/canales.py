@@ -0,0 +1,310 @@
+"""
+Capa de Channels sobre un archivo SQLite, para que varios workers ASGI de la misma máquina se
+manden mensajes sin Redis:
+
+    CHANNEL_LAYERS = {'default': {
+        'BACKEND': 'App.canales.CapaSQLite',
+        'CONFIG': {'ruta': BASE_DIR / 'canales.sqlite3', 'expiry': 60, 'capacity': 100},
+    }}
+
+Cada mensaje es una fila (en JSON) que se borra al recibirla; los grupos son otra tabla de
+(grupo, canal). expiry, capacity, channel_capacity y group_expiry funcionan como en la capa en
+memoria de Channels: un mensaje vencido se descarta y su canal sale de los grupos, y send() a un
+canal lleno lanza ChannelFull (group_send se lo salta).
+
+Los canales de new_channel() llevan el prefijo del proceso ('specific.<proceso>!<canal>'): una
+sola tarea por proceso lee los mensajes de todos ellos y los reparte, y mil consumidores no hacen
+mil consultas. Entre procesos no hay aviso: se consulta cada `intervalo` segundos, duplicando la
+espera mientras no llega nada hasta `intervalo_maximo`. Dentro del mismo proceso send() despierta
+al que recibe enseguida.
+
+Las consultas van por un solo hilo por proceso, con su conexión: SQLite escribe de a uno y así
+ninguna espera bloquea el event loop.
+"""
+import asyncio
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from .backends.sqlite_wal.base import PRAGMAS, aplicar_pragmas
+
+ESQUEMA = '''
+    CREATE TABLE IF NOT EXISTS mensaje (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        canal TEXT NOT NULL,
+        destino TEXT NOT NULL,  -- El canal, o 'specific.<proceso>!' si es de un proceso
+        expira REAL NOT NULL,
+        datos TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS mensaje_destino ON mensaje (destino, id);
+    CREATE INDEX IF NOT EXISTS mensaje_canal ON mensaje (canal, expira);  -- capacity
+    CREATE INDEX IF NOT EXISTS mensaje_expira ON mensaje (expira);
+    CREATE TABLE IF NOT EXISTS grupo (
+        grupo TEXT NOT NULL,
+        canal TEXT NOT NULL,
+        destino TEXT NOT NULL,
+        expira REAL NOT NULL,
+        PRIMARY KEY (grupo, canal)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS grupo_canal ON grupo (canal);
+'''
+
+
+class _Cola:
+    """Mensajes ya leídos de un canal de este proceso, hasta que alguien los reciba"""
+    __slots__ = ('mensajes', 'receptores', 'aviso')
+
+    def __init__(self):
+        self.mensajes = deque()  # (expira, mensaje)
+        self.receptores = 0
+        self.aviso = asyncio.Event()
+
+
+class CapaSQLite(BaseChannelLayer):
+    extensions = ['groups', 'flush']
+
+    def __init__(self, ruta, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 intervalo=0.005, intervalo_maximo=0.1, lote=500, limpieza=5.0, pragmas=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.ruta = str(ruta)
+        self.group_expiry = group_expiry
+        self.intervalo = intervalo
+        self.intervalo_maximo = intervalo_maximo
+        self.lote = lote  # Mensajes que el lector del proceso saca por consulta
+        self.limpieza = limpieza  # Segundos entre barridas de mensajes y grupos vencidos
+        self.pragmas = {**PRAGMAS, **(pragmas or {})}
+        self.proceso = secrets.token_hex(6)
+
+        self._hilo = ThreadPoolExecutor(max_workers=1, thread_name_prefix='canales')
+        self._conexion = None
+        self._proxima_limpieza = 0.0
+        self._lock = threading.Lock()
+        self._avisos = set()  # (loop, asyncio.Event) de los que esperan en este proceso
+        self._colas = {}  # canal del proceso -> _Cola
+        self._lector = None
+
+    # Base de datos (siempre en self._hilo)
+
+    def _db(self):
+        if self._conexion is None:
+            # isolation_level=None: las transacciones se abren a mano
+            self._conexion = sqlite3.connect(self.ruta, isolation_level=None, check_same_thread=False)
+            aplicar_pragmas(self._conexion, {nombre: valor for nombre, valor in self.pragmas.items() if valor is not None})
+            self._conexion.executescript(ESQUEMA)
+        return self._conexion
+
+    def _transaccion(self, funcion, *args):
+        conexion = self._db()
+        conexion.execute('BEGIN IMMEDIATE')
+        try:
+            resultado = funcion(conexion, *args)
+        except BaseException:
+            conexion.execute('ROLLBACK')
+            raise
+        conexion.execute('COMMIT')
+        return resultado
+
+    async def _en_hilo(self, funcion, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._hilo, funcion, *args)
+
+    async def _ejecutar(self, funcion, *args):
+        return await self._en_hilo(self._transaccion, funcion, *args)
+
+    def _limpiar(self, conexion, ahora):
+        if ahora < self._proxima_limpieza:
+            return
+        self._proxima_limpieza = ahora + self.limpieza
+        conexion.execute(
+            'DELETE FROM grupo WHERE expira < ? OR canal IN (SELECT canal FROM mensaje WHERE expira < ?)',
+            (ahora, ahora),
+        )
+        conexion.execute('DELETE FROM mensaje WHERE expira < ?', (ahora,))
+
+    def _insertar(self, conexion, canales, datos, estricto):
+        """Mete el mensaje en cada canal [(canal, destino, pendientes)] con lugar; devuelve cuántos"""
+        ahora = time.time()
+        filas = []
+        for canal, destino, pendientes in canales:
+            if pendientes >= self.get_capacity(canal):
+                if estricto:
+                    raise ChannelFull(canal)
+                continue
+            filas.append((canal, destino, ahora + self.expiry, datos))
+        conexion.executemany('INSERT INTO mensaje (canal, destino, expira, datos) VALUES (?, ?, ?, ?)', filas)
+        self._limpiar(conexion, ahora)
+        return len(filas)
+
+    def _enviar(self, conexion, canal, datos):
+        pendientes = conexion.execute(
+            'SELECT COUNT(*) FROM mensaje WHERE canal = ? AND expira >= ?', (canal, time.time())
+        ).fetchone()[0]
+        return self._insertar(conexion, [(canal, self.non_local_name(canal), pendientes)], datos, True)
+
+    def _enviar_grupo(self, conexion, grupo, datos):
+        ahora = time.time()
+        canales = conexion.execute(
+            'SELECT g.canal, g.destino, (SELECT COUNT(*) FROM mensaje m WHERE m.canal = g.canal AND m.expira >= ?) '
+            'FROM grupo g WHERE g.grupo = ? AND g.expira >= ?',
+            (ahora, grupo, ahora),
+        ).fetchall()
+        return self._insertar(conexion, canales, datos, False)
+
+    def _tomar(self, conexion, destino, cantidad):
+        """Saca los primeros mensajes del destino; los vencidos se descartan y su canal sale de los grupos"""
+        filas = sorted(conexion.execute(
+            'DELETE FROM mensaje WHERE id IN (SELECT id FROM mensaje WHERE destino = ? ORDER BY id LIMIT ?) '
+            'RETURNING id, canal, expira, datos',
+            (destino, cantidad),
+        ).fetchall())
+        ahora = time.time()
+        vencidos = {canal for _, canal, expira, _ in filas if expira < ahora}
+        if vencidos:
+            conexion.executemany('DELETE FROM grupo WHERE canal = ?', [(canal,) for canal in vencidos])
+        return [(canal, expira, json.loads(datos)) for _, canal, expira, datos in filas if expira >= ahora]
+
+    def _recoger(self, destino, cantidad):
+        # Mirar sin bloquear la base: la escritura (y su lock) solo si hay algo que sacar
+        if self._db().execute('SELECT 1 FROM mensaje WHERE destino = ? LIMIT 1', (destino,)).fetchone() is None:
+            return []
+        return self._transaccion(self._tomar, destino, cantidad)
+
+    # Avisos dentro del proceso
+
+    def _avisar(self):
+        with self._lock:
+            avisos = list(self._avisos)
+        for loop, evento in avisos:
+            try:
+                loop.call_soon_threadsafe(evento.set)
+            except RuntimeError:  # Ese loop ya se cerró
+                pass
+
+    async def _dormir(self, espera):
+        """Espera `espera` segundos o hasta que alguien de este proceso envíe algo"""
+        evento = asyncio.Event()
+        aviso = (asyncio.get_running_loop(), evento)
+        with self._lock:
+            self._avisos.add(aviso)
+        try:
+            await asyncio.wait_for(evento.wait(), espera)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._avisos.discard(aviso)
+
+    def _es_propio(self, canal):
+        return '!' in canal and self.non_local_name(canal) == self._prefijo()
+
+    def _prefijo(self, prefix='specific.'):
+        return f'{prefix}{self.proceso}!'
+
+    # API de Channels
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+        await self._ejecutar(self._enviar, channel, json.dumps(message, separators=(',', ':')))
+        self._avisar()
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        if self._es_propio(channel):
+            return await self._recibir_propio(channel)
+        espera = self.intervalo
+        while True:
+            mensajes = await self._en_hilo(self._recoger, channel, 1)
+            if mensajes:
+                return mensajes[0][2]
+            await self._dormir(espera)
+            espera = min(espera * 2, self.intervalo_maximo)
+
+    async def _recibir_propio(self, channel):
+        cola = self._colas.setdefault(channel, _Cola())
+        cola.receptores += 1
+        loop = asyncio.get_running_loop()
+        if self._lector is None or self._lector.done() or self._lector.get_loop() is not loop:
+            self._lector = loop.create_task(self._leer_proceso())
+        try:
+            while True:
+                while cola.mensajes:
+                    expira, mensaje = cola.mensajes.popleft()
+                    if expira >= time.time():
+                        return mensaje
+                cola.aviso.clear()
+                await cola.aviso.wait()
+        finally:
+            cola.receptores -= 1
+            if not cola.receptores and not cola.mensajes:
+                self._colas.pop(channel, None)
+
+    async def _leer_proceso(self):
+        """Reparte los mensajes de los canales de este proceso mientras haya a quién"""
+        espera = self.intervalo
+        while self._colas:
+            mensajes = await self._en_hilo(self._recoger, self._prefijo(), self.lote)
+            for canal, expira, mensaje in mensajes:
+                cola = self._colas.setdefault(canal, _Cola())
+                cola.mensajes.append((expira, mensaje))
+                cola.aviso.set()
+            # Lo de un canal que nadie está recibiendo se guarda hasta que vence
+            ahora = time.time()
+            for canal, cola in list(self._colas.items()):
+                if not cola.receptores:
+                    while cola.mensajes and cola.mensajes[0][0] < ahora:
+                        cola.mensajes.popleft()
+                    if not cola.mensajes:
+                        del self._colas[canal]
+            if len(mensajes) == self.lote:
+                continue
+            if mensajes:
+                espera = self.intervalo
+            await self._dormir(espera)
+            espera = min(espera * 2, self.intervalo_maximo)
+
+    async def new_channel(self, prefix='specific.'):
+        return self._prefijo(prefix) + secrets.token_hex(6)
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._ejecutar(lambda conexion: conexion.execute(
+            'INSERT OR REPLACE INTO grupo (grupo, canal, destino, expira) VALUES (?, ?, ?, ?)',
+            (group, channel, self.non_local_name(channel), time.time() + self.group_expiry),
+        ))
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        await self._ejecutar(lambda conexion: conexion.execute(
+            'DELETE FROM grupo WHERE grupo = ? AND canal = ?', (group, channel),
+        ))
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        self.require_valid_group_name(group)
+        await self._ejecutar(self._enviar_grupo, group, json.dumps(message, separators=(',', ':')))
+        self._avisar()
+
+    async def flush(self):
+        def vaciar(conexion):
+            conexion.execute('DELETE FROM mensaje')
+            conexion.execute('DELETE FROM grupo')
+        await self._ejecutar(vaciar)
+        self._colas.clear()
+
+    async def close(self):
+        def cerrar():
+            if self._conexion is not None:
+                self._conexion.close()
+                self._conexion = None
+        await self._en_hilo(cerrar)
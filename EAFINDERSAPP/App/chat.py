@@ -0,0 +1,118 @@
+"""
+Formato compacto de los mensajes del chat (obtener_mensajes y la bandeja):
+
+    {"participantes": {"12": "Ana", "34": "Ana"},
+     "mensajes": [[id, remitente_id, fecha_epoch, contenido], ...],
+     "ultimo": id}
+
+Los nombres van una sola vez en la cabecera y cada mensaje dice quién lo envió por id (dos
+usuarios pueden llamarse igual). Las fechas son segundos epoch (UTC). Con `?desde=<id>` solo van
+los mensajes posteriores y sin cabecera: el cliente ya la tiene. Si el cliente lo prefiere en
+su Accept y msgpack está instalado, la respuesta va en MessagePack con la misma estructura.
+"""
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .models import Mensaje
+from .shards import shard_de
+
+try:
+    import msgpack
+except ImportError:  # Dependencia opcional: sin ella todo va en JSON
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
+# Conversaciones por consulta de la bandeja y mensajes por shard en cada respuesta (el resto
+# llega en la siguiente, desde el último que se mandó)
+BANDEJA_MAX_CONVERSACIONES = getattr(settings, 'BANDEJA_MAX_CONVERSACIONES', 100)
+BANDEJA_MAX_MENSAJES = getattr(settings, 'BANDEJA_MAX_MENSAJES', 500)
+
+
+def filas(mensajes):
+    """[[id, remitente_id, fecha_epoch, contenido], ...] de un queryset de Mensaje"""
+    return [
+        [mensaje_id, remitente_id, int(fecha.timestamp()), contenido]
+        for mensaje_id, remitente_id, fecha, contenido
+        in mensajes.values_list('id', 'remitente_id', 'fecha_enviado', 'contenido')
+    ]
+
+
+def paquete(mensajes, participantes=None, desde=0):
+    """`participantes` ({id: nombre}) solo en la carga completa; `ultimo` sirve de próximo `desde`"""
+    datos = {}
+    if participantes is not None:
+        datos['participantes'] = {str(usuario_id): nombre for usuario_id, nombre in participantes.items()}
+    datos['mensajes'] = mensajes
+    datos['ultimo'] = mensajes[-1][0] if mensajes else desde
+    return datos
+
+
+def _por_shard(usuario_id, amigos):
+    grupos = defaultdict(list)
+    for amigo in amigos:
+        grupos[shard_de(usuario_id, amigo)].append(amigo)
+    return grupos.items()
+
+
+def novedades(usuario_id, desde):
+    """
+    Bandeja: de {amigo_id: último id visto} a {amigo_id: {'mensajes': filas, 'no_leidos': n,
+    'ultimo': id}} solo de las conversaciones con mensajes nuevos. Una consulta por shard, por
+    el índice (remitente, destinatario, id); `no_leidos` cuenta los nuevos que mandó el amigo.
+    """
+    resultado = {}
+    for alias, amigos in _por_shard(usuario_id, desde):
+        filtro = Q()
+        for amigo in amigos:
+            filtro |= Q(remitente_id=usuario_id, destinatario_id=amigo, id__gt=desde[amigo])
+            filtro |= Q(remitente_id=amigo, destinatario_id=usuario_id, id__gt=desde[amigo])
+        nuevos = (
+            Mensaje.objects.using(alias).filter(filtro).order_by('id')
+            .values_list('id', 'remitente_id', 'destinatario_id', 'fecha_enviado', 'contenido')
+            [:BANDEJA_MAX_MENSAJES]
+        )
+        for mensaje_id, remitente_id, destinatario_id, fecha, contenido in nuevos:
+            amigo = destinatario_id if remitente_id == usuario_id else remitente_id
+            conversacion = resultado.setdefault(amigo, {'mensajes': [], 'no_leidos': 0})
+            conversacion['mensajes'].append([mensaje_id, remitente_id, int(fecha.timestamp()), contenido])
+            conversacion['no_leidos'] += remitente_id != usuario_id
+    for conversacion in resultado.values():
+        conversacion['ultimo'] = conversacion['mensajes'][-1][0]
+    return resultado
+
+
+def ultimos(usuario_id, amigos):
+    """{amigo_id: id del último mensaje} de las conversaciones con mensajes; una consulta por shard"""
+    resultado = {}
+    for alias, ids in _por_shard(usuario_id, amigos):
+        por_par = (
+            Mensaje.objects.using(alias)
+            .filter(Q(remitente_id=usuario_id, destinatario_id__in=ids) | Q(remitente_id__in=ids, destinatario_id=usuario_id))
+            .values('remitente_id', 'destinatario_id').annotate(ultimo=Max('id')).order_by()
+            .values_list('remitente_id', 'destinatario_id', 'ultimo')
+        )
+        for remitente_id, destinatario_id, ultimo in por_par:
+            amigo = destinatario_id if remitente_id == usuario_id else remitente_id
+            resultado[amigo] = max(resultado.get(amigo, 0), ultimo)
+    return resultado
+
+
+def responder(request, datos):
+    """JSON por defecto; MessagePack si el cliente lo prefiere (Accept) y está instalado"""
+    tipos = [JSON, MSGPACK] if msgpack else [JSON]
+    if request.get_preferred_type(tipos) == MSGPACK:
+        response = HttpResponse(msgpack.packb(datos, use_bin_type=True), content_type=MSGPACK)
+    else:
+        response = HttpResponse(
+            json.dumps(datos, ensure_ascii=False, separators=(',', ':')),
+            content_type=JSON,
+        )
+    patch_vary_headers(response, ('Accept',))
+    return response
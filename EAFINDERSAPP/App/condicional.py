@@ -0,0 +1,67 @@
+"""
+GET condicional para las páginas HTML: cada vista da una función que calcula, con una o dos
+consultas baratas (fechas de actualización, conteos), de qué depende la página. Con eso y lo
+propio de quien la pide (usuario, navbar, token CSRF) se arma un ETag débil sin renderizar, y
+si el navegador ya tiene esa versión se responde 304.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from .context_processors import solicitudes_pendientes
+
+# max-age de las páginas para usuarios anónimos, que un proxy inverso puede compartir (Vary: Cookie)
+PAGINAS_PUBLICAS_MAX_AGE = getattr(settings, 'PAGINAS_PUBLICAS_MAX_AGE', 30)
+
+
+def _etag(request, version):
+    if get_messages(request):
+        # Los mensajes flash pendientes solo salen si se renderiza
+        return None
+    usuario = request.user
+    partes = [version]
+    if usuario.is_authenticated:
+        # Con sesión la página lleva el token CSRF: get_token crea el secreto si todavía no hay
+        # cookie, para que el ETag no cambie cuando llegue. La navbar: nombre, foto y solicitudes
+        get_token(request)
+        partes += [
+            request.META['CSRF_COOKIE'], usuario.pk, usuario.fecha_actualizacion, solicitudes_pendientes(request),
+        ]
+    return 'W/"%s"' % hashlib.blake2b(repr(partes).encode(), digest_size=12).hexdigest()
+
+
+def _cabeceras(request, response):
+    if request.user.is_authenticated:
+        # Se puede guardar pero se revalida siempre; los proxies no la comparten
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=PAGINAS_PUBLICAS_MAX_AGE)
+    patch_vary_headers(response, ('Cookie',))
+
+
+def condicional(version):
+    """
+    Decorador de vistas: `version(request, *args, **kwargs)` devuelve algo comparable que cambia
+    cuando cambia la página (None si no existe: la vista responde lo que corresponda, p. ej. 404).
+    En vistas de clase: method_decorator(condicional(...), name='get').
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return vista(request, *args, **kwargs)
+            valor = version(request, *args, **kwargs)
+            etag = None if valor is None else _etag(request, valor)
+            response = etag and get_conditional_response(request, etag=etag)
+            if response is None:
+                response = vista(request, *args, **kwargs)
+            if etag and response.status_code in (200, 304) and not response.has_header('ETag'):
+                response['ETag'] = etag
+            _cabeceras(request, response)
+            return response
+        return envoltura
+    return decorador
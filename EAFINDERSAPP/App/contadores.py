@@ -0,0 +1,97 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Case, F, Value, When
+
+logger = logging.getLogger(__name__)
+
+
+class ContadorVistas:
+    """
+    Acumula en memoria las vistas de cada foro y las escribe por lotes.
+
+    Un UPDATE por visita serializa las escrituras en SQLite; aquí cada proceso suma las
+    vistas en un Counter y las vuelca con un solo UPDATE ... CASE cuando se acumulan demasiadas
+    o, a más tardar, `intervalo` segundos después de la primera pendiente: un temporizador las
+    vuelca aunque no lleguen más visitas (None: solo por cantidad). Si el proceso muere se
+    pierden como mucho las pendientes.
+    """
+
+    def __init__(self, intervalo=10, maximo=500, lote=500):
+        self.intervalo = intervalo
+        self.maximo = maximo
+        self.lote = lote
+        self._pendientes = Counter()
+        self._total = 0
+        self._lock = threading.Lock()
+        self._temporizador = None
+
+    def incrementar(self, foro_id, cantidad=1):
+        with self._lock:
+            self._pendientes[foro_id] += cantidad
+            self._total += cantidad
+            debe_volcar = self._total >= self.maximo
+            if not debe_volcar:
+                self._programar()
+        if debe_volcar:
+            self.volcar()
+
+    def _programar(self):
+        """Con el lock tomado: arranca el temporizador si no hay uno corriendo"""
+        if self._temporizador is None and self.intervalo is not None:
+            self._temporizador = threading.Timer(self.intervalo, self._vencer)
+            self._temporizador.daemon = True
+            self._temporizador.start()
+
+    def _vencer(self):
+        with self._lock:
+            self._temporizador = None
+        try:
+            self.volcar()
+        finally:
+            connection.close()  # La conexión es de este hilo, que termina aquí
+        with self._lock:
+            if self._pendientes:  # Las de un volcado fallido o las que llegaron mientras tanto
+                self._programar()
+
+    def pendientes(self, foro_id):
+        """Vistas de foro_id que todavía no están en la base de datos"""
+        with self._lock:
+            return self._pendientes.get(foro_id, 0)
+
+    def volcar(self):
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, Counter()
+            self._total = 0
+        if not pendientes:
+            return
+
+        from .models import Foro, Version
+
+        items = list(pendientes.items())
+        try:
+            with transaction.atomic():
+                for i in range(0, len(items), self.lote):
+                    grupo = items[i:i + self.lote]
+                    incremento = Case(*[When(id=foro_id, then=Value(n)) for foro_id, n in grupo])
+                    Foro.objects.filter(id__in=[foro_id for foro_id, _ in grupo]).update(
+                        vistas=F('vistas') + incremento
+                    )
+                Version.subir('foros')  # La lista de foros muestra las vistas
+        except DatabaseError:
+            # Se devuelven al buffer para el siguiente intento en lugar de perderlas
+            logger.exception('No se pudieron volcar las vistas de %d foros', len(items))
+            with self._lock:
+                self._pendientes.update(pendientes)
+                self._total += sum(pendientes.values())
+
+
+vistas_foro = ContadorVistas(
+    intervalo=getattr(settings, 'FORO_VISTAS_INTERVALO', 10),
+    maximo=getattr(settings, 'FORO_VISTAS_MAXIMO', 500),
+)
+atexit.register(vistas_foro.volcar)
@@ -1,14 +1,20 @@
 from .models import Amistad  # Asegúrate de que la importación es correcta
 
-def notificaciones(request):
-    if request.user.is_authenticated:
-        # Solo solicitudes de amistad pendientes
-        solicitudes_pendientes = Amistad.objects.filter(
+
+def solicitudes_pendientes(request):
+    """Cuenta de la navbar; se guarda en el request porque también entra en los ETag"""
+    if not hasattr(request, '_solicitudes_pendientes'):
+        request._solicitudes_pendientes = Amistad.objects.filter(
             user2=request.user,
             estado='pendiente'
         ).count()
-        
+    return request._solicitudes_pendientes
+
+
+def notificaciones(request):
+    if request.user.is_authenticated:
+        # Solo solicitudes de amistad pendientes
         return {
-            'solicitudes_pendientes': solicitudes_pendientes,
+            'solicitudes_pendientes': solicitudes_pendientes(request),
         }
     return {}
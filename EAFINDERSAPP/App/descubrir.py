@@ -0,0 +1,74 @@
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+
+from .metricas import registrar_cache
+from .models import Usuario
+from .perfiles import obtener_tarjetas
+
+POR_PAGINA = getattr(settings, 'DESCUBRIR_POR_PAGINA', 24)
+# Candidatos sorteados por cada usuario pedido en el modo aleatorio (cubre los ids borrados)
+SOBREMUESTREO = 3
+INTENTOS = 3
+
+_CACHE_MAX_ID = 'descubrir:max_id'
+
+
+def _usuarios(excluir_id):
+    usuarios = Usuario.objects.all()
+    if excluir_id is not None:
+        usuarios = usuarios.exclude(id=excluir_id)
+    return usuarios
+
+
+def pagina(excluir_id=None, cursor=None, limite=POR_PAGINA):
+    """
+    Usuarios del más reciente al más antiguo, de a `limite`. Pagina por id (el cursor es el
+    último id de la página anterior) en lugar de OFFSET, así que cualquier página cuesta lo mismo.
+    La consulta solo lee ids; lo que se muestra sale de las tarjetas de perfil.
+    Devuelve (tarjetas, siguiente_cursor).
+    """
+    usuarios = _usuarios(excluir_id)
+    try:
+        usuarios = usuarios.filter(id__lt=int(cursor)) if cursor else usuarios
+    except ValueError:
+        pass  # Un cursor inválido vuelve al principio
+    ids = list(usuarios.order_by('-id').values_list('id', flat=True)[:limite + 1])
+    siguiente = str(ids[limite - 1]) if len(ids) > limite else None
+    return list(obtener_tarjetas(ids[:limite]).values()), siguiente
+
+
+def max_id():
+    """El id más alto de Usuario, cacheado unos minutos (los recién registrados tardan en salir)"""
+    valor = cache.get(_CACHE_MAX_ID)
+    registrar_cache('descubrir_max_id', valor is not None)
+    if valor is None:
+        valor = Usuario.objects.aggregate(maximo=Max('id'))['maximo'] or 0
+        cache.set(_CACHE_MAX_ID, valor, 300)
+    return valor
+
+
+def muestra(excluir_id=None, cantidad=POR_PAGINA, rng=random):
+    """
+    `cantidad` usuarios al azar sin ORDER BY RANDOM() (que ordena la tabla entera): se sortean
+    ids entre 1 y el máximo y se buscan con id__in sobre la clave primaria. Los huecos de ids
+    borrados se cubren sorteando de más y, si no alcanza, con otra ronda.
+    """
+    tope = max_id()
+    usuarios = _usuarios(excluir_id)
+    if tope <= cantidad * SOBREMUESTREO:
+        # Tabla chica: sale más barato traer todos los ids
+        encontrados = list(usuarios.values_list('id', flat=True))
+    else:
+        encontrados, probados = [], set()
+        for _ in range(INTENTOS):
+            candidatos = {rng.randint(1, tope) for _ in range((cantidad - len(encontrados)) * SOBREMUESTREO)}
+            candidatos -= probados
+            probados |= candidatos
+            encontrados += usuarios.filter(id__in=candidatos).values_list('id', flat=True)
+            if len(encontrados) >= cantidad:
+                break
+    ids = rng.sample(encontrados, min(cantidad, len(encontrados)))
+    return list(obtener_tarjetas(ids).values())
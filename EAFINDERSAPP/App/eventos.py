@@ -0,0 +1,210 @@
+"""
+Eventos en vivo para el long-poll (vista esperar_eventos): mensajes nuevos y solicitudes de
+amistad. El código síncrono (signals, observers) publica en el buzón del proceso y las peticiones
+async esperan en un future del event loop: miles de clientes parados no ocupan hilos ni
+conexiones a la base.
+
+El cursor es '<proceso>:<secuencia>'. Cada proceso numera sus eventos y recuerda los últimos de
+cada usuario; si el cursor es de otro proceso (otro worker, o uno reiniciado) o ya se olvidaron
+eventos posteriores a él, la respuesta dice al_dia=False y el cliente se pone al día con las
+vistas normales (la bandeja, notificaciones). Los eventos son avisos, no los datos.
+
+Con varios workers ASGI, LONGPOLL_CAPA (un alias de CHANNEL_LAYERS, p. ej. la capa SQLite de
+App/canales.py) lleva cada evento a todos: se publica en el grupo 'eventos' y en cada proceso una
+tarea, que arranca con la primera espera, lo pasa a su buzón.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Segundos que espera una petición sin novedades; eventos recordados por usuario y usuarios con
+# eventos recordados en cada proceso
+LONGPOLL_SEGUNDOS = getattr(settings, 'LONGPOLL_SEGUNDOS', 25)
+LONGPOLL_RECIENTES = getattr(settings, 'LONGPOLL_RECIENTES', 50)
+LONGPOLL_USUARIOS = getattr(settings, 'LONGPOLL_USUARIOS', 10000)
+# Alias de CHANNEL_LAYERS que reparte los eventos entre procesos (None: cada uno los suyos)
+LONGPOLL_CAPA = getattr(settings, 'LONGPOLL_CAPA', None)
+# Cada cuánto consulta igual el cliente; sin capa es lo que tarda un evento de otro worker
+LONGPOLL_RESPALDO_SEGUNDOS = getattr(settings, 'LONGPOLL_RESPALDO_SEGUNDOS', 30 if LONGPOLL_CAPA else 2)
+GRUPO = 'eventos'
+
+
+def _despertar(futuro):
+    if not futuro.done():
+        futuro.set_result(None)
+
+
+class Buzon:
+    """Eventos de cada usuario en este proceso. publicar() se puede llamar desde cualquier hilo."""
+
+    def __init__(self, recientes=LONGPOLL_RECIENTES, usuarios=LONGPOLL_USUARIOS):
+        self.proceso = uuid.uuid4().hex[:8]
+        self.recientes = recientes
+        self.usuarios = usuarios
+        self._lock = threading.Lock()
+        self._secuencia = 0
+        # usuario_id -> [secuencia del último evento descartado, deque de (secuencia, evento)]; el
+        # usuario que hace más tiempo no recibe nada primero
+        self._eventos = OrderedDict()
+        self._desalojado = 0  # Último evento de los usuarios que se sacaron enteros
+        self._esperando = {}  # usuario_id -> {(loop, futuro)}
+
+    def cursor(self, secuencia=None):
+        return f'{self.proceso}:{self._secuencia if secuencia is None else secuencia}'
+
+    def publicar(self, usuario_id, evento):
+        with self._lock:
+            self._secuencia += 1
+            registro = self._eventos.pop(usuario_id, None) or [self._desalojado, deque()]
+            cola = registro[1]
+            if len(cola) == self.recientes:
+                registro[0] = cola.popleft()[0]
+            cola.append((self._secuencia, evento))
+            self._eventos[usuario_id] = registro
+            if len(self._eventos) > self.usuarios:
+                self._desalojado = self._eventos.popitem(last=False)[1][1][-1][0]
+            esperando = self._esperando.pop(usuario_id, ())
+        for loop, futuro in esperando:
+            try:
+                loop.call_soon_threadsafe(_despertar, futuro)
+            except RuntimeError:  # El loop de esa petición ya se cerró
+                pass
+
+    def _leer(self, usuario_id, cursor):
+        """(eventos posteriores al cursor, al_dia); al_dia=False si hubo que adivinar"""
+        proceso, _, secuencia = (cursor or '').partition(':')
+        try:
+            secuencia = int(secuencia)
+        except ValueError:
+            return [], False
+        if proceso != self.proceso:
+            return [], False
+        olvidado, cola = self._eventos.get(usuario_id, (self._desalojado, ()))
+        return [(numero, evento) for numero, evento in cola if numero > secuencia], olvidado <= secuencia
+
+    def _respuesta(self, usuario_id, cursor):
+        eventos, al_dia = self._leer(usuario_id, cursor)
+        if not al_dia:
+            return {'cursor': self.cursor(), 'eventos': [], 'al_dia': False}
+        siguiente = eventos[-1][0] if eventos else int(cursor.partition(':')[2])
+        return {'cursor': self.cursor(siguiente), 'eventos': [evento for _, evento in eventos], 'al_dia': True}
+
+    async def esperar(self, usuario_id, cursor, segundos=None):
+        """
+        {'cursor', 'eventos', 'al_dia'} con lo posterior al cursor. Si no hay nada espera hasta
+        `segundos` (LONGPOLL_SEGUNDOS) a que llegue algo; si no llegó, eventos vacío. Sin cursor
+        responde enseguida con el actual.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not cursor:
+                return {'cursor': self.cursor(), 'eventos': [], 'al_dia': True}
+            respuesta = self._respuesta(usuario_id, cursor)
+            if respuesta['eventos'] or not respuesta['al_dia']:
+                return respuesta
+            espera = (loop, loop.create_future())
+            self._esperando.setdefault(usuario_id, set()).add(espera)
+        try:
+            await asyncio.wait_for(espera[1], LONGPOLL_SEGUNDOS if segundos is None else segundos)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                esperas = self._esperando.get(usuario_id)
+                if esperas is not None:
+                    esperas.discard(espera)
+                    if not esperas:
+                        del self._esperando[usuario_id]
+        with self._lock:
+            return self._respuesta(usuario_id, cursor)
+
+    def esperando(self):
+        """Peticiones paradas en este momento"""
+        with self._lock:
+            return sum(len(esperas) for esperas in self._esperando.values())
+
+
+buzon = Buzon()
+
+
+def soltar_conexiones():
+    """
+    Cierra las conexiones que abrió la petición (la sesión, el usuario) antes de ponerse a
+    esperar; las que están dentro de una transacción se dejan.
+    """
+    for conexion in connections.all(initialized_only=True):
+        if not conexion.in_atomic_block:
+            conexion.close()
+
+
+def capa():
+    return None if LONGPOLL_CAPA is None else get_channel_layer(LONGPOLL_CAPA)
+
+
+def entregar(usuarios, evento):
+    """A los buzones de todos los procesos si hay capa, si no al de este"""
+    canales = capa()
+    if canales is not None:
+        try:
+            async_to_sync(canales.group_send)(GRUPO, {'type': 'eventos', 'usuarios': list(usuarios), 'evento': evento})
+            return
+        except Exception:
+            logger.exception('No se pudo repartir el evento; solo llega a este proceso')
+    for usuario_id in usuarios:
+        buzon.publicar(usuario_id, evento)
+
+
+def publicar(usuarios, evento, using=None):
+    """Publica el evento a cada usuario cuando se confirme la transacción (ya se puede leer)"""
+    transaction.on_commit(lambda: entregar(usuarios, evento), using=using)
+
+
+_escucha = None  # (tarea, future que se cumple cuando ya está en el grupo)
+
+
+async def escuchar():
+    """Arranca (una vez por proceso y event loop) la tarea que recibe los eventos de la capa"""
+    global _escucha
+    canales = capa()
+    if canales is None:
+        return
+    loop = asyncio.get_running_loop()
+    if _escucha is None or _escucha[0].done() or _escucha[0].get_loop() is not loop:
+        listo = loop.create_future()
+        _escucha = (loop.create_task(_recibir(canales, listo)), listo)
+    try:
+        await asyncio.shield(_escucha[1])
+    except Exception:
+        logger.exception('No se pudo escuchar la capa de canales; solo llegan los eventos de este proceso')
+
+
+async def _recibir(canales, listo):
+    try:
+        canal = await canales.new_channel()
+        await canales.group_add(GRUPO, canal)
+    except Exception as error:
+        listo.set_exception(error)
+        return
+    listo.set_result(canal)
+    # La pertenencia al grupo vence (group_expiry): se renueva a la mitad
+    renovar = getattr(canales, 'group_expiry', 86400) / 2
+    hasta = time.monotonic() + renovar
+    while True:
+        try:
+            mensaje = await asyncio.wait_for(canales.receive(canal), max(hasta - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            await canales.group_add(GRUPO, canal)
+            hasta = time.monotonic() + renovar
+            continue
+        for usuario_id in mensaje['usuarios']:
+            buzon.publicar(usuario_id, mensaje['evento'])
@@ -0,0 +1,129 @@
+import base64
+import heapq
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Actividad, Amistad, FeedItem
+
+# Usuarios con más amigos que esto no hacen fan-out al escribir: la actividad queda con
+# difundida=False y sus lectores la leen al vuelo
+FEED_FANOUT_MAX_AMIGOS = getattr(settings, 'FEED_FANOUT_MAX_AMIGOS', 1000)
+# Actividades recientes que se copian al feed de cada uno cuando se acepta una amistad
+FEED_BACKFILL = getattr(settings, 'FEED_BACKFILL', 50)
+FEED_POR_PAGINA = getattr(settings, 'FEED_POR_PAGINA', 20)
+
+_LOTE = 500
+
+
+def amigos_ids(usuario_id):
+    """Ids de los usuarios con amistad aceptada con usuario_id"""
+    pares = Amistad.objects.filter(
+        Q(user1_id=usuario_id) | Q(user2_id=usuario_id),
+        estado='aceptada'
+    ).values_list('user1_id', 'user2_id')
+    return {user2 if user1 == usuario_id else user1 for user1, user2 in pares}
+
+
+def _entregar(actividades, destinatarios):
+    items = [
+        FeedItem(usuario_id=usuario_id, actividad_id=actividad.id, fecha=actividad.fecha)
+        for actividad in actividades
+        for usuario_id in destinatarios
+    ]
+    FeedItem.objects.bulk_create(items, batch_size=_LOTE, ignore_conflicts=True)
+
+
+def publicar(actividad):
+    """Fan-out en escritura: copia la actividad al feed de cada amigo del actor"""
+    amigos = amigos_ids(actividad.actor_id)
+    if len(amigos) > FEED_FANOUT_MAX_AMIGOS:
+        # Usuario de alto grado: queda anotado en la fila y sus amigos la leen en obtener_feed. Se
+        # decide una vez por actividad, así que no importa si después cambia de grado.
+        Actividad.objects.filter(id=actividad.id).update(difundida=False)
+        actividad.difundida = False
+        return
+    _entregar([actividad], amigos)
+
+
+def conectar_amigos(user1, user2):
+    """Trae la actividad reciente de cada uno al feed del otro al aceptar la amistad"""
+    for actor, lector in ((user1, user2), (user2, user1)):
+        # Las no difundidas ya las lee al vuelo por ser amigos
+        recientes = Actividad.objects.filter(actor=actor, difundida=True).order_by('-fecha', '-id')[:FEED_BACKFILL]
+        _entregar(list(recientes), [lector.id])
+
+
+def desconectar_amigos(user1, user2):
+    """Quita del feed de cada uno la actividad del otro al eliminar la amistad"""
+    FeedItem.objects.filter(
+        Q(usuario=user1, actividad__actor=user2) | Q(usuario=user2, actividad__actor=user1)
+    ).delete()
+
+
+def codificar_cursor(actividad):
+    valor = f'{actividad.fecha.isoformat()}|{actividad.id}'
+    return base64.urlsafe_b64encode(valor.encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    """Devuelve (fecha, id) del cursor, o None si no hay cursor o es inválido"""
+    if not cursor:
+        return None
+    try:
+        fecha, actividad_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(fecha), int(actividad_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def _antes_de(posicion, campo_fecha, campo_id):
+    fecha, actividad_id = posicion
+    return Q(**{f'{campo_fecha}__lt': fecha}) | Q(**{campo_fecha: fecha, f'{campo_id}__lt': actividad_id})
+
+
+def obtener_feed(usuario, cursor=None, limite=FEED_POR_PAGINA):
+    """
+    Página del feed de usuario, de la más reciente a la más antigua.
+
+    Mezcla las filas de FeedItem (fan-out en escritura) con la actividad no difundida de los
+    amigos (la de alto grado), leída al vuelo, y los foros nuevos de las etiquetas seguidas. Pagina con un
+    cursor (fecha, id) en lugar de OFFSET. Devuelve (actividades, siguiente_cursor).
+    """
+    posicion = decodificar_cursor(cursor)
+
+    empujadas = FeedItem.objects.filter(usuario=usuario)
+    if posicion:
+        empujadas = empujadas.filter(_antes_de(posicion, 'fecha', 'actividad_id'))
+    corrientes = [list(
+        empujadas.order_by('-fecha', '-actividad_id').values_list('fecha', 'actividad_id')[:limite + 1]
+    )]
+
+    leidas = Q()
+    amigos = amigos_ids(usuario.id)
+    if amigos:
+        leidas |= Q(actor_id__in=amigos, difundida=False)
+    etiquetas = list(usuario.etiquetas_seguidas.values_list('id', flat=True))
+    if etiquetas:
+        leidas |= Q(verbo='creo', foro__etiquetas__in=etiquetas)
+    if leidas:
+        al_vuelo = Actividad.objects.filter(leidas).exclude(actor=usuario)
+        if posicion:
+            al_vuelo = al_vuelo.filter(_antes_de(posicion, 'fecha', 'id'))
+        corrientes.append(list(
+            al_vuelo.order_by('-fecha', '-id').values_list('fecha', 'id').distinct()[:limite + 1]
+        ))
+
+    ids = []
+    for _, actividad_id in heapq.merge(*corrientes, reverse=True):
+        if actividad_id not in ids:
+            ids.append(actividad_id)
+        if len(ids) > limite:
+            break
+
+    hay_mas = len(ids) > limite
+    por_id = Actividad.objects.select_related('actor', 'foro').in_bulk(ids[:limite])
+    actividades = [por_id[actividad_id] for actividad_id in ids[:limite] if actividad_id in por_id]
+    siguiente = codificar_cursor(actividades[-1]) if hay_mas and actividades else None
+    return actividades, siguiente
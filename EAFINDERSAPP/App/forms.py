@@ -141,7 +141,8 @@ class ForoForm(forms.ModelForm):
     def save(self, commit=True):
         # Primero, guardamos el foro sin etiquetas
         foro = super().save(commit=False)
-        foro.creador = self.initial.get('creador')  # Asegúrate de asignar el creador si es necesario
+        if self.initial.get('creador'):
+            foro.creador = self.initial['creador']  # La vista normalmente ya lo asignó en la instancia
         if commit:
             foro.save()  # Guardamos el foro para obtener el ID
 
@@ -162,3 +163,8 @@ class ComentarioForm(forms.ModelForm):
         widgets = {
             'contenido': forms.Textarea(attrs={'class': 'form-control', 'rows': 3, 'placeholder': 'Añade un comentario...'}),
         }
+
+
+class RosterForm(forms.Form):
+    archivo = forms.FileField(label='Roster (CSV o JSONL)')
+    validar = forms.BooleanField(label='Solo validar, sin guardar', required=False)
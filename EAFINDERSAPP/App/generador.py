@@ -0,0 +1,303 @@
+import random
+import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .models import Amistad, Comentario, Etiqueta, Foro, Mensaje, Usuario, Version
+from .shards import shard_de
+
+# Tamaño del escenario de referencia de los benchmarks (escala 1.0)
+ESCENARIO = {
+    'usuarios': 50_000,
+    'amistades': 500_000,
+    'mensajes': 5_000_000,
+    'foros': 50_000,
+    'comentarios': 400_000,
+    'etiquetas': 200,
+}
+CONTRASENA = 'Password123'
+LOTE = 5000
+# Lo que se genera va numerado; otra corrida sobre la misma base sigue después del mayor número
+_EMAIL = re.compile(r'usuario(\d+)@eafit\.edu\.co')
+_ETIQUETA = re.compile(r'[^-]+-(\d+)')
+
+_NOMBRES = ('Ana', 'Juan', 'María', 'Carlos', 'Laura', 'Andrés', 'Sofía', 'Mateo', 'Valentina', 'Santiago',
+            'Camila', 'Sebastián', 'Isabella', 'Daniel', 'Mariana', 'Tomás', 'Sara', 'Samuel', 'Lucía', 'David')
+_APELLIDOS = ('Gómez', 'Rodríguez', 'López', 'Martínez', 'García', 'Pérez', 'Sánchez', 'Ramírez', 'Torres',
+              'Flores', 'Rivera', 'Vargas', 'Castro', 'Restrepo', 'Ospina', 'Londoño', 'Zapata', 'Jaramillo')
+_CARRERAS = ('Ingenieria de Sistemas', 'Ingenieria Civil', 'Ingenieria Mecanica', 'Psicologia', 'Derecho',
+             'Economia', 'Musica', 'Biologia', 'Geologia', 'Negocios Internacionales', 'Comunicación Social')
+_PALABRAS = ('parcial', 'proyecto', 'monitoría', 'biblioteca', 'laboratorio', 'semestre', 'cálculo', 'tesis',
+             'grupo', 'examen', 'clase', 'profesor', 'apuntes', 'taller', 'práctica', 'intercambio', 'beca',
+             'bloque', 'cafetería', 'horario', 'entrega', 'nota', 'materia', 'créditos', 'evento', 'deporte')
+
+
+@contextmanager
+def sin_auto_now(*campos):
+    """Permite fijar a mano las fechas auto_now_add (bulk_create las pisaría con now())"""
+    for campo in campos:
+        campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        for campo in campos:
+            campo.auto_now_add = True
+
+
+def escalar(escala):
+    return {entidad: max(1, int(total * escala)) for entidad, total in ESCENARIO.items()}
+
+
+def _texto(rng, palabras):
+    return ' '.join(rng.choices(_PALABRAS, k=palabras))
+
+
+def _hashear(contrasena):
+    return make_password(contrasena)
+
+
+def _popular(rng, ids):
+    # Sesgado hacia el principio de la lista: unos pocos usuarios concentran amigos y mensajes
+    return ids[int(len(ids) * rng.random() ** 2)]
+
+
+def _por_lotes(filas, lote):
+    buffer = []
+    for fila in filas:
+        buffer.append(fila)
+        if len(buffer) >= lote:
+            yield buffer
+            buffer = []
+    if buffer:
+        yield buffer
+
+
+class Generador:
+    """
+    Siembra datos sintéticos con bulk_create por lotes. Es determinista: con la misma semilla
+    y los mismos totales produce exactamente los mismos datos.
+
+    Por defecto todos los usuarios comparten un único hash de CONTRASENA, calculado una sola
+    vez; con `procesos` cada uno recibe su propio hash (con su sal), repartiendo el hasher
+    entre varios procesos. Amistades y mensajes, las tablas de millones de filas, se insertan
+    como tuplas con executemany, sin pasar por instancias del modelo.
+    """
+
+    def __init__(self, semilla=0, lote=LOTE, informar=None, inicio=None, procesos=0):
+        self.rng = random.Random(semilla)
+        self.lote = lote
+        self.informar = informar or (lambda mensaje: None)
+        self.inicio = inicio or timezone.now().replace(microsecond=0)
+        self.procesos = procesos
+        self.hash = make_password(CONTRASENA, salt=f'semilla{semilla}')
+
+    def _fecha(self, dias=365):
+        return self.inicio - timedelta(seconds=self.rng.randrange(dias * 86400))
+
+    def _insertar(self, modelo, filas, etiqueta):
+        total = 0
+        for lote in _por_lotes(filas, self.lote):
+            with transaction.atomic():
+                modelo.objects.bulk_create(lote, batch_size=self.lote)
+            total += len(lote)
+            self.informar(f'{etiqueta}: {total}')
+        return total
+
+    def _insertar_tuplas(self, modelo, campos, filas, etiqueta, shard=None):
+        """
+        Como _insertar pero con tuplas en el orden de `campos` y un INSERT ... VALUES con
+        executemany. Si se pasa `shard(fila)`, cada fila va a la base que devuelva (Mensaje).
+        """
+        total = 0
+        for lote in _por_lotes(filas, self.lote):
+            if shard is None:
+                grupos = {router.db_for_write(modelo): lote}
+            else:
+                grupos = {}
+                for fila in lote:
+                    grupos.setdefault(shard(fila), []).append(fila)
+            for alias, filas_alias in grupos.items():
+                conexion = connections[alias]
+                nombre = conexion.ops.quote_name
+                sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+                    nombre(modelo._meta.db_table),
+                    ', '.join(nombre(modelo._meta.get_field(campo).column) for campo in campos),
+                    ', '.join(['%s'] * len(campos)),
+                )
+                with transaction.atomic(using=alias), conexion.cursor() as cursor:
+                    cursor.executemany(sql, filas_alias)
+            total += len(lote)
+            self.informar(f'{etiqueta}: {total}')
+        return total
+
+    def _fecha_bd(self, dias=365):
+        return connections['default'].ops.adapt_datetimefield_value(self._fecha(dias))
+
+    def _hashes(self, total):
+        if not self.procesos:
+            return [self.hash] * total
+        with ProcessPoolExecutor(self.procesos) as pool:
+            return list(pool.map(_hashear, [CONTRASENA] * total, chunksize=max(1, total // (self.procesos * 4))))
+
+    @staticmethod
+    def _siguiente(valores, patron):
+        numeros = (int(coincide[1]) for valor in valores.iterator() if (coincide := patron.fullmatch(valor)))
+        return max(numeros, default=-1) + 1
+
+    def siguiente_usuario(self):
+        """N del próximo usuarioN@eafit.edu.co: si la base ya tiene usuarios generados se agregan después"""
+        return self._siguiente(
+            Usuario.objects.filter(email_institucional__startswith='usuario').values_list('email_institucional', flat=True),
+            _EMAIL,
+        )
+
+    def usuarios(self, total):
+        hashes = self._hashes(total)
+        desde = self.siguiente_usuario() if total else 0
+
+        def filas():
+            for i in range(total):
+                nombre, apellido = self.rng.choice(_NOMBRES), self.rng.choice(_APELLIDOS)
+                yield Usuario(
+                    nombres=nombre,
+                    apellidos=apellido,
+                    email_institucional=f'usuario{desde + i}@eafit.edu.co',
+                    password=hashes[i],
+                    biografia=_texto(self.rng, 12),
+                    carrera=self.rng.choice(_CARRERAS),
+                    semestre=self.rng.randint(1, 10),
+                    date_joined=self._fecha(),
+                )
+
+        with sin_auto_now(Usuario._meta.get_field('date_joined')):
+            return self._insertar(Usuario, filas(), 'usuarios')
+
+    def amistades(self, total, usuarios):
+        """
+        Pares únicos (sin importar el orden), también respecto a las amistades que ya hay; el 85%
+        aceptadas y el resto pendientes o rechazadas
+        """
+        pares = {(min(a, b), max(a, b)) for a, b in Amistad.objects.values_list('user1_id', 'user2_id').iterator()}
+        hasta = len(pares) + min(total, len(usuarios) * (len(usuarios) - 1) // 2 - len(pares))
+
+        def filas():
+            while len(pares) < hasta:
+                a, b = self.rng.choice(usuarios), _popular(self.rng, usuarios)
+                par = (min(a, b), max(a, b))
+                if a == b or par in pares:
+                    continue
+                pares.add(par)
+                azar = self.rng.random()
+                estado = 'aceptada' if azar < 0.85 else 'pendiente' if azar < 0.95 else 'rechazada'
+                yield a, b, estado, self._fecha_bd()
+
+        return self._insertar_tuplas(
+            Amistad, ('user1', 'user2', 'estado', 'fecha_amistad'), filas(), 'amistades'
+        )
+
+    def mensajes(self, total, parejas):
+        """Mensajes entre amigos; las conversaciones de los primeros pares son las más largas"""
+        def filas():
+            for _ in range(total):
+                a, b = _popular(self.rng, parejas)
+                if self.rng.random() < 0.5:
+                    a, b = b, a
+                yield a, b, _texto(self.rng, self.rng.randint(2, 20)), self._fecha_bd()
+
+        return self._insertar_tuplas(
+            Mensaje, ('remitente', 'destinatario', 'contenido', 'fecha_enviado'), filas(), 'mensajes',
+            shard=lambda fila: shard_de(fila[0], fila[1]),
+        )
+
+    def etiquetas(self, total):
+        desde = self._siguiente(Etiqueta.objects.values_list('nombre', flat=True), _ETIQUETA) if total else 0
+        filas = (Etiqueta(nombre=f'{self.rng.choice(_PALABRAS)}-{desde + i}') for i in range(total))
+        return self._insertar(Etiqueta, filas, 'etiquetas')
+
+    def foros(self, total, usuarios, etiquetas):
+        """Foros con 0-3 etiquetas y unos cuantos likes cada uno"""
+        foros_etiquetas = Foro.etiquetas.through
+        foros_likes = Foro.likes.through
+        creados = 0
+        with sin_auto_now(Foro._meta.get_field('fecha_creacion')):
+            for inicio in range(0, total, self.lote):
+                lote = [
+                    Foro(
+                        titulo=_texto(self.rng, 5).capitalize(),
+                        descripcion=_texto(self.rng, 40),
+                        creador_id=_popular(self.rng, usuarios),
+                        fecha_creacion=self._fecha(),
+                        vistas=self.rng.randrange(5000),
+                    )
+                    for _ in range(min(self.lote, total - inicio))
+                ]
+                with transaction.atomic():
+                    Foro.objects.bulk_create(lote)
+                    relaciones, likes = [], []
+                    for foro in lote:
+                        for etiqueta_id in self.rng.sample(etiquetas, min(len(etiquetas), self.rng.randint(0, 3))):
+                            relaciones.append(foros_etiquetas(foro_id=foro.id, etiqueta_id=etiqueta_id))
+                        for usuario_id in {_popular(self.rng, usuarios) for _ in range(self.rng.randint(0, 20))}:
+                            likes.append(foros_likes(foro_id=foro.id, usuario_id=usuario_id))
+                    foros_etiquetas.objects.bulk_create(relaciones, batch_size=self.lote)
+                    foros_likes.objects.bulk_create(likes, batch_size=self.lote)
+                creados += len(lote)
+                self.informar(f'foros: {creados}')
+        return creados
+
+    def comentarios(self, total, usuarios, foros):
+        """Comentarios anidados en tres niveles: la mitad raíces, un cuarto respuestas y un cuarto respuestas a respuestas"""
+        def responder(padres, cantidad):
+            return [
+                Comentario(
+                    foro_id=padre.foro_id, autor_id=self.rng.choice(usuarios), parent_id=padre.id,
+                    contenido=_texto(self.rng, self.rng.randint(3, 30)),
+                    fecha_creacion=padre.fecha_creacion + timedelta(minutes=self.rng.randint(1, 600)),
+                )
+                for padre in (self.rng.choice(padres) for _ in range(cantidad))
+            ]
+
+        creados = 0
+        with sin_auto_now(Comentario._meta.get_field('fecha_creacion')):
+            while creados < total:
+                tamano = min(self.lote, total - creados)
+                raices = [
+                    Comentario(
+                        foro_id=_popular(self.rng, foros), autor_id=self.rng.choice(usuarios),
+                        contenido=_texto(self.rng, self.rng.randint(3, 30)), fecha_creacion=self._fecha(),
+                    )
+                    for _ in range(tamano - tamano // 2)
+                ]
+                with transaction.atomic():
+                    # bulk_create devuelve los ids (SQLite y PostgreSQL), así cada nivel apunta al anterior
+                    Comentario.objects.bulk_create(raices)
+                    respuestas = Comentario.objects.bulk_create(responder(raices, tamano // 4))
+                    Comentario.objects.bulk_create(responder(respuestas or raices, tamano // 2 - tamano // 4))
+                creados += tamano
+                self.informar(f'comentarios: {creados}')
+        return creados
+
+    def generar(self, totales):
+        """Crea todas las entidades; `totales` tiene las claves de ESCENARIO (puede haber ceros)"""
+        self.usuarios(totales['usuarios'])
+        usuarios = list(Usuario.objects.order_by('id').values_list('id', flat=True))
+        if len(usuarios) > 1:
+            self.amistades(totales['amistades'], usuarios)
+        parejas = list(
+            Amistad.objects.filter(estado='aceptada').order_by('id').values_list('user1_id', 'user2_id')
+        )
+        if parejas:
+            self.mensajes(totales['mensajes'], parejas)
+        self.etiquetas(totales['etiquetas'])
+        etiquetas = list(Etiqueta.objects.order_by('id').values_list('id', flat=True))
+        if usuarios:
+            self.foros(totales['foros'], usuarios, etiquetas)
+        foros = list(Foro.objects.order_by('id').values_list('id', flat=True))
+        if usuarios and foros:
+            self.comentarios(totales['comentarios'], usuarios, foros)
+        Version.subir('foros')  # bulk_create no manda los signals que la suben
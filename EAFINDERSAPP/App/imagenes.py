@@ -0,0 +1,118 @@
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from .metricas import registrar_cache
+
+logger = logging.getLogger(__name__)
+
+# Lado mayor en px de cada miniatura; las plantillas piden el tamaño más pequeño que alcance
+TAMANOS = tuple(getattr(settings, 'IMAGENES_TAMANOS', (64, 128, 256, 512)))
+CALIDAD = getattr(settings, 'IMAGENES_CALIDAD', 80)
+PREFIJO = 'derivados/'
+
+# formato -> (formato de Pillow, extensión, tipo MIME)
+FORMATOS = {'jpeg': ('JPEG', 'jpg', 'image/jpeg')}
+if features.check('webp'):
+    FORMATOS['webp'] = ('WEBP', 'webp', 'image/webp')
+
+# Derivados que ya sabemos que están en disco -> su ancho real en px (una foto vertical de
+# 512 queda más angosta), para no abrirlos en cada render
+_anchos = {}
+
+
+def nombre_derivado(nombre, tamano, formato):
+    """perfil_fotos/foo.png -> derivados/perfil_fotos/foo_128.webp"""
+    base, _ = os.path.splitext(nombre)
+    return f'{PREFIJO}{base}_{tamano}.{FORMATOS[formato][1]}'
+
+
+def tamano_para(ancho):
+    """El tamaño de la lista que cubre un ancho en px (o el mayor si ninguno alcanza)"""
+    for tamano in TAMANOS:
+        if tamano >= ancho:
+            return tamano
+    return TAMANOS[-1]
+
+
+def abrir(archivo):
+    """Abre la imagen ya rotada según su EXIF (las fotos del celular suelen venir giradas)"""
+    imagen = Image.open(archivo)
+    return ImageOps.exif_transpose(imagen)
+
+
+def renderizar(imagen, tamano, formato):
+    """Miniatura de la imagen con lado mayor `tamano`, codificada en `formato`. Devuelve bytes"""
+    formato_pil = FORMATOS[formato][0]
+    miniatura = imagen.copy()
+    miniatura.thumbnail((tamano, tamano), Image.Resampling.LANCZOS)
+    if formato_pil == 'JPEG' and miniatura.mode != 'RGB':
+        miniatura = miniatura.convert('RGB')
+    elif miniatura.mode not in ('RGB', 'RGBA'):
+        miniatura = miniatura.convert('RGBA')
+
+    salida = BytesIO()
+    miniatura.save(salida, formato_pil, quality=CALIDAD, optimize=formato_pil == 'JPEG')
+    return salida.getvalue()
+
+
+def generar_derivados(archivo):
+    """
+    Genera (si faltan) todas las miniaturas de un ImageField/FieldFile. Se guardan con
+    default_storage, que respeta el nombre pedido (el storage del campo puede renombrar).
+    """
+    faltantes = [
+        (tamano, formato) for tamano in TAMANOS for formato in FORMATOS
+        if not default_storage.exists(nombre_derivado(archivo.name, tamano, formato))
+    ]
+    if faltantes:
+        with archivo.storage.open(archivo.name, 'rb') as original:
+            imagen = abrir(original)
+            imagen.load()
+        for tamano, formato in faltantes:
+            nombre = nombre_derivado(archivo.name, tamano, formato)
+            datos = renderizar(imagen, tamano, formato)
+            default_storage.save(nombre, ContentFile(datos))
+            _anchos[nombre] = Image.open(BytesIO(datos)).width
+
+
+def ancho_derivado(nombre):
+    """Ancho en px del derivado `nombre`, o None si todavía no está en disco"""
+    ancho = _anchos.get(nombre)
+    registrar_cache('miniaturas', ancho is not None)
+    if ancho is None:
+        try:
+            with default_storage.open(nombre, 'rb') as archivo:
+                ancho = Image.open(archivo).width  # Solo lee la cabecera
+        except (OSError, UnidentifiedImageError):
+            return None
+        _anchos[nombre] = ancho
+    return ancho
+
+
+def url_derivado(archivo, tamano, formato='jpeg'):
+    """
+    URL de la miniatura de `archivo`, o la de la original si la miniatura no está en disco. No
+    las genera al renderizar: lo hace el signal al subir la imagen, y reprocesar_media con las
+    que ya estaban (o si la original no es una imagen válida, nunca).
+    """
+    nombre = nombre_derivado(archivo.name, tamano, formato)
+    if ancho_derivado(nombre) is None:
+        return archivo.url
+    return default_storage.url(nombre)
+
+
+def srcset(archivo, formato='jpeg'):
+    """Miniaturas en disco con su ancho real; si la original es chica varias tienen el mismo y va una"""
+    candidatos = {}
+    for tamano in TAMANOS:
+        nombre = nombre_derivado(archivo.name, tamano, formato)
+        ancho = ancho_derivado(nombre)
+        if ancho is not None:
+            candidatos.setdefault(ancho, nombre)
+    return ', '.join(f'{default_storage.url(nombre)} {ancho}w' for ancho, nombre in candidatos.items())
@@ -0,0 +1,286 @@
+import json
+import logging
+import platform
+import random
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from pathlib import Path
+from statistics import mean, quantiles
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from App import metricas, shards
+from App.contadores import vistas_foro
+from App.generador import ESCENARIO, Generador, escalar
+from App.models import Amistad, Foro, Usuario
+
+
+class ContadorConsultas:
+    def __init__(self):
+        self.total = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.total += 1
+        return execute(sql, params, many, context)
+
+
+def percentiles(valores):
+    if len(valores) < 2:
+        return {'p50': valores[0], 'p95': valores[0], 'p99': valores[0]} if valores else {}
+    cortes = quantiles(valores, n=100, method='inclusive')
+    return {'p50': cortes[49], 'p95': cortes[94], 'p99': cortes[98]}
+
+
+class Command(BaseCommand):
+    help = (
+        'Siembra una base de datos de prueba con un escenario realista y mide latencia (p50/p95/p99), '
+        'throughput y consultas por petición de las URLs más usadas. Guarda el resultado en JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escala', type=float, default=1.0,
+                            help='Multiplica el escenario de referencia (%s)' % ', '.join(f'{v} {k}' for k, v in ESCENARIO.items()))
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument('--peticiones', type=int, default=200, help='Peticiones medidas por URL')
+        parser.add_argument('--calentamiento', type=int, default=10, help='Peticiones por URL que no se miden')
+        parser.add_argument('--concurrencia', type=int, default=4, help='Hilos que hacen peticiones a la vez')
+        parser.add_argument('--urls', nargs='*', help='Solo estas URLs (por nombre)')
+        parser.add_argument('--reusar', action='store_true',
+                            help='Conserva la base de datos sembrada entre ejecuciones (no la vuelve a generar)')
+        parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto benchmarks/<fecha>.json)')
+        parser.add_argument('--comparar', help='JSON de una ejecución anterior para mostrar la diferencia')
+
+    def handle(self, *args, **opciones):
+        # default y los shards de mensajes, cada uno con su base de prueba
+        bases = [connections[alias] for alias in dict.fromkeys([DEFAULT_DB_ALIAS, *shards.aliases()])]
+        for conexion in bases:
+            if conexion.vendor == 'sqlite' and not conexion.settings_dict.get('TEST', {}).get('NAME'):
+                # La base en memoria no se comparte entre hilos ni sobrevive a --reusar
+                archivo = 'benchmark.sqlite3' if conexion.alias == DEFAULT_DB_ALIAS else f'benchmark_{conexion.alias}.sqlite3'
+                conexion.settings_dict.setdefault('TEST', {})['NAME'] = str(settings.BASE_DIR / archivo)
+
+        setup_test_environment(debug=False)
+        # La instrumentación SQL escribiría una línea por petición
+        logging.getLogger('App.sql').disabled = True
+        # Ni sus peticiones se suman al /metrics de los workers del servidor
+        metricas.registro.directorio = None
+        nombres_originales = {conexion.alias: conexion.settings_dict['NAME'] for conexion in bases}
+        for conexion in bases:
+            conexion.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=opciones['reusar'], serialize=False)
+        for alias, configuracion in settings.DATABASES.items():
+            # La réplica de lectura (TEST MIRROR) tiene que apuntar a la base sembrada, no a la real
+            if configuracion.get('TEST', {}).get('MIRROR') == connection.alias:
+                connections[alias].creation.set_as_test_mirror(connection.settings_dict)
+        try:
+            totales = escalar(opciones['escala'])
+            if not Usuario.objects.exists():
+                self.sembrar(totales, opciones['semilla'])
+            elif opciones['reusar']:
+                self.stdout.write('Reusando la base de datos sembrada')
+            resultado = self.medir(opciones)
+        finally:
+            # Las vistas pendientes son de la base de prueba: no pueden volcarse a la real al salir
+            vistas_foro.volcar()
+            connections.close_all()
+            if not opciones['reusar']:
+                for conexion in bases:
+                    conexion.creation.destroy_test_db(nombres_originales[conexion.alias], verbosity=0)
+            teardown_test_environment()
+
+        resultado['escenario'] = totales
+        resultado['semilla'] = opciones['semilla']
+        self.mostrar(resultado['urls'])
+        salida = Path(opciones['salida'] or settings.BASE_DIR / 'benchmarks' / f'{timezone.now():%Y%m%d-%H%M%S}.json')
+        salida.parent.mkdir(parents=True, exist_ok=True)
+        salida.write_text(json.dumps(resultado, indent=2, ensure_ascii=False))
+        self.stdout.write(self.style.SUCCESS(f'Resultados en {salida}'))
+
+        if opciones['comparar']:
+            try:
+                anterior = json.loads(Path(opciones['comparar']).read_text())
+            except (OSError, ValueError) as error:
+                raise CommandError(f'No se pudo leer {opciones["comparar"]}: {error}')
+            self.comparar(anterior['urls'], resultado['urls'])
+
+    def sembrar(self, totales, semilla):
+        self.stdout.write('Sembrando: ' + ', '.join(f'{v} {k}' for k, v in totales.items()))
+        inicio = time.monotonic()
+        ultimo = [0.0]
+
+        def informar(mensaje):
+            if time.monotonic() - ultimo[0] >= 5:
+                ultimo[0] = time.monotonic()
+                self.stdout.write(f'  {mensaje} ({ultimo[0] - inicio:.0f}s)')
+
+        Generador(semilla, informar=informar).generar(totales)
+        self.stdout.write(f'Sembrado en {time.monotonic() - inicio:.1f}s')
+
+    def escenarios(self, rng):
+        """(nombre, función que devuelve la URL y el usuario con sesión) de cada URL medida"""
+        usuarios = list(Usuario.objects.order_by('id').values_list('id', flat=True)[:1000])
+        amistades = list(
+            Amistad.objects.filter(estado='aceptada').order_by('id').values_list('user1_id', 'user2_id')[:1000]
+        )
+        foros = list(Foro.objects.order_by('-id').values_list('id', flat=True)[:1000])
+        if not (usuarios and amistades and foros):
+            raise CommandError('El escenario necesita al menos un usuario, una amistad aceptada y un foro')
+
+        def amigos():
+            return rng.choice(amistades) if rng.random() < 0.5 else rng.choice(amistades)[::-1]
+
+        return [
+            ('home', lambda: (reverse('home'), rng.choice(usuarios))),
+            ('lista_foros', lambda: (reverse('lista_foros'), rng.choice(usuarios))),
+            ('lista_foros_tendencia', lambda: (reverse('lista_foros') + '?orden=tendencia', rng.choice(usuarios))),
+            ('detalle_foro', lambda: (reverse('detalle_foro', args=[rng.choice(foros)]), rng.choice(usuarios))),
+            ('feed', lambda: (reverse('feed'), rng.choice(usuarios))),
+            ('profile', lambda: (reverse('profile', args=[rng.choice(usuarios)]), rng.choice(usuarios))),
+            ('Cuenta', lambda: (reverse('Cuenta'), rng.choice(usuarios))),
+            ('Notificaciones', lambda: (reverse('Notificaciones'), rng.choice(usuarios))),
+            ('buscar_usuarios', lambda: (reverse('buscar_usuarios') + '?query=Ana', rng.choice(usuarios))),
+            ('lista_conversaciones', lambda: (reverse('lista_conversaciones'), rng.choice(usuarios))),
+            ('chat_view', lambda: (lambda par: (reverse('chat_view', args=[par[1]]), par[0]))(amigos())),
+            ('obtener_mensajes', lambda: (lambda par: (reverse('obtener_mensajes', args=[par[1]]), par[0]))(amigos())),
+        ]
+
+    def medir(self, opciones):
+        rng = random.Random(opciones['semilla'])
+        escenarios = self.escenarios(rng)
+        if opciones['urls']:
+            escenarios = [e for e in escenarios if e[0] in opciones['urls']]
+        # Las URLs se sortean antes de lanzar los hilos para que la carga sea la misma en cada ejecución
+
+        def sortear(cantidad):
+            tareas = [(nombre, *generar()) for nombre, generar in escenarios for _ in range(cantidad)]
+            rng.shuffle(tareas)
+            return tareas
+
+        calentamiento, medidas = sortear(opciones['calentamiento']), sortear(opciones['peticiones'])
+        # Las sesiones se abren antes: el login no entra en la ventana medida
+        sesiones = {}
+        for usuario in Usuario.objects.filter(id__in={t[2] for t in calentamiento + medidas}):
+            cliente = Client()
+            cliente.force_login(usuario)
+            sesiones[usuario.id] = cliente.cookies[settings.SESSION_COOKIE_NAME].value
+
+        muestras = defaultdict(list)  # nombre -> [(segundos, consultas, estado)]
+        fases = (iter(calentamiento), iter(medidas))
+        candado = threading.Lock()
+        # Todos los hilos terminan el calentamiento antes de que empiece a correr el reloj del throughput
+        barrera = threading.Barrier(opciones['concurrencia'] + 1)
+
+        def trabajador():
+            clientes = {}
+            contador = ContadorConsultas()
+            try:
+                with ExitStack() as pila:
+                    for alias in connections:
+                        pila.enter_context(connections[alias].execute_wrapper(contador))
+                    for medir, tareas in enumerate(fases):
+                        if medir:
+                            barrera.wait()
+                        while True:
+                            with candado:
+                                tarea = next(tareas, None)
+                            if tarea is None:
+                                break
+                            nombre, url, usuario_id = tarea
+                            cliente = clientes.get(usuario_id)
+                            if cliente is None:
+                                cliente = clientes[usuario_id] = Client(raise_request_exception=False)
+                                cliente.cookies[settings.SESSION_COOKIE_NAME] = sesiones[usuario_id]
+                            contador.total = 0
+                            inicio = time.perf_counter()
+                            respuesta = cliente.get(url)
+                            duracion = time.perf_counter() - inicio
+                            if medir:
+                                with candado:
+                                    muestras[nombre].append((duracion, contador.total, respuesta.status_code))
+            except BaseException:
+                barrera.abort()  # Que los demás hilos y el principal no se queden esperando
+                raise
+            finally:
+                for alias in connections:
+                    connections[alias].close()
+
+        hilos = [threading.Thread(target=trabajador) for _ in range(opciones['concurrencia'])]
+        for hilo in hilos:
+            hilo.start()
+        try:
+            barrera.wait()
+        except threading.BrokenBarrierError:
+            for hilo in hilos:
+                hilo.join()
+            raise CommandError('Un hilo falló durante el calentamiento')
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+
+        urls = {}
+        for nombre, valores in sorted(muestras.items()):
+            tiempos = [v[0] * 1000 for v in valores]
+            urls[nombre] = {
+                'peticiones': len(valores),
+                'errores': sum(1 for v in valores if v[2] >= 400),
+                'media_ms': mean(tiempos),
+                **percentiles(tiempos),
+                'consultas': mean(v[1] for v in valores),
+                'consultas_max': max(v[1] for v in valores),
+            }
+        total = sum(len(v) for v in muestras.values())
+        return {
+            'fecha': timezone.now().isoformat(),
+            'commit': self.commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'base_de_datos': connection.vendor,
+            'concurrencia': opciones['concurrencia'],
+            'duracion_s': duracion,
+            'throughput_rps': len(medidas) / duracion,
+            'peticiones_medidas': total,
+            'urls': urls,
+        }
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def mostrar(self, urls):
+        self.stdout.write(f'{"URL":<24}{"n":>6}{"err":>5}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"consultas":>11}')
+        for nombre, datos in urls.items():
+            self.stdout.write(
+                f'{nombre:<24}{datos["peticiones"]:>6}{datos["errores"]:>5}{datos["p50"]:>10.1f}'
+                f'{datos["p95"]:>10.1f}{datos["p99"]:>10.1f}{datos["consultas"]:>11.1f}'
+            )
+
+    def comparar(self, anterior, actual):
+        self.stdout.write('\nDiferencia con la ejecución anterior (negativo es mejor):')
+        self.stdout.write(f'{"URL":<24}{"p50":>10}{"p95":>10}{"p99":>10}{"consultas":>11}')
+        for nombre, datos in actual.items():
+            previo = anterior.get(nombre)
+            if not previo:
+                continue
+
+            def delta(clave):
+                return f'{(datos[clave] - previo[clave]) / previo[clave] * 100:+.0f}%' if previo[clave] else '-'
+
+            self.stdout.write(
+                f'{nombre:<24}{delta("p50"):>10}{delta("p95"):>10}{delta("p99"):>10}'
+                f'{datos["consultas"] - previo["consultas"]:>+11.1f}'
+            )
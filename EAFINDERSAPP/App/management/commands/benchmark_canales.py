@@ -0,0 +1,139 @@
+import asyncio
+import multiprocessing
+import tempfile
+import time
+from pathlib import Path
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from App.canales import CapaSQLite
+from App.management.commands.benchmark import percentiles
+
+ESCENARIOS = ['memoria', 'proceso', 'procesos', 'grupo']
+ESPERA_MAXIMA = 5  # Segundos sin recibir nada para dar el resto por perdido
+
+
+async def consumir(capa, canal, total, latencias):
+    for _ in range(total):
+        try:
+            mensaje = await asyncio.wait_for(capa.receive(canal), ESPERA_MAXIMA)
+        except asyncio.TimeoutError:
+            return
+        latencias.append((time.time() - mensaje['t']) * 1000)
+
+
+async def producir(capa, destino, mensajes, grupo=False):
+    for n in range(mensajes):
+        mensaje = {'type': 'bench', 'n': n, 't': time.time()}
+        if grupo:
+            await capa.group_send(destino, mensaje)
+        else:
+            await capa.send(destino, mensaje)
+
+
+def productor(ruta, capacidad, destino, mensajes, grupo, salida):
+    # En otro proceso: otra capa sobre el mismo archivo, como otro worker
+    salida.wait()
+    asyncio.run(producir(CapaSQLite(ruta, capacity=capacidad), destino, mensajes, grupo))
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide la capa de canales SQLite (App/canales.py): mensajes por segundo y latencia de send '
+        'y receive en el mismo proceso (junto a la capa en memoria de Channels), desde varios '
+        'procesos productores, y de group_send a un grupo con varios canales. Los productores no '
+        'esperan al consumidor: la latencia incluye la cola que se forme.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mensajes', type=int, default=2000, help='Mensajes por productor')
+        parser.add_argument('--productores', type=int, default=4, help='Procesos que envían en procesos y grupo')
+        parser.add_argument('--canales-grupo', type=int, default=10, help='Canales del grupo en el escenario grupo')
+        parser.add_argument('--escenarios', nargs='*', choices=ESCENARIOS, default=ESCENARIOS)
+
+    def handle(self, *args, **opciones):
+        resultados = {}
+        with tempfile.TemporaryDirectory() as directorio:
+            for escenario in opciones['escenarios']:
+                ruta = Path(directorio) / f'{escenario}.sqlite3'
+                resultados[escenario] = getattr(self, f'medir_{escenario}')(ruta, opciones)
+        self.mostrar(resultados)
+
+    def resultado(self, esperados, latencias, segundos):
+        return {
+            'entregados': len(latencias),
+            'perdidos': esperados - len(latencias),
+            'por_segundo': len(latencias) / segundos,
+            **percentiles(sorted(latencias)),
+        }
+
+    def en_un_proceso(self, capa, mensajes):
+        async def correr():
+            canal = await capa.new_channel()
+            latencias = []
+            inicio = time.perf_counter()
+            await asyncio.gather(consumir(capa, canal, mensajes, latencias), producir(capa, canal, mensajes))
+            return latencias, time.perf_counter() - inicio
+
+        # La capacidad alcanza para todos: se mide cuánto tarda, no cuánto se descarta
+        latencias, segundos = asyncio.run(correr())
+        return self.resultado(mensajes, latencias, segundos)
+
+    def medir_memoria(self, ruta, opciones):
+        return self.en_un_proceso(InMemoryChannelLayer(capacity=opciones['mensajes']), opciones['mensajes'])
+
+    def medir_proceso(self, ruta, opciones):
+        return self.en_un_proceso(CapaSQLite(ruta, capacity=opciones['mensajes']), opciones['mensajes'])
+
+    def entre_procesos(self, ruta, opciones, canales, grupo):
+        productores, mensajes = opciones['productores'], opciones['mensajes']
+        por_canal = productores * mensajes
+        capa = CapaSQLite(ruta, capacity=por_canal)
+
+        async def preparar():
+            nombres = [await capa.new_channel() for _ in range(canales)]
+            if grupo:
+                for nombre in nombres:
+                    await capa.group_add('bench', nombre)
+            return nombres
+
+        nombres = asyncio.run(preparar())
+        salida = multiprocessing.Event()
+        procesos = [
+            multiprocessing.Process(
+                target=productor,
+                args=(str(ruta), por_canal, 'bench' if grupo else nombres[0], mensajes, grupo, salida),
+            )
+            for _ in range(productores)
+        ]
+        for proceso in procesos:
+            proceso.start()
+
+        async def recibir():
+            latencias = []
+            inicio = time.perf_counter()
+            salida.set()
+            await asyncio.gather(*(consumir(capa, nombre, por_canal, latencias) for nombre in nombres))
+            return latencias, time.perf_counter() - inicio
+
+        latencias, segundos = asyncio.run(recibir())
+        for proceso in procesos:
+            proceso.join()
+        return self.resultado(por_canal * canales, latencias, segundos)
+
+    def medir_procesos(self, ruta, opciones):
+        return self.entre_procesos(ruta, opciones, 1, grupo=False)
+
+    def medir_grupo(self, ruta, opciones):
+        return self.entre_procesos(ruta, opciones, opciones['canales_grupo'], grupo=True)
+
+    def mostrar(self, resultados):
+        self.stdout.write(
+            f'{"escenario":<11}{"entregados":>11}{"perdidos":>9}{"msg/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+        )
+        for escenario, datos in resultados.items():
+            self.stdout.write(
+                f'{escenario:<11}{datos["entregados"]:>11}{datos["perdidos"]:>9}{datos["por_segundo"]:>10.0f}'
+                f'{datos.get("p50", 0):>10.2f}{datos.get("p95", 0):>10.2f}{datos.get("p99", 0):>10.2f}'
+            )
@@ -0,0 +1,146 @@
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from App.backends.sqlite_wal.base import PRAGMAS, aplicar_pragmas
+from App.management.commands.benchmark import percentiles
+
+# Configuración de cada modo: pragmas y cómo empieza una transacción de escritura
+MODOS = {
+    # Lo que hace el backend sqlite3 de Django sin opciones: journal de rollback y BEGIN diferido
+    'stock': ({}, 'BEGIN'),
+    'wal': (PRAGMAS, 'BEGIN IMMEDIATE'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide lecturas y escrituras concurrentes sobre SQLite con la configuración por defecto '
+        'y con la del backend App.backends.sqlite_wal (WAL + pragmas), con una tabla parecida a '
+        'la de mensajes: hilos que leen conversaciones mientras otros insertan mensajes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duracion', type=float, default=5.0, help='Segundos por modo')
+        parser.add_argument('--lectores', type=int, default=4)
+        parser.add_argument('--escritores', type=int, default=2)
+        parser.add_argument('--filas', type=int, default=50000, help='Mensajes sembrados antes de medir')
+        parser.add_argument('--usuarios', type=int, default=500)
+        parser.add_argument('--modos', nargs='*', choices=list(MODOS), default=list(MODOS))
+
+    def handle(self, *args, **opciones):
+        resultados = {}
+        with tempfile.TemporaryDirectory() as directorio:
+            for modo in opciones['modos']:
+                archivo = Path(directorio) / f'{modo}.sqlite3'
+                self.sembrar(archivo, modo, opciones)
+                resultados[modo] = self.medir(archivo, modo, opciones)
+        self.mostrar(resultados)
+
+    def conectar(self, archivo, modo):
+        # isolation_level=None: las transacciones se abren a mano, igual que hace Django
+        conexion = sqlite3.connect(archivo, isolation_level=None, check_same_thread=False)
+        aplicar_pragmas(conexion, MODOS[modo][0])
+        return conexion
+
+    def sembrar(self, archivo, modo, opciones):
+        conexion = self.conectar(archivo, modo)
+        conexion.executescript('''
+            CREATE TABLE mensaje (
+                id INTEGER PRIMARY KEY, remitente INTEGER, destinatario INTEGER,
+                contenido TEXT, fecha REAL
+            );
+            CREATE INDEX mensaje_conversacion ON mensaje (remitente, destinatario, fecha);
+        ''')
+        rng = random.Random(0)
+        conexion.execute('BEGIN')
+        conexion.executemany(
+            'INSERT INTO mensaje (remitente, destinatario, contenido, fecha) VALUES (?, ?, ?, ?)',
+            ((rng.randrange(opciones['usuarios']), rng.randrange(opciones['usuarios']), 'hola ' * 10, i)
+             for i in range(opciones['filas'])),
+        )
+        conexion.execute('COMMIT')
+        conexion.close()
+
+    def medir(self, archivo, modo, opciones):
+        usuarios = opciones['usuarios']
+        inicio_transaccion = MODOS[modo][1]
+        fin = time.monotonic() + opciones['duracion']
+        muestras = {'lectura': [], 'escritura': []}
+        errores = {'lectura': 0, 'escritura': 0}
+        candado = threading.Lock()
+
+        def leer(conexion, rng):
+            a, b = rng.randrange(usuarios), rng.randrange(usuarios)
+            conexion.execute(
+                'SELECT id, remitente, contenido, fecha FROM mensaje '
+                'WHERE remitente IN (?, ?) AND destinatario IN (?, ?) ORDER BY fecha DESC LIMIT 50',
+                (a, b, a, b),
+            ).fetchall()
+
+        def escribir(conexion, rng):
+            conexion.execute(inicio_transaccion)
+            try:
+                # Como chat_view: se lee la conversación y después se inserta en la misma transacción
+                a, b = rng.randrange(usuarios), rng.randrange(usuarios)
+                conexion.execute('SELECT id FROM mensaje WHERE remitente = ? AND destinatario = ? LIMIT 1', (a, b))
+                conexion.execute(
+                    'INSERT INTO mensaje (remitente, destinatario, contenido, fecha) VALUES (?, ?, ?, ?)',
+                    (a, b, 'hola', time.time()),
+                )
+                conexion.execute('COMMIT')
+            except sqlite3.Error:
+                conexion.execute('ROLLBACK')
+                raise
+
+        def trabajador(tipo, operacion, semilla):
+            rng = random.Random(semilla)
+            conexion = self.conectar(archivo, modo)
+            propias, fallidas = [], 0
+            try:
+                while time.monotonic() < fin:
+                    inicio = time.perf_counter()
+                    try:
+                        operacion(conexion, rng)
+                    except sqlite3.OperationalError:  # database is locked
+                        fallidas += 1
+                        continue
+                    propias.append((time.perf_counter() - inicio) * 1000)
+            finally:
+                conexion.close()
+                with candado:
+                    muestras[tipo] += propias
+                    errores[tipo] += fallidas
+
+        hilos = [threading.Thread(target=trabajador, args=('lectura', leer, i)) for i in range(opciones['lectores'])]
+        hilos += [
+            threading.Thread(target=trabajador, args=('escritura', escribir, 1000 + i))
+            for i in range(opciones['escritores'])
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        return {
+            tipo: {
+                'por_segundo': len(valores) / opciones['duracion'],
+                'errores': errores[tipo],
+                **percentiles(sorted(valores)),
+            }
+            for tipo, valores in muestras.items()
+        }
+
+    def mostrar(self, resultados):
+        self.stdout.write(f'{"modo":<8}{"operación":<12}{"ops/s":>10}{"errores":>9}{"p50 ms":>10}{"p99 ms":>10}')
+        for modo, tipos in resultados.items():
+            for tipo, datos in tipos.items():
+                self.stdout.write(
+                    f'{modo:<8}{tipo:<12}{datos["por_segundo"]:>10.0f}{datos["errores"]:>9}'
+                    f'{datos.get("p50", 0):>10.2f}{datos.get("p99", 0):>10.2f}'
+                )
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from App import shards
+from App.generador import ESCENARIO, LOTE, Generador
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera usuarios, amistades, mensajes, etiquetas, foros y comentarios sintéticos con '
+        'bulk_create por lotes. Con la misma semilla produce los mismos datos. Sobre una base ya '
+        'generada agrega: los usuarios nuevos siguen la numeración de los correos usuarioN@eafit.edu.co.'
+    )
+
+    def add_arguments(self, parser):
+        for entidad, total in ESCENARIO.items():
+            parser.add_argument(f'--{entidad}', type=int, default=total // 100,
+                                help=f'Cantidad a crear (por defecto {total // 100})')
+        parser.add_argument('--semilla', type=int, default=0)
+        parser.add_argument('--lote', type=int, default=LOTE, help='Filas por INSERT y por transacción')
+        parser.add_argument('--procesos', type=int, default=0,
+                            help='Hashea la contraseña de cada usuario por separado con tantos procesos. '
+                                 'Por defecto todos comparten un único hash (mucho más rápido)')
+        parser.add_argument('--seguro', action='store_true',
+                            help='En SQLite no desactiva synchronous durante la carga')
+
+    def handle(self, *args, **opciones):
+        totales = {entidad: opciones[entidad] for entidad in ESCENARIO}
+        if any(total < 0 for total in totales.values()):
+            raise CommandError('Las cantidades no pueden ser negativas')
+
+        for alias in {DEFAULT_DB_ALIAS, *shards.aliases()}:
+            conexion = connections[alias]
+            if conexion.vendor == 'sqlite' and not opciones['seguro']:
+                # Si se corta la carga se vuelve a generar: no vale la pena un fsync por lote
+                with conexion.cursor() as cursor:
+                    cursor.execute('PRAGMA synchronous = OFF')
+
+        self.stdout.write('Generando: ' + ', '.join(f'{v} {k}' for k, v in totales.items()))
+        inicio = time.monotonic()
+        ultimo = [inicio]
+
+        def informar(mensaje):
+            ahora = time.monotonic()
+            if ahora - ultimo[0] >= 5:
+                ultimo[0] = ahora
+                self.stdout.write(f'  {mensaje} ({ahora - inicio:.0f}s)')
+
+        generador = Generador(
+            opciones['semilla'], lote=opciones['lote'], informar=informar, procesos=opciones['procesos']
+        )
+        generador.generar(totales)
+
+        duracion = time.monotonic() - inicio
+        filas = sum(totales.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'{filas} filas principales en {duracion:.1f}s ({filas / duracion:.0f} filas/s)'
+        ))
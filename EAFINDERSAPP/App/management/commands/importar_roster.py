@@ -0,0 +1,52 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from App.roster import LOTE, importar_roster
+
+
+class Command(BaseCommand):
+    help = (
+        'Crea o actualiza usuarios desde un roster CSV (con encabezado) o JSONL. Columnas: '
+        'email_institucional, nombres, apellidos y opcionalmente carrera, semestre, biografia y password.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo')
+        parser.add_argument('--formato', choices=['csv', 'jsonl'], help='Por defecto según la extensión')
+        parser.add_argument('--lote', type=int, default=LOTE)
+        parser.add_argument('--procesos', type=int, help='Procesos para hashear contraseñas (por defecto, uno por CPU)')
+        parser.add_argument('--validar', action='store_true', help='Solo valida el archivo, no guarda nada')
+        parser.add_argument('--borrar', action='store_true',
+                            help='Borra el archivo al terminar (el admin deja aquí los rosters grandes, con contraseñas en claro)')
+
+    def handle(self, *args, **opciones):
+        inicio = time.monotonic()
+        ultimo = [inicio]
+
+        def progreso(resultado):
+            ahora = time.monotonic()
+            if ahora - ultimo[0] >= 2:
+                ultimo[0] = ahora
+                self.stdout.write(f'  {resultado} ({resultado.leidas / (ahora - inicio):.0f} filas/s)')
+
+        try:
+            archivo = open(opciones['archivo'], 'rb')
+        except OSError as error:
+            raise CommandError(f'No se pudo abrir {opciones["archivo"]}: {error}')
+        try:
+            with archivo:
+                resultado = importar_roster(
+                    archivo, formato=opciones['formato'], lote=opciones['lote'], procesos=opciones['procesos'],
+                    validar=opciones['validar'], progreso=progreso,
+                )
+        finally:
+            if opciones['borrar']:
+                os.remove(opciones['archivo'])
+
+        for linea, mensaje in resultado.errores:
+            self.stderr.write(f'Línea {linea}: {mensaje}')
+        if resultado.invalidas > len(resultado.errores):
+            self.stderr.write(f'... y {resultado.invalidas - len(resultado.errores)} errores más')
+        self.stdout.write(self.style.SUCCESS(f'{resultado} en {time.monotonic() - inicio:.1f}s'))
@@ -0,0 +1,107 @@
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from App.imagenes import FORMATOS, TAMANOS, nombre_derivado
+from App.models import Blob
+from App.signals import CAMPOS_BLOB
+from App.storage import PREFIJO_BLOBS, almacenamiento_por_contenido, es_blob
+
+
+class Command(BaseCommand):
+    help = 'Elimina los blobs subidos que ya no referencia ningún usuario, foro o comentario'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--gracia', type=int, default=60,
+            help='Minutos que se respeta un blob sin referencias (puede ser una subida en curso)'
+        )
+        parser.add_argument(
+            '--recontar', action='store_true',
+            help='Recalcular las referencias recorriendo los modelos antes de limpiar'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Solo mostrar lo que se borraría')
+
+    def handle(self, *args, **options):
+        storage = almacenamiento_por_contenido()
+        limite = timezone.now() - timedelta(minutes=options['gracia'])
+        dry_run = options['dry_run']
+
+        if options['recontar']:
+            self._recontar(dry_run)
+
+        borrados = liberado = 0
+        huerfanos = Blob.objects.filter(referencias__lte=0, fecha_uso__lt=limite)
+        for blob_id, nombre, tamano in huerfanos.values_list('id', 'nombre', 'tamano').iterator():
+            if dry_run:
+                self.stdout.write(f'Se borraría {nombre}')
+            # Se borra la fila solo si sigue sin referencias y sin usarse, por si alguien la tomó
+            # entre tanto (AlmacenamientoPorContenido._save actualiza fecha_uso antes de contarla)
+            elif Blob.objects.filter(id=blob_id, referencias__lte=0, fecha_uso__lt=limite).delete()[0]:
+                if not Blob.objects.filter(nombre=nombre).exists():  # Si no se volvió a subir recién
+                    self._borrar_archivo(storage, nombre)
+            else:
+                continue
+            borrados += 1
+            liberado += tamano
+
+        sueltos = self._archivos_sin_fila(storage, limite.timestamp(), dry_run)
+
+        accion = 'Se borrarían' if dry_run else 'Borrados'
+        self.stdout.write(self.style.SUCCESS(
+            f'{accion} {borrados} blobs huérfanos ({liberado / 2**20:.2f} MB) '
+            f'y {sueltos} archivos sin registro en blobs/'
+        ))
+
+    def _recontar(self, dry_run):
+        conteo = Counter()
+        for modelo, campos in CAMPOS_BLOB.items():
+            for campo in campos:
+                conteo.update(
+                    nombre for nombre in modelo._default_manager.filter(
+                        **{f'{campo}__startswith': PREFIJO_BLOBS}
+                    ).values_list(campo, flat=True).iterator()
+                )
+
+        corregidos = []
+        for blob in Blob.objects.only('id', 'nombre', 'referencias').iterator():
+            if blob.referencias != conteo[blob.nombre]:
+                blob.referencias = conteo[blob.nombre]
+                corregidos.append(blob)
+        if not dry_run:
+            Blob.objects.bulk_update(corregidos, ['referencias'], batch_size=500)
+        self.stdout.write(f'{len(corregidos)} blobs con el conteo de referencias corregido')
+
+    def _borrar_archivo(self, storage, nombre):
+        storage.delete(nombre)
+        for tamano in TAMANOS:
+            for formato in FORMATOS:
+                default_storage.delete(nombre_derivado(nombre, tamano, formato))
+
+    def _archivos_sin_fila(self, storage, limite, dry_run):
+        """Archivos en blobs/ sin fila Blob (p. ej. un proceso que murió a mitad de una subida)"""
+        raiz = storage.path(PREFIJO_BLOBS)
+        if not os.path.isdir(raiz):
+            return 0
+
+        sueltos = 0
+        for directorio, _, archivos in os.walk(raiz):
+            for archivo in archivos:
+                ruta = os.path.join(directorio, archivo)
+                nombre = os.path.relpath(ruta, storage.location).replace(os.sep, '/')
+                if os.path.getmtime(ruta) >= limite:
+                    continue
+                if es_blob(nombre) and not nombre.startswith(f'{PREFIJO_BLOBS}tmp/') \
+                        and Blob.objects.filter(nombre=nombre).exists():
+                    continue
+                if dry_run:
+                    self.stdout.write(f'Se borraría {nombre}')
+                else:
+                    os.remove(ruta)
+                sueltos += 1
+        return sueltos
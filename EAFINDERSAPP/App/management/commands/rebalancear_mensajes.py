@@ -0,0 +1,98 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Count, Q
+
+from App import shards
+from App.generador import sin_auto_now
+from App.models import Mensaje
+
+
+class Command(BaseCommand):
+    help = (
+        'Mueve cada conversación al shard que le toca según MENSAJES_SHARDS (después de agregar un '
+        'shard, o para pasar los mensajes de la tabla vieja en default con --desde default). Los '
+        'mensajes conservan su id.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', nargs='*',
+                            help='Bases a revisar (por defecto todos los shards)')
+        parser.add_argument('--lote', type=int, default=1000, help='Mensajes por transacción')
+        parser.add_argument('--dry-run', action='store_true', help='Solo informa qué se movería')
+
+    def handle(self, *args, **opciones):
+        desde = opciones['desde'] or shards.aliases()
+        desconocidos = [alias for alias in desde if alias not in connections.settings]
+        if desconocidos:
+            raise CommandError(f'Bases desconocidas: {", ".join(desconocidos)}')
+
+        for origen in desde:
+            movimientos = self.planear(origen)
+            conversaciones = sum(len(pares) for pares in movimientos.values())
+            mensajes = sum(n for pares in movimientos.values() for n in pares.values())
+            self.stdout.write(f'{origen}: {conversaciones} conversaciones ({mensajes} mensajes) fuera de lugar')
+            for destino, pares in movimientos.items():
+                self.stdout.write(f'  -> {destino}: {len(pares)} conversaciones, {sum(pares.values())} mensajes')
+                if opciones['dry_run']:
+                    continue
+                for a, b in pares:
+                    self.mover(origen, destino, a, b, opciones['lote'])
+        if opciones['dry_run']:
+            self.stdout.write('Dry run: no se movió nada')
+
+    def planear(self, origen):
+        """{destino: {(a, b): mensajes}} de las conversaciones de `origen` que van a otro shard"""
+        por_par = Counter()
+        filas = (
+            Mensaje.objects.using(origen).order_by()
+            .values_list('remitente_id', 'destinatario_id').annotate(n=Count('id'))
+        )
+        for remitente, destinatario, n in filas.iterator():
+            por_par[min(remitente, destinatario), max(remitente, destinatario)] += n
+
+        movimientos = {}
+        for (a, b), n in por_par.items():
+            destino = shards.shard_de(a, b)
+            if destino != origen:
+                movimientos.setdefault(destino, {})[a, b] = n
+        return movimientos
+
+    def mover(self, origen, destino, a, b, lote):
+        """
+        Copia la conversación por lotes y la borra del origen. El destino confirma antes que el
+        origen: si algo se corta en el medio quedan mensajes repetidos, nunca perdidos.
+
+        Los mensajes conservan su id: los cursores (?desde=, c=amigo:id de la bandeja) y los
+        primer_id/ultimo_id de ArchivoMensajes siguen valiendo. Los shards numeran en rangos
+        separados (shards.primer_id), y el contador del destino queda por encima de lo movido, así
+        que los mensajes nuevos de la conversación siguen teniendo ids mayores. Si un id ya existe
+        en el destino (shards migrados antes de tener rangos) se corta sin mover ese lote.
+        """
+        conversacion = Mensaje.objects.using(origen).filter(
+            Q(remitente_id=a, destinatario_id=b) | Q(remitente_id=b, destinatario_id=a)
+        )
+        while True:
+            with transaction.atomic(using=origen):
+                mensajes = list(conversacion.order_by('id')[:lote])
+                if not mensajes:
+                    return
+                ids = [m.id for m in mensajes]
+                ocupados = list(Mensaje.objects.using(destino).filter(id__in=ids).values_list('id', flat=True))
+                if ocupados:
+                    raise CommandError(
+                        f'{destino} ya tiene mensajes con los ids {sorted(ocupados)[:10]} de la conversación {a}-{b}'
+                    )
+                with transaction.atomic(using=destino), sin_auto_now(Mensaje._meta.get_field('fecha_enviado')):
+                    Mensaje.objects.using(destino).bulk_create(
+                        Mensaje(id=m.id, remitente_id=m.remitente_id, destinatario_id=m.destinatario_id,
+                                contenido=m.contenido, fecha_enviado=m.fecha_enviado)
+                        for m in mensajes
+                    )
+                    # SQLite (AUTOINCREMENT) ya sube solo el contador; PostgreSQL necesita setval
+                    with connections[destino].cursor() as cursor:
+                        for sql in connections[destino].ops.sequence_reset_sql(no_style(), [Mensaje]):
+                            cursor.execute(sql)
+                Mensaje.objects.using(origen).filter(id__in=ids).delete()
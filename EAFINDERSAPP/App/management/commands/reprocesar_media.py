@@ -0,0 +1,189 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import models
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from App.imagenes import FORMATOS, TAMANOS, nombre_derivado, renderizar
+from App.signals import CAMPOS_BLOB
+from App.storage import almacenamiento_por_contenido, es_blob, nombre_blob
+
+# Formatos que se vuelven a codificar; el resto (GIF animados, PDFs, ...) solo se cuenta
+FORMATOS_RECODIFICABLES = {'JPEG', 'PNG', 'WEBP'}
+
+
+def _escribir_atomico(ruta, datos):
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta.with_name(f'.{ruta.name}.tmp')
+    temporal.write_bytes(datos)
+    os.replace(temporal, ruta)
+
+
+def _procesar(media_root, nombre, max_lado, calidad, derivados):
+    """
+    Reduce, limpia el EXIF y vuelve a codificar una imagen, y genera sus miniaturas.
+    Corre en un proceso del pool, así que trabaja directo sobre rutas de MEDIA_ROOT.
+    Devuelve (nombre, bytes_antes, bytes_despues, error, blob_nuevo).
+
+    Un blob no se reescribe: su nombre es el hash de su contenido y lo pueden compartir varias
+    filas. La versión nueva queda en un temporal y blob_nuevo es (ruta del temporal, nombre del
+    blob que le toca); el comando la guarda como otro blob y cambia las referencias.
+    """
+    ruta = Path(media_root) / nombre
+    try:
+        antes = ruta.stat().st_size
+    except OSError as e:
+        return nombre, 0, 0, f'no existe ({e.strerror})', None
+
+    try:
+        with open(ruta, 'rb') as original:
+            imagen_original = Image.open(original)
+            formato = imagen_original.format
+            tenia_exif = bool(imagen_original.getexif())
+            animada = getattr(imagen_original, 'is_animated', False)
+            imagen = ImageOps.exif_transpose(imagen_original)
+            imagen.load()
+    except UnidentifiedImageError:
+        return nombre, antes, antes, None, None  # No es una imagen (p. ej. un adjunto PDF)
+    except (OSError, Image.DecompressionBombError) as e:
+        return nombre, antes, antes, str(e), None
+
+    despues = antes
+    blob_nuevo = None
+    if formato in FORMATOS_RECODIFICABLES and not animada:
+        reducida = max(imagen.size) > max_lado
+        if reducida:
+            imagen.thumbnail((max_lado, max_lado), Image.Resampling.LANCZOS)
+        if formato == 'JPEG' and imagen.mode != 'RGB':
+            imagen = imagen.convert('RGB')
+
+        temporal = ruta.with_name(f'.{ruta.name}.tmp')
+        opciones = {'quality': calidad, 'optimize': True} if formato != 'PNG' else {'optimize': True}
+        imagen.save(temporal, formato, **opciones)  # Sin exif=..., así que se descarta
+        nuevo = temporal.stat().st_size
+        if not (reducida or tenia_exif or nuevo < antes):
+            temporal.unlink()
+        elif es_blob(nombre):
+            digest = hashlib.sha256(temporal.read_bytes()).hexdigest()
+            blob_nuevo = (str(temporal), nombre_blob(digest, os.path.splitext(nombre)[1].lower()))
+            despues = nuevo
+        else:
+            os.replace(temporal, ruta)
+            despues = nuevo
+
+    if derivados:
+        # Las miniaturas van con el nombre que va a quedar en las filas
+        base = blob_nuevo[1] if blob_nuevo else nombre
+        for tamano in TAMANOS:
+            for formato_derivado in FORMATOS:
+                destino = Path(media_root) / nombre_derivado(base, tamano, formato_derivado)
+                if not destino.exists():
+                    _escribir_atomico(destino, renderizar(imagen, tamano, formato_derivado))
+
+    return nombre, antes, despues, None, blob_nuevo
+
+
+class Command(BaseCommand):
+    help = (
+        'Reduce, quita el EXIF, vuelve a codificar y genera miniaturas de todos los archivos '
+        'referenciados por ImageField/FileField, en paralelo y con punto de control para reanudar'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--max-lado', type=int, default=2048, help='Lado mayor máximo en px')
+        parser.add_argument('--calidad', type=int, default=85)
+        parser.add_argument('--sin-derivados', action='store_true', help='No generar miniaturas')
+        parser.add_argument(
+            '--checkpoint', default=str(Path(settings.MEDIA_ROOT) / '.reprocesar_media.checkpoint'),
+            help='Archivo con los nombres ya procesados (uno por línea)'
+        )
+        parser.add_argument('--reiniciar', action='store_true', help='Ignorar el punto de control')
+
+    def _referencias(self):
+        """Nombres distintos guardados en todos los FileField/ImageField de todos los modelos"""
+        nombres = set()
+        for modelo in apps.get_models():
+            for campo in modelo._meta.get_fields():
+                if isinstance(campo, models.FileField):
+                    nombres.update(
+                        modelo._default_manager.exclude(**{campo.name: ''})
+                        .exclude(**{f'{campo.name}__isnull': True})
+                        .values_list(campo.name, flat=True).distinct().iterator()
+                    )
+        return sorted(nombres)
+
+    def _reemplazar_blob(self, nombre, temporal):
+        """
+        Guarda la versión nueva de un blob como otro blob y pasa a ella las filas que usaban el
+        viejo. Se guarda fila por fila para que las señales muevan las referencias (y se
+        invaliden las tarjetas de perfil); el viejo queda sin referencias y lo borra limpiar_blobs.
+        """
+        try:
+            with open(temporal, 'rb') as archivo:
+                nuevo = almacenamiento_por_contenido().save(nombre, File(archivo))
+        finally:
+            os.remove(temporal)
+        for modelo, campos in CAMPOS_BLOB.items():
+            for campo in campos:
+                for instancia in modelo._default_manager.filter(**{campo: nombre}).only('pk', campo):
+                    setattr(instancia, campo, nuevo)
+                    instancia.save(update_fields=[campo])
+        return nuevo
+
+    def handle(self, *args, **options):
+        checkpoint = Path(options['checkpoint'])
+        if options['reiniciar'] and checkpoint.exists():
+            checkpoint.unlink()
+        hechos = set(checkpoint.read_text().splitlines()) if checkpoint.exists() else set()
+
+        pendientes = [nombre for nombre in self._referencias() if nombre not in hechos]
+        self.stdout.write(f'{len(pendientes)} archivos pendientes ({len(hechos)} ya procesados)')
+        if not pendientes:
+            return
+
+        total_antes = total_despues = errores = 0
+        inicio = time.monotonic()
+        with open(checkpoint, 'a') as registro, ProcessPoolExecutor(options['procesos']) as pool:
+            tareas = [
+                pool.submit(_procesar, str(settings.MEDIA_ROOT), nombre, options['max_lado'],
+                            options['calidad'], not options['sin_derivados'])
+                for nombre in pendientes
+            ]
+            try:
+                for i, tarea in enumerate(as_completed(tareas), start=1):
+                    nombre, antes, despues, error, blob_nuevo = tarea.result()
+                    if error:
+                        errores += 1
+                        self.stderr.write(f'{nombre}: {error}')
+                    else:
+                        total_antes += antes
+                        total_despues += despues
+                    if blob_nuevo:
+                        # El blob nuevo también se marca: volver a codificarlo solo perdería calidad
+                        registro.write(self._reemplazar_blob(nombre, blob_nuevo[0]) + '\n')
+                    # Los errores también se marcan: reintentarlos no los va a arreglar
+                    registro.write(nombre + '\n')
+                    registro.flush()
+                    if i % 100 == 0:
+                        self.stdout.write(f'{i}/{len(pendientes)}')
+            except KeyboardInterrupt:
+                pool.shutdown(cancel_futures=True)
+                self.stderr.write('Interrumpido; vuelve a ejecutar el comando para continuar.')
+                raise
+
+        segundos = max(time.monotonic() - inicio, 1e-9)
+        ahorrado = total_antes - total_despues
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(pendientes)} archivos en {segundos:.1f}s '
+            f'({len(pendientes) / segundos:.1f} archivos/s, {total_antes / segundos / 2**20:.1f} MB/s), '
+            f'{errores} errores. Ahorrados {ahorrado / 2**20:.2f} MB '
+            f'({total_antes / 2**20:.2f} MB -> {total_despues / 2**20:.2f} MB)'
+        ))
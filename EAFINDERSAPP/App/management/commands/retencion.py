@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from App import retencion, shards
+
+
+def _dias(valor):
+    # 'no' desactiva esa política para esta corrida
+    return None if valor.lower() == 'no' else int(valor)
+
+
+class Command(BaseCommand):
+    help = (
+        'Aplica las políticas de RETENCION: archiva comprimidos los mensajes viejos (en cada shard) '
+        'y borra las solicitudes de amistad rechazadas hace tiempo, que así se pueden volver a enviar.'
+    )
+
+    def add_arguments(self, parser):
+        politicas = retencion.RETENCION
+        parser.add_argument('--mensajes-dias', type=_dias, default=politicas['mensajes_dias'],
+                            help=f'Archivar mensajes de más de N días ("no" para saltarlos; '
+                                 f'por defecto {politicas["mensajes_dias"]})')
+        parser.add_argument('--rechazadas-dias', type=_dias, default=politicas['rechazadas_dias'],
+                            help=f'Borrar solicitudes rechazadas de más de N días ("no" para saltarlas; '
+                                 f'por defecto {politicas["rechazadas_dias"]})')
+        parser.add_argument('--lote', type=int, default=politicas['lote'], help='Filas por transacción')
+        parser.add_argument('--pausa', type=float, default=politicas['pausa'],
+                            help='Segundos entre lotes, para dejar pasar a los escritores')
+        parser.add_argument('--dry-run', action='store_true', help='Solo informa qué se haría')
+
+    def handle(self, *args, **opciones):
+        mensajes_dias, rechazadas_dias = opciones['mensajes_dias'], opciones['rechazadas_dias']
+        if any(dias is not None and dias < 0 for dias in (mensajes_dias, rechazadas_dias)) or opciones['lote'] < 1:
+            raise CommandError('Los días no pueden ser negativos y el lote debe ser positivo')
+
+        if opciones['dry_run']:
+            self._informar(retencion.informe(mensajes_dias, rechazadas_dias))
+            return
+
+        if mensajes_dias is not None:
+            for alias in shards.aliases():
+                mensajes, lotes, tamano = retencion.archivar_mensajes(
+                    alias, mensajes_dias, opciones['lote'], opciones['pausa']
+                )
+                self.stdout.write(f'{alias}: {mensajes} mensajes archivados en {lotes} lotes ({tamano / 2**10:.1f} KB)')
+        if rechazadas_dias is not None:
+            borradas = retencion.purgar_rechazadas(rechazadas_dias, opciones['lote'], opciones['pausa'])
+            self.stdout.write(f'{borradas} solicitudes rechazadas borradas')
+        self.stdout.write(self.style.SUCCESS('Retención aplicada'))
+
+    def _informar(self, informe):
+        for alias, datos in informe['mensajes'].items():
+            desde = f', el más viejo del {datos["desde"]:%Y-%m-%d}' if datos['desde'] else ''
+            self.stdout.write(
+                f'{alias}: se archivarían {datos["cantidad"]} mensajes{desde} '
+                f'(~{datos["bytes"] / 2**10:.1f} KB comprimidos)'
+            )
+        if informe['rechazadas'] is not None:
+            self.stdout.write(f'Se borrarían {informe["rechazadas"]} solicitudes rechazadas')
+        self.stdout.write('Dry run: no se cambió nada')
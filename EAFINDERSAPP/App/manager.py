@@ -1,5 +1,5 @@
 from django.db import models
-from .querysets import ForoQuerySet
+from .querysets import ForoQuerySet, MensajeQuerySet
 
 class ForoManager(models.Manager):
     def get_queryset(self):
@@ -14,3 +14,14 @@ class ForoManager(models.Manager):
 
     def por_etiqueta(self, etiqueta_nombre):
         return self.get_queryset().por_etiqueta(etiqueta_nombre)
+
+    def tendencia(self, dias=7):
+        return self.get_queryset().tendencia(dias)
+
+
+class MensajeManager(models.Manager):
+    def get_queryset(self):
+        return MensajeQuerySet(self.model, using=self._db)
+
+    def conversacion(self, usuario_a, usuario_b):
+        return self.get_queryset().conversacion(usuario_a, usuario_b)
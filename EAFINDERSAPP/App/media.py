@@ -0,0 +1,135 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from .storage import PREFIJO_BLOBS
+
+TAMANO_CHUNK = 64 * 1024
+# None (Django lee el archivo), 'x-sendfile' (Apache/lighttpd) o 'x-accel-redirect' (nginx)
+MEDIA_SENDFILE = getattr(settings, 'MEDIA_SENDFILE', None)
+# Location interna de nginx que apunta a MEDIA_ROOT, solo para 'x-accel-redirect'
+MEDIA_ACCEL_PREFIJO = getattr(settings, 'MEDIA_ACCEL_PREFIJO', '/media-interno/')
+MEDIA_MAX_AGE = getattr(settings, 'MEDIA_MAX_AGE', 3600)
+
+_RANGO = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _es_inmutable(path):
+    # Los blobs (y sus miniaturas) se nombran por su hash: si cambia el contenido cambia la URL
+    return path.startswith(PREFIJO_BLOBS) or path.startswith(f'derivados/{PREFIJO_BLOBS}')
+
+
+def _rango(request, tamano, etag, modificado):
+    """
+    (inicio, fin) inclusivos del Range pedido; None para servir el archivo completo y
+    False si el rango no se puede satisfacer. Solo se atiende un rango: con varios,
+    o si If-Range ya no coincide, se responde el archivo completo como permite la RFC.
+    """
+    cabecera = request.headers.get('Range')
+    if not cabecera:
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != modificado:
+        return None
+
+    coincidencia = _RANGO.match(cabecera.strip())
+    if not coincidencia or coincidencia.groups() == ('', ''):
+        return None
+    inicio, fin = coincidencia.groups()
+    if inicio == '':
+        # bytes=-N: los últimos N bytes
+        inicio, fin = max(tamano - int(fin), 0), tamano - 1
+    else:
+        inicio, fin = int(inicio), min(int(fin), tamano - 1) if fin else tamano - 1
+    if inicio >= tamano or inicio > fin:
+        return False
+    return inicio, fin
+
+
+def _leer(ruta, inicio, longitud):
+    with open(ruta, 'rb') as archivo:
+        archivo.seek(inicio)
+        while longitud > 0:
+            chunk = archivo.read(min(TAMANO_CHUNK, longitud))
+            if not chunk:
+                break
+            longitud -= len(chunk)
+            yield chunk
+
+
+def servir_media(request, path):
+    """
+    Sirve los archivos de MEDIA_ROOT por chunks, con ETag/Last-Modified (304), Range (206)
+    y, si MEDIA_SENDFILE está configurado, delegando el envío al servidor web.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    # Los temporales y puntos de control (.archivo, blobs/tmp/) no son públicos
+    if any(parte.startswith('.') for parte in path.split('/')) or path.startswith(f'{PREFIJO_BLOBS}tmp/'):
+        raise Http404
+    try:
+        ruta = safe_join(settings.MEDIA_ROOT, path)
+        estado = os.stat(ruta)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not os.path.isfile(ruta):
+        raise Http404
+
+    tamano = estado.st_size
+    modificado = int(estado.st_mtime)
+    etag = f'"{estado.st_mtime_ns:x}-{tamano:x}"'
+    tipo, codificacion = mimetypes.guess_type(ruta)
+    tipo = tipo or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=modificado)
+    if response is None:
+        rango = _rango(request, tamano, etag, modificado)
+        if rango is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{tamano}'
+            return response
+
+        if MEDIA_SENDFILE:
+            # El servidor web se encarga del cuerpo y de los rangos
+            response = HttpResponse(content_type=tipo)
+            if MEDIA_SENDFILE == 'x-accel-redirect':
+                response['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIJO + path
+            else:
+                response['X-Sendfile'] = ruta
+        elif request.method == 'HEAD':
+            response = HttpResponse(content_type=tipo)
+            response['Content-Length'] = tamano
+        elif rango:
+            inicio, fin = rango
+            response = StreamingHttpResponse(
+                _leer(ruta, inicio, fin - inicio + 1), status=206, content_type=tipo
+            )
+            response['Content-Length'] = fin - inicio + 1
+            response['Content-Range'] = f'bytes {inicio}-{fin}/{tamano}'
+        else:
+            # FileResponse usa wsgi.file_wrapper (sendfile del servidor WSGI) cuando existe
+            response = FileResponse(open(ruta, 'rb'), content_type=tipo)
+            response.block_size = TAMANO_CHUNK
+
+        if codificacion:
+            response['Content-Encoding'] = codificacion
+        if not tipo.startswith('image/'):
+            # Los adjuntos de comentarios los sube cualquiera: que no se rendericen en nuestro dominio
+            response['Content-Disposition'] = 'attachment'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modificado)
+    response['Accept-Ranges'] = 'bytes'
+    response['X-Content-Type-Options'] = 'nosniff'
+    if _es_inmutable(path):
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = f'public, max-age={MEDIA_MAX_AGE}'
+    return response
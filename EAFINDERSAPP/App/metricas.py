@@ -0,0 +1,201 @@
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Límites (en segundos) de los buckets de los histogramas de latencia
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Cada worker que atiende peticiones vuelca sus métricas a <METRICAS_DIR>/<pid>.json y /metrics
+# suma todos los archivos; así funciona con varios workers de gunicorn/uwsgi sin servicios
+# externos. Los archivos de workers que ya terminaron los absorbe un worker vivo, para que el
+# total no baje y el directorio no crezca con cada reinicio
+METRICAS_DIR = getattr(settings, 'METRICAS_DIR', None)
+METRICAS_INTERVALO = getattr(settings, 'METRICAS_INTERVALO', 5)
+
+_AYUDA = {
+    'eafinders_peticiones_total': ('counter', 'Peticiones atendidas por vista, método y estado'),
+    'eafinders_peticion_segundos': ('histogram', 'Latencia de las peticiones por vista'),
+    'eafinders_db_segundos': ('histogram', 'Tiempo en la base de datos por petición y vista'),
+    'eafinders_cache_total': ('counter', 'Aciertos y fallos de las cachés de la aplicación'),
+}
+
+
+def _clave(nombre, etiquetas):
+    return json.dumps([nombre, sorted(etiquetas.items())])
+
+
+class RegistroMetricas:
+    """Contadores e histogramas en memoria de este proceso, con volcado periódico a disco.
+
+    Solo vuelca después de activar(), que llama MetricasMiddleware: manage.py, los tests y los
+    procesos del pool no dejan archivos.
+    """
+
+    def __init__(self, directorio=None, intervalo=5):
+        self.directorio = Path(directorio) if directorio else None
+        self.intervalo = intervalo
+        self.activo = False
+        self._lock = threading.Lock()
+        self._contadores = {}
+        self._histogramas = {}  # clave -> [conteo por bucket..., +Inf, suma]
+        self._ultimo_volcado = time.monotonic()
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = _clave(nombre, etiquetas)
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+        self._volcar_si_toca()
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = _clave(nombre, etiquetas)
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = [0] * (len(BUCKETS) + 2)
+            histograma[bisect_left(BUCKETS, valor)] += 1
+            histograma[-1] += valor
+        self._volcar_si_toca()
+
+    def instantanea(self):
+        with self._lock:
+            return {
+                'contadores': dict(self._contadores),
+                'histogramas': {clave: list(valores) for clave, valores in self._histogramas.items()},
+            }
+
+    def activar(self):
+        if not self.activo:
+            self.activo = True
+            atexit.register(self.volcar)
+
+    def _archivo(self):
+        return self.directorio / f'{os.getpid()}.json'
+
+    def _volcar_si_toca(self):
+        if self.activo and self.directorio and time.monotonic() - self._ultimo_volcado >= self.intervalo:
+            self.volcar()
+
+    def volcar(self):
+        if not (self.activo and self.directorio):
+            return
+        self._ultimo_volcado = time.monotonic()
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        temporal = self._archivo().with_suffix('.tmp')
+        temporal.write_text(json.dumps(self.instantanea()))
+        os.replace(temporal, self._archivo())
+
+    def _absorber(self, archivo):
+        """Suma a este proceso el archivo de un worker que ya terminó y lo borra"""
+        reclamado = archivo.with_suffix(f'.{os.getpid()}.absorbiendo')
+        try:
+            os.replace(archivo, reclamado)  # Si dos workers lo ven a la vez, solo uno lo renombra
+        except FileNotFoundError:
+            return
+        try:
+            instantanea = json.loads(reclamado.read_text())
+        except (OSError, ValueError):
+            instantanea = {'contadores': {}, 'histogramas': {}}
+        with self._lock:
+            _sumar(self._contadores, self._histogramas, instantanea)
+        self.volcar()
+        reclamado.unlink()
+
+    def agregado(self):
+        """Suma de este proceso (en vivo) y de lo volcado por los demás procesos"""
+        instantaneas = []
+        if self.directorio and self.directorio.is_dir():
+            propio = self._archivo()
+            for archivo in list(self.directorio.glob('*.json')):
+                if archivo == propio:
+                    continue
+                if self.activo and archivo.stem.isdigit() and not _vivo(int(archivo.stem)):
+                    self._absorber(archivo)
+                    continue
+                try:
+                    instantaneas.append(json.loads(archivo.read_text()))
+                except (OSError, ValueError):
+                    continue  # Otro proceso lo está reemplazando justo ahora
+
+        contadores, histogramas = {}, {}
+        for instantanea in [self.instantanea(), *instantaneas]:
+            _sumar(contadores, histogramas, instantanea)
+        return contadores, histogramas
+
+
+def _sumar(contadores, histogramas, instantanea):
+    for clave, valor in instantanea['contadores'].items():
+        contadores[clave] = contadores.get(clave, 0) + valor
+    for clave, valores in instantanea['histogramas'].items():
+        acumulado = histogramas.setdefault(clave, [0] * len(valores))
+        for i, valor in enumerate(valores):
+            acumulado[i] += valor
+
+
+def _vivo(pid):
+    if os.name == 'nt':
+        return True  # En Windows os.kill(pid, 0) termina el proceso
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Existe, pero es de otro usuario
+    return True
+
+
+def _formatear_etiquetas(etiquetas):
+    if not etiquetas:
+        return ''
+    partes = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for k, v in etiquetas
+    )
+    return '{' + partes + '}'
+
+
+def texto_prometheus(registro):
+    contadores, histogramas = registro.agregado()
+    series = {}
+    for clave, valor in contadores.items():
+        nombre, etiquetas = json.loads(clave)
+        series.setdefault(nombre, []).append(f'{nombre}{_formatear_etiquetas(etiquetas)} {valor}')
+    for clave, valores in histogramas.items():
+        nombre, etiquetas = json.loads(clave)
+        lineas = series.setdefault(nombre, [])
+        acumulado = 0
+        for limite, conteo in zip(BUCKETS + ('+Inf',), valores[:-1]):
+            acumulado += conteo
+            lineas.append(f'{nombre}_bucket{_formatear_etiquetas(etiquetas + [["le", limite]])} {acumulado}')
+        lineas.append(f'{nombre}_sum{_formatear_etiquetas(etiquetas)} {valores[-1]}')
+        lineas.append(f'{nombre}_count{_formatear_etiquetas(etiquetas)} {acumulado}')
+
+    salida = []
+    for nombre in sorted(series):
+        tipo, ayuda = _AYUDA.get(nombre, ('untyped', nombre))
+        salida.append(f'# HELP {nombre} {ayuda}')
+        salida.append(f'# TYPE {nombre} {tipo}')
+        salida.extend(series[nombre])
+    return '\n'.join(salida) + '\n'
+
+
+registro = RegistroMetricas(METRICAS_DIR, METRICAS_INTERVALO)
+
+
+def registrar_cache(cache, acierto, cantidad=1):
+    if cantidad:
+        registro.incrementar('eafinders_cache_total', cantidad, cache=cache, resultado='hit' if acierto else 'miss')
+
+
+def exponer_metricas(request):
+    """/metrics en formato de texto de Prometheus, sumando todos los procesos"""
+    permitidas = getattr(settings, 'METRICAS_IPS_PERMITIDAS', ['127.0.0.1', '::1'])
+    if not (settings.DEBUG or request.META.get('REMOTE_ADDR') in permitidas or request.user.is_staff):
+        return HttpResponseForbidden()
+    return HttpResponse(texto_prometheus(registro), content_type='text/plain; version=0.0.4; charset=utf-8')
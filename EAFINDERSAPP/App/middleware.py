@@ -0,0 +1,231 @@
+import json
+import logging
+import random
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metricas import registro as metricas
+
+logger = logging.getLogger('App.sql')
+
+# IN (%s, %s, %s) cambia con cada lista; para agrupar consultas iguales se colapsa a IN (...)
+_LISTA_PARAMETROS = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_DIRECTORIO_PROYECTO = str(settings.BASE_DIR)
+
+
+@contextmanager
+def envolver_consultas(wrapper):
+    """execute_wrapper en todas las conexiones (también las de los shards)"""
+    with ExitStack() as pila:
+        for conexion in connections.all():
+            pila.enter_context(conexion.execute_wrapper(wrapper))
+        yield
+
+
+class MiddlewareHibrido:
+    """
+    Base de los middleware del proyecto: síncronos con WSGI y async con ASGI, para que una vista
+    async (el long-poll de App/eventos.py) no ocupe un hilo mientras espera. Las subclases
+    implementan antes(request) -> estado, envolver(request, estado) -> contexto alrededor de
+    get_response y despues(request, response, estado) -> response.
+    """
+    sync_capable = True
+    async_capable = True
+    # Las conexiones son de cada hilo: lo que envuelve consultas se pone en el hilo donde corre el
+    # código síncrono de la petición (sync_to_async), no en el del event loop
+    envolver_en_hilo = False
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def antes(self, request):
+        return None
+
+    def despues(self, request, response, estado):
+        return response
+
+    def envolver(self, request, estado):
+        return ExitStack()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        estado = self.antes(request)
+        with self.envolver(request, estado):
+            response = self.get_response(request)
+        return self.despues(request, response, estado)
+
+    async def __acall__(self, request):
+        estado = self.antes(request)
+        if not self.envolver_en_hilo:
+            with self.envolver(request, estado):
+                response = await self.get_response(request)
+            return self.despues(request, response, estado)
+        pila = ExitStack()
+        await sync_to_async(pila.enter_context)(self.envolver(request, estado))
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(pila.close)()
+        return self.despues(request, response, estado)
+
+
+def plantilla_sql(sql):
+    return _LISTA_PARAMETROS.sub('(...)', sql)
+
+
+def origen_consulta():
+    """
+    'plantilla.html:42' del nodo de plantilla que disparó la consulta, o 'archivo.py:10' del
+    código del proyecto más cercano si no viene de una plantilla. Solo se llama una vez por
+    consulta sospechosa, porque recorrer la pila no es gratis.
+    """
+    codigo = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_name == 'render_annotated':
+            nodo = frame.f_locals.get('self')
+            token, origin = getattr(nodo, 'token', None), getattr(nodo, 'origin', None)
+            if token is not None and origin is not None:
+                return f'{origin.template_name}:{token.lineno}'
+        nombre = frame.f_code.co_filename
+        if codigo is None and nombre.startswith(_DIRECTORIO_PROYECTO) and 'middleware' not in nombre:
+            codigo = f'{nombre[len(_DIRECTORIO_PROYECTO) + 1:]}:{frame.f_lineno}'
+        frame = frame.f_back
+    return codigo
+
+
+class RegistroSQL:
+    """execute_wrapper que cuenta y cronometra las consultas de una petición"""
+
+    def __init__(self, umbral_n1):
+        self.umbral_n1 = umbral_n1
+        self.total = 0
+        self.segundos = 0.0
+        self.plantillas = Counter()
+        self.origenes = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.segundos += time.perf_counter() - inicio
+            self.total += 1
+            plantilla = plantilla_sql(sql)
+            self.plantillas[plantilla] += 1
+            if self.plantillas[plantilla] == self.umbral_n1:
+                self.origenes[plantilla] = origen_consulta()
+
+    def sospechosas(self):
+        """Consultas repetidas al menos umbral_n1 veces: casi siempre un N+1"""
+        return [
+            {'sql': plantilla[:300], 'veces': veces, 'origen': self.origenes.get(plantilla)}
+            for plantilla, veces in self.plantillas.most_common()
+            if veces >= self.umbral_n1
+        ]
+
+
+class SQLInstrumentacionMiddleware(MiddlewareHibrido):
+    """
+    Mide las consultas de cada petición y marca los posibles N+1.
+
+    Añade Server-Timing (db;dur=...) a la respuesta y escribe una línea JSON en el logger
+    App.sql. Se activa con SQL_INSTRUMENTACION; SQL_INSTRUMENTACION_MUESTREO (0-1) limita
+    qué fracción de las peticiones se mide, para poder dejarlo encendido en producción.
+    """
+    envolver_en_hilo = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SQL_INSTRUMENTACION', False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.muestreo = getattr(settings, 'SQL_INSTRUMENTACION_MUESTREO', 1.0)
+        self.umbral_n1 = getattr(settings, 'SQL_N1_UMBRAL', 5)
+
+    def antes(self, request):
+        if self.muestreo < 1 and random.random() >= self.muestreo:
+            return None
+        return RegistroSQL(self.umbral_n1)
+
+    def envolver(self, request, registro):
+        return envolver_consultas(registro) if registro else ExitStack()
+
+    def despues(self, request, response, registro):
+        if registro is None:
+            return response
+
+        milisegundos = registro.segundos * 1000
+        metrica = f'db;dur={milisegundos:.1f};desc="{registro.total} consultas"'
+        if response.has_header('Server-Timing'):
+            metrica = f'{response["Server-Timing"]}, {metrica}'
+        response['Server-Timing'] = metrica
+
+        sospechosas = registro.sospechosas()
+        match = getattr(request, 'resolver_match', None)
+        linea = {
+            'vista': match.view_name if match else None,
+            'metodo': request.method,
+            'ruta': request.path,
+            'estado': response.status_code,
+            'consultas': registro.total,
+            'sql_ms': round(milisegundos, 1),
+            'n1': sospechosas,
+        }
+        logger.log(logging.WARNING if sospechosas else logging.INFO, json.dumps(linea, ensure_ascii=False))
+        return response
+
+
+class CronometroSQL:
+    """execute_wrapper mínimo: solo acumula el tiempo de las consultas"""
+
+    def __init__(self):
+        self.segundos = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.segundos += time.perf_counter() - inicio
+
+
+class MetricasMiddleware(MiddlewareHibrido):
+    """Latencia y tiempo de base de datos de cada petición, por nombre de URL, para /metrics"""
+    envolver_en_hilo = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICAS_ACTIVAS', True):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        metricas.activar()  # Este proceso atiende peticiones: vuelca sus métricas a METRICAS_DIR
+
+    def antes(self, request):
+        return CronometroSQL(), time.perf_counter()
+
+    def envolver(self, request, estado):
+        return envolver_consultas(estado[0])
+
+    def despues(self, request, response, estado):
+        cronometro, inicio = estado
+        duracion = time.perf_counter() - inicio
+
+        match = getattr(request, 'resolver_match', None)
+        # El nombre de la URL y no la ruta: /foros/1/ y /foros/2/ son la misma serie
+        vista = match.view_name if match else 'sin_ruta'
+        metricas.observar('eafinders_peticion_segundos', duracion, vista=vista)
+        metricas.observar('eafinders_db_segundos', cronometro.segundos, vista=vista)
+        metricas.incrementar(
+            'eafinders_peticiones_total', vista=vista, metodo=request.method, estado=response.status_code
+        )
+        return response
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0033_alter_etiqueta_nombre'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='etiqueta',
+            name='seguidores',
+            field=models.ManyToManyField(blank=True, related_name='etiquetas_seguidas', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='Actividad',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('verbo', models.CharField(choices=[('creo', 'creó'), ('like', 'le dio like a'), ('comento', 'comentó en')], max_length=10)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('actor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actividades', to=settings.AUTH_USER_MODEL)),
+                ('foro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actividades', to='App.foro')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FeedItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField()),
+                ('actividad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entregas', to='App.actividad')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='actividad',
+            index=models.Index(fields=['actor', '-fecha', '-id'], name='App_activid_actor_i_dd8c72_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feeditem',
+            index=models.Index(fields=['usuario', '-fecha', '-actividad'], name='App_feedite_usuario_7825fa_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feeditem',
+            constraint=models.UniqueConstraint(fields=('usuario', 'actividad'), name='feeditem_unico'),
+        ),
+    ]
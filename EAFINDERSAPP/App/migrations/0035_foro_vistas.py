@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0034_etiqueta_seguidores_actividad_feeditem_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foro',
+            name='vistas',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:31
+
+import App.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0035_foro_vistas'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='comentario',
+            name='archivo',
+            field=models.FileField(blank=True, null=True, storage=App.storage.almacenamiento_por_contenido, upload_to='comentarios_archivos/'),
+        ),
+        migrations.AlterField(
+            model_name='foro',
+            name='foto_foro',
+            field=models.ImageField(blank=True, null=True, storage=App.storage.almacenamiento_por_contenido, upload_to='foros_media/'),
+        ),
+        migrations.AlterField(
+            model_name='usuario',
+            name='foto_perfil',
+            field=models.ImageField(blank=True, null=True, storage=App.storage.almacenamiento_por_contenido, upload_to='perfil_fotos/'),
+        ),
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=255, unique=True)),
+                ('tamano', models.PositiveBigIntegerField()),
+                ('referencias', models.IntegerField(default=0)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['referencias', 'fecha_creacion'], name='App_blob_referen_368581_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0036_alter_comentario_archivo_alter_foro_foto_foro_and_more'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='amistad',
+            index=models.Index(fields=['user2', 'estado'], name='App_amistad_user2_i_cc7b34_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='amistad',
+            index=models.Index(fields=['fecha_amistad', 'id'], name='App_amistad_fecha_a_bdba06_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comentario',
+            index=models.Index(fields=['foro', 'parent', 'fecha_creacion'], name='App_comenta_foro_id_273105_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comentario',
+            index=models.Index(fields=['fecha_creacion', 'id'], name='App_comenta_fecha_c_a4dea6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foro',
+            index=models.Index(fields=['fecha_creacion', 'id'], name='App_foro_fecha_c_518018_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mensaje',
+            index=models.Index(fields=['fecha_enviado', 'id'], name='App_mensaje_fecha_e_91b038_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(fields=['date_joined', 'id'], name='App_usuario_date_jo_f49fbf_idx'),
+        ),
+    ]
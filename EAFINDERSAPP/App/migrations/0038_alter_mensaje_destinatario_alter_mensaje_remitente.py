@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-19 14:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0037_amistad_app_amistad_user2_i_cc7b34_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mensaje',
+            name='destinatario',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='mensajes_recibidos', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='mensaje',
+            name='remitente',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='mensajes_enviados', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
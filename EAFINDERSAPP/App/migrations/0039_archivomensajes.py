@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0038_alter_mensaje_destinatario_alter_mensaje_remitente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivoMensajes',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('primer_id', models.BigIntegerField()),
+                ('ultimo_id', models.BigIntegerField()),
+                ('desde', models.DateTimeField()),
+                ('hasta', models.DateTimeField()),
+                ('cantidad', models.PositiveIntegerField()),
+                ('datos', models.BinaryField()),
+                ('fecha_archivado', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0039_archivomensajes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foro',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0040_foro_fecha_actualizacion_usuario_fecha_actualizacion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mensaje',
+            index=models.Index(fields=['remitente', 'destinatario', 'id'], name='App_mensaje_remiten_383df6_idx'),
+        ),
+    ]
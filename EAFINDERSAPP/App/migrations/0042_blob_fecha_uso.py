@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:36
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0041_mensaje_app_mensaje_remiten_383df6_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='blob',
+            name='App_blob_referen_368581_idx',
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='fecha_uso',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='blob',
+            index=models.Index(fields=['referencias', 'fecha_uso'], name='App_blob_referen_a52c6d_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:41
+
+from django.db import migrations, models
+
+
+def marcar_no_difundidas(apps, schema_editor):
+    # Las que no tienen ninguna copia en un feed son las que publicar() no repartió (alto grado)
+    Actividad = apps.get_model('App', 'Actividad')
+    Actividad.objects.filter(entregas__isnull=True).update(difundida=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0042_blob_fecha_uso'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='actividad',
+            name='difundida',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name='actividad',
+            index=models.Index(condition=models.Q(('difundida', False)), fields=['actor', '-fecha', '-id'], name='actividad_al_vuelo'),
+        ),
+        migrations.RunPython(marcar_no_difundidas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-19 16:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0043_actividad_difundida'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Version',
+            fields=[
+                ('pagina', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('numero', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
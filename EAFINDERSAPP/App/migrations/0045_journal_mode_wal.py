@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:02
+
+from django.db import migrations
+
+
+def activar_wal(apps, schema_editor):
+    # journal_mode queda guardado en el archivo: las conexiones ya no lo piden (App/backends/sqlite_wal)
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode = wal')
+
+
+def desactivar_wal(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode = delete')
+
+
+class Migration(migrations.Migration):
+    # No se puede cambiar de journal_mode dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('App', '0044_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(activar_wal, desactivar_wal),
+        # Los shards de mensajes solo migran lo de Mensaje (RouterMensajes)
+        migrations.RunPython(activar_wal, desactivar_wal, hints={'model_name': 'mensaje'}),
+    ]
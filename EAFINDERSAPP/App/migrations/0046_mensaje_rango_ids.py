@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:40
+
+from django.db import migrations
+
+from App.shards import reservar_rango
+
+
+def reservar(apps, schema_editor):
+    # Cada shard numera sus mensajes en su propio rango (App/shards.py)
+    reservar_rango(schema_editor.connection, apps.get_model('App', 'Mensaje')._meta.db_table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('App', '0045_journal_mode_wal'),
+    ]
+
+    operations = [
+        migrations.RunPython(reservar, migrations.RunPython.noop, hints={'model_name': 'mensaje'}),
+    ]
@@ -4,7 +4,8 @@ from django.db import models
 from django.conf import settings
 from django.db.models import Q
 from django.utils import timezone
-from .manager import ForoManager
+from .manager import ForoManager, MensajeManager
+from .storage import almacenamiento_por_contenido
 # Solo mantener el modelo Amistad original sin la lógica de negocio
 class Amistad(models.Model):
     user1 = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='amigos_user1', on_delete=models.CASCADE)
@@ -12,6 +13,12 @@ class Amistad(models.Model):
     estado = models.CharField(max_length=20, choices=[('pendiente', 'Pendiente'), ('aceptada', 'Aceptada'), ('rechazada', 'Rechazada')], default='pendiente')
     fecha_amistad = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user2', 'estado']),  # Solicitudes pendientes de la navbar
+            models.Index(fields=['fecha_amistad', 'id']),
+        ]
+
     def __str__(self):
         return f'Amistad entre {self.user1} y {self.user2} - {self.estado}'
 
@@ -41,7 +48,7 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
         validators=[RegexValidator(regex=r'^[\w\.-]+@eafit\.edu\.co$', message="El correo debe terminar en @eafit.edu.co")]
     )
     password = models.CharField(max_length=128)
-    foto_perfil = models.ImageField(upload_to='perfil_fotos/', blank=True, null=True)
+    foto_perfil = models.ImageField(upload_to='perfil_fotos/', storage=almacenamiento_por_contenido, blank=True, null=True)
     biografia = models.TextField(blank=True, null=True)
     carrera = models.CharField(max_length=100, blank=True, null=True)
     semestre = models.IntegerField(blank=True, null=True)
@@ -49,25 +56,73 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     date_joined = models.DateTimeField(auto_now_add=True)
+    # Para los ETag de las páginas que muestran el perfil (App/condicional.py)
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = UsuarioManager()
 
+    class Meta:
+        indexes = [models.Index(fields=['date_joined', 'id'])]
+
     USERNAME_FIELD = 'email_institucional'
     REQUIRED_FIELDS = ['nombres', 'apellidos']
 
     def __str__(self):
         return f'{self.nombres} {self.apellidos} ({self.email_institucional})'
 
+    @property
+    def foto_perfil_miniatura(self):
+        """URL de la miniatura de 128px de la foto de perfil (None si no tiene foto)"""
+        if not self.foto_perfil:
+            return None
+        from .imagenes import url_derivado
+        return url_derivado(self.foto_perfil, 128)
+
 class Mensaje(models.Model):
-    remitente = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='mensajes_enviados', on_delete=models.CASCADE)
-    destinatario = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='mensajes_recibidos', on_delete=models.CASCADE)
+    # Los mensajes viven en los shards de MENSAJES_SHARDS (App/shards.py), que pueden ser otra base
+    # que la de Usuario: sin FK en la base, y al borrar un usuario sus mensajes se borran en signals
+    remitente = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='mensajes_enviados',
+                                  on_delete=models.DO_NOTHING, db_constraint=False)
+    destinatario = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='mensajes_recibidos',
+                                     on_delete=models.DO_NOTHING, db_constraint=False)
     contenido = models.TextField()
     fecha_enviado = models.DateTimeField(auto_now_add=True)
 
+    objects = MensajeManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['fecha_enviado', 'id']),
+            models.Index(fields=['remitente', 'destinatario', 'id']),  # Conversaciones y bandeja
+        ]
+
     def __str__(self):
         return f'Mensaje de {self.remitente} a {self.destinatario}'
+
+
+class ArchivoMensajes(models.Model):
+    """
+    Un lote de mensajes viejos sacados de la tabla por el comando retencion, comprimido con zlib
+    (App/retencion.py). Vive en el mismo shard que los mensajes que guarda.
+    """
+    primer_id = models.BigIntegerField()
+    ultimo_id = models.BigIntegerField()
+    desde = models.DateTimeField()
+    hasta = models.DateTimeField()
+    cantidad = models.PositiveIntegerField()
+    datos = models.BinaryField()
+    fecha_archivado = models.DateTimeField(auto_now_add=True)
+
+    def mensajes(self):
+        from .retencion import descomprimir
+        return descomprimir(self.datos)
+
+    def __str__(self):
+        return f'{self.cantidad} mensajes del {self.desde:%Y-%m-%d} al {self.hasta:%Y-%m-%d}'
+
 class Etiqueta(models.Model):
     nombre = models.CharField(max_length=50, unique=True)  # Nombre de la etiqueta
+    seguidores = models.ManyToManyField("Usuario", related_name="etiquetas_seguidas", blank=True)
 
     def __str__(self):
         return self.nombre
@@ -77,15 +132,29 @@ class Foro(models.Model):
     descripcion = models.TextField()
     creador = models.ForeignKey("Usuario", on_delete=models.CASCADE)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
-    foto_foro = models.ImageField(upload_to="foros_media/", blank=True, null=True)
+    foto_foro = models.ImageField(upload_to="foros_media/", storage=almacenamiento_por_contenido, blank=True, null=True)
     likes = models.ManyToManyField("Usuario", related_name="foros_likes", blank=True)
     etiquetas = models.ManyToManyField("Etiqueta", related_name="foros", blank=True)
+    vistas = models.PositiveIntegerField(default=0)  # Se actualiza por lotes desde App.contadores
+    # También cambia con los comentarios, likes y etiquetas del foro (signals); no con las vistas
+    fecha_actualizacion = models.DateTimeField(auto_now=True, db_index=True)
 
     objects = ForoManager()
 
+    class Meta:
+        indexes = [models.Index(fields=['fecha_creacion', 'id'])]
+
     def total_likes(self):
         return self.likes.count()
 
+    @property
+    def foto_foro_miniatura(self):
+        """URL de la miniatura de 512px de la foto del foro (None si no tiene foto)"""
+        if not self.foto_foro:
+            return None
+        from .imagenes import url_derivado
+        return url_derivado(self.foto_foro, 512)
+
     def __str__(self):
         return self.titulo
 
@@ -96,7 +165,85 @@ class Comentario(models.Model):
     contenido = models.TextField()
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='respuestas')
-    archivo = models.FileField(upload_to='comentarios_archivos/', blank=True, null=True)  # Campo para archivos adjuntos
+    archivo = models.FileField(upload_to='comentarios_archivos/', storage=almacenamiento_por_contenido, blank=True, null=True)  # Campo para archivos adjuntos
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['foro', 'parent', 'fecha_creacion']),  # Comentarios raíz de un foro
+            models.Index(fields=['fecha_creacion', 'id']),
+        ]
 
     def __str__(self):
         return f'Comentario de {self.autor} en {self.foro}'
+
+
+class Blob(models.Model):
+    """Archivo subido guardado una sola vez por contenido, con su conteo de referencias."""
+    nombre = models.CharField(max_length=255, unique=True)  # blobs/ab/cd/<sha256>.<ext>
+    tamano = models.PositiveBigIntegerField()
+    referencias = models.IntegerField(default=0)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    # Última vez que se subió este contenido; la gracia de limpiar_blobs cuenta desde aquí
+    fecha_uso = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['referencias', 'fecha_uso'])]
+
+    def __str__(self):
+        return f'{self.nombre} ({self.referencias} referencias)'
+
+
+class Actividad(models.Model):
+    """Registro de lo que hace un usuario en los foros; es la fuente del feed."""
+    VERBOS = [('creo', 'creó'), ('like', 'le dio like a'), ('comento', 'comentó en')]
+
+    actor = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='actividades')
+    foro = models.ForeignKey(Foro, on_delete=models.CASCADE, related_name='actividades')
+    verbo = models.CharField(max_length=10, choices=VERBOS)
+    fecha = models.DateTimeField(auto_now_add=True)
+    # False si el actor tenía demasiados amigos para copiarla a sus feeds: se lee al vuelo
+    difundida = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['actor', '-fecha', '-id']),
+            models.Index(fields=['actor', '-fecha', '-id'], condition=Q(difundida=False), name='actividad_al_vuelo'),
+        ]
+
+    def __str__(self):
+        return f'{self.actor} {self.get_verbo_display()} {self.foro}'
+
+
+class Version(models.Model):
+    """
+    Número que sube cada vez que cambia algo de una página con ETag (App/condicional.py): el GET
+    condicional lee una fila en lugar de agregar toda la tabla. Lo suben los signals y los
+    procesos por lotes que no los mandan.
+    """
+    pagina = models.CharField(max_length=50, primary_key=True)
+    numero = models.PositiveBigIntegerField(default=0)
+
+    @classmethod
+    def subir(cls, pagina):
+        if not cls.objects.filter(pagina=pagina).update(numero=models.F('numero') + 1):
+            _, creada = cls.objects.get_or_create(pagina=pagina, defaults={'numero': 1})
+            if not creada:  # Otro proceso la creó entre el update y el get_or_create
+                cls.objects.filter(pagina=pagina).update(numero=models.F('numero') + 1)
+
+    @classmethod
+    def actual(cls, pagina):
+        return cls.objects.filter(pagina=pagina).values_list('numero', flat=True).first() or 0
+
+    def __str__(self):
+        return f'{self.pagina} v{self.numero}'
+
+
+class FeedItem(models.Model):
+    """Copia de una actividad en el feed de cada amigo (fan-out en escritura)."""
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='feed')
+    actividad = models.ForeignKey(Actividad, on_delete=models.CASCADE, related_name='entregas')
+    fecha = models.DateTimeField()  # Copia de actividad.fecha para paginar solo con el índice
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['usuario', 'actividad'], name='feeditem_unico')]
+        indexes = [models.Index(fields=['usuario', '-fecha', '-actividad'])]
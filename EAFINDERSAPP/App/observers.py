@@ -77,6 +77,29 @@ class NotificacionEmailObserver(Observer):
         except Exception as e:
             print(f"Error enviando email: {e}")
 
+class FeedObserver(Observer):
+    """Observer que mantiene el feed de foros de los amigos"""
+    def update(self, evento, datos):
+        from . import feed
+
+        if evento == 'actividad_registrada':
+            feed.publicar(datos['actividad'])
+        elif evento == 'solicitud_aceptada':
+            feed.conectar_amigos(datos['remitente'], datos['destinatario'])
+
+class EventosObserver(Observer):
+    """Observer que despierta el long-poll de los dos usuarios de la solicitud (App/eventos.py)"""
+    def update(self, evento, datos):
+        from . import eventos
+
+        if evento in ('solicitud_enviada', 'solicitud_aceptada', 'solicitud_rechazada'):
+            eventos.publicar([datos['remitente'].id, datos['destinatario'].id], {
+                'tipo': evento,
+                'amistad': datos['amistad'].id,
+                'remitente': datos['remitente'].id,
+                'destinatario': datos['destinatario'].id,
+            })
+
 class AmistadSubject(Subject):
     """Subject específico para manejar eventos de amistad"""
     
@@ -129,7 +152,33 @@ class AmistadSubject(Subject):
         
         return amistad
 
+class ActividadSubject(Subject):
+    """Subject para la actividad de los usuarios en los foros"""
+
+    def registrar(self, actor, verbo, foro):
+        """Registra que actor creó, le dio like o comentó un foro y notifica"""
+        from .models import Actividad
+
+        actividad = Actividad.objects.create(actor=actor, verbo=verbo, foro=foro)
+
+        self.notify('actividad_registrada', {
+            'actividad': actividad
+        })
+
+        return actividad
+
+    def retirar(self, actor, verbo, foro):
+        """Elimina la actividad (por ejemplo al quitar un like) y sus copias en los feeds"""
+        from .models import Actividad
+
+        Actividad.objects.filter(actor=actor, verbo=verbo, foro=foro).delete()
+
 # Instancia global del subject con observadores simplificados
 amistad_subject = AmistadSubject()
 amistad_subject.attach(NotificacionConsoleObserver())
-amistad_subject.attach(NotificacionEmailObserver())
\ No newline at end of file
+amistad_subject.attach(NotificacionEmailObserver())
+amistad_subject.attach(FeedObserver())
+amistad_subject.attach(EventosObserver())
+
+actividad_subject = ActividadSubject()
+actividad_subject.attach(FeedObserver())
\ No newline at end of file
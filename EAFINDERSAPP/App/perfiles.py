@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .metricas import registrar_cache
+from .models import Usuario
+
+# Lo que se muestra de otro usuario en listas, chats y comentarios. En la caché cada tarjeta
+# es una tupla con estos campos en este orden; si cambian, hay que subir _VERSION.
+CAMPOS = ('id', 'nombres', 'apellidos', 'email_institucional', 'foto_perfil', 'carrera', 'semestre')
+_VERSION = 1
+DURACION = getattr(settings, 'PERFILES_CACHE_SEGUNDOS', 60 * 60 * 24)
+
+_campo_foto = Usuario._meta.get_field('foto_perfil')
+
+
+def clave(usuario_id):
+    return f'perfil:{_VERSION}:{usuario_id}'
+
+
+class TarjetaPerfil:
+    """
+    Perfil público de un usuario. Tiene los mismos nombres de atributo que
+    Usuario, así que las plantillas lo usan igual: {{ autor.nombres }}, {% imagen autor.foto_perfil 50 %}
+    """
+
+    __slots__ = ('id', 'nombres', 'apellidos', 'email_institucional', '_foto', 'carrera', 'semestre')
+
+    def __init__(self, id, nombres, apellidos, email_institucional, foto, carrera, semestre):
+        self.id = id
+        self.nombres = nombres
+        self.apellidos = apellidos
+        self.email_institucional = email_institucional
+        self._foto = foto
+        self.carrera = carrera
+        self.semestre = semestre
+
+    def __eq__(self, otro):
+        # {% if autor == request.user %} sigue funcionando
+        return getattr(otro, 'pk', None) == self.id if isinstance(otro, (TarjetaPerfil, Usuario)) else NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f'<TarjetaPerfil {self.id}: {self.nombres} {self.apellidos}>'
+
+    @property
+    def foto_perfil(self):
+        # En la tupla va solo el nombre del archivo; el FieldFile da .url y las miniaturas
+        return _campo_foto.attr_class(None, _campo_foto, self._foto or None)
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def nombre_completo(self):
+        return f'{self.nombres} {self.apellidos}'
+
+
+def obtener_tarjetas(ids):
+    """
+    {id: TarjetaPerfil} en el orden de `ids`, con un solo get_many a la caché y una sola
+    consulta para las que falten. Los ids que no existen no aparecen en el resultado.
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return {}
+    claves = {clave(usuario_id): usuario_id for usuario_id in ids}
+    en_cache = cache.get_many(claves)
+    tuplas = {claves[k]: v for k, v in en_cache.items()}
+    registrar_cache('perfiles', True, len(tuplas))
+
+    faltan = [usuario_id for usuario_id in ids if usuario_id not in tuplas]
+    if faltan:
+        registrar_cache('perfiles', False, len(faltan))
+        nuevas = {fila[0]: tuple(fila) for fila in Usuario.objects.filter(id__in=faltan).values_list(*CAMPOS)}
+        cache.set_many({clave(usuario_id): valores for usuario_id, valores in nuevas.items()}, DURACION)
+        tuplas.update(nuevas)
+    return {usuario_id: TarjetaPerfil(*tuplas[usuario_id]) for usuario_id in ids if usuario_id in tuplas}
+
+
+def obtener_tarjeta(usuario_id):
+    return obtener_tarjetas([usuario_id]).get(usuario_id)
+
+
+def invalidar(ids):
+    """La próxima lectura vuelve a la base de datos (se llama al guardar o borrar un usuario)"""
+    cache.delete_many([clave(usuario_id) for usuario_id in ids])
@@ -2,6 +2,8 @@ from django.db import models
 from django.utils import timezone
 from datetime import timedelta
 
+from .shards import shard_de
+
 class ForoQuerySet(models.QuerySet):
     def recientes(self, dias=7):
         return self.filter(fecha_creacion__gte=timezone.now() - timedelta(days=dias))
@@ -11,3 +13,44 @@ class ForoQuerySet(models.QuerySet):
 
     def por_etiqueta(self, etiqueta_nombre):
         return self.filter(etiquetas__nombre__iexact=etiqueta_nombre)
+
+    def con_puntaje(self):
+        # Puntaje de tendencia: cada like y comentario pesa más que una vista
+        return self.annotate(
+            num_likes=models.Count("likes", distinct=True),
+            num_comentarios=models.Count("comentarios", distinct=True),
+        ).annotate(
+            puntaje=models.F("vistas") + 10 * models.F("num_likes") + 5 * models.F("num_comentarios")
+        )
+
+    def tendencia(self, dias=7):
+        return self.recientes(dias).con_puntaje().order_by("-puntaje", "-fecha_creacion")
+
+
+class MensajeQuerySet(models.QuerySet):
+    def conversacion(self, usuario_a, usuario_b):
+        """Mensajes entre dos usuarios (o sus ids), leídos del shard de la conversación"""
+        a, b = getattr(usuario_a, 'pk', usuario_a), getattr(usuario_b, 'pk', usuario_b)
+        return self.using(shard_de(a, b)).filter(
+            models.Q(remitente_id=a, destinatario_id=b) | models.Q(remitente_id=b, destinatario_id=a)
+        )
+
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        # save() elige el shard con la instancia ya armada (remitente y destinatario)
+        mensaje = self.model(**kwargs)
+        mensaje.save(force_insert=True)
+        return mensaje
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # Sin .using() explícito cada mensaje va al shard de su conversación
+        if self._db is not None:
+            return super().bulk_create(objs, *args, **kwargs)
+        por_shard = {}
+        for mensaje in objs:
+            por_shard.setdefault(shard_de(mensaje.remitente_id, mensaje.destinatario_id), []).append(mensaje)
+        creados = []
+        for alias, mensajes in por_shard.items():
+            creados += super(MensajeQuerySet, self.using(alias)).bulk_create(mensajes, *args, **kwargs)
+        return creados
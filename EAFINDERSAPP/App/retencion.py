@@ -0,0 +1,110 @@
+"""
+Políticas de retención: los mensajes viejos pasan a ArchivoMensajes (lotes comprimidos con
+zlib) y las solicitudes de amistad rechazadas se borran. Todo va por lotes, cada uno en su
+propia transacción corta, para no dejar a los escritores de SQLite esperando el lock.
+"""
+import json
+import time
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import shards
+from .models import Amistad, ArchivoMensajes, Mensaje
+
+# Días que se conserva cada cosa (None: no se toca) y tamaño de lote / pausa entre lotes
+RETENCION = {
+    'mensajes_dias': 365 * 2,
+    'rechazadas_dias': 90,
+    'lote': 500,
+    'pausa': 0.05,
+    **getattr(settings, 'RETENCION', {}),
+}
+
+_CAMPOS = ('id', 'remitente_id', 'destinatario_id', 'contenido', 'fecha_enviado')
+
+
+def comprimir(filas):
+    """Filas (tuplas en el orden de _CAMPOS) -> bytes"""
+    datos = [[*fila[:4], fila[4].isoformat()] for fila in filas]
+    return zlib.compress(json.dumps(datos, ensure_ascii=False, separators=(',', ':')).encode(), 9)
+
+
+def descomprimir(datos):
+    mensajes = []
+    for fila in json.loads(zlib.decompress(bytes(datos))):
+        mensaje = dict(zip(_CAMPOS, fila))
+        mensaje['fecha_enviado'] = parse_datetime(mensaje['fecha_enviado'])
+        mensajes.append(mensaje)
+    return mensajes
+
+
+def _limite(dias):
+    return timezone.now() - timedelta(days=dias)
+
+
+def mensajes_viejos(alias, dias):
+    return Mensaje.objects.using(alias).filter(fecha_enviado__lt=_limite(dias))
+
+
+def rechazadas_viejas(dias):
+    # fecha_amistad es la de la solicitud: el rechazo no guarda fecha propia
+    return Amistad.objects.filter(estado='rechazada', fecha_amistad__lt=_limite(dias))
+
+
+def archivar_mensajes(alias, dias, lote, pausa=0.0):
+    """Archiva en `alias` los mensajes de más de `dias` días. Devuelve (mensajes, lotes, bytes)"""
+    mensajes = lotes = tamano = 0
+    viejos = mensajes_viejos(alias, dias).order_by('fecha_enviado', 'id')
+    while True:
+        with transaction.atomic(using=alias):
+            filas = list(viejos.values_list(*_CAMPOS)[:lote])
+            if not filas:
+                break
+            datos = comprimir(filas)
+            ArchivoMensajes.objects.using(alias).create(
+                primer_id=min(fila[0] for fila in filas), ultimo_id=max(fila[0] for fila in filas),
+                desde=filas[0][4], hasta=filas[-1][4], cantidad=len(filas), datos=datos,
+            )
+            Mensaje.objects.using(alias).filter(id__in=[fila[0] for fila in filas]).delete()
+        mensajes += len(filas)
+        lotes += 1
+        tamano += len(datos)
+        time.sleep(pausa)
+    return mensajes, lotes, tamano
+
+
+def purgar_rechazadas(dias, lote, pausa=0.0):
+    borradas = 0
+    while True:
+        with transaction.atomic():
+            ids = list(rechazadas_viejas(dias).order_by('id').values_list('id', flat=True)[:lote])
+            if not ids:
+                break
+            # Se vuelve a filtrar por estado: pudo cambiar desde que se leyeron los ids
+            borradas += Amistad.objects.filter(id__in=ids, estado='rechazada').delete()[0]
+        time.sleep(pausa)
+    return borradas
+
+
+def informe(mensajes_dias, rechazadas_dias):
+    """Lo que haría una pasada con estas políticas, sin tocar nada (dry run)"""
+    resultado = {'mensajes': {}, 'rechazadas': None}
+    if mensajes_dias is not None:
+        for alias in shards.aliases():
+            viejos = mensajes_viejos(alias, mensajes_dias)
+            cantidad = viejos.count()
+            muestra = list(viejos.order_by('fecha_enviado', 'id').values_list(*_CAMPOS)[:RETENCION['lote']])
+            resultado['mensajes'][alias] = {
+                'cantidad': cantidad,
+                'desde': muestra[0][4] if muestra else None,
+                # Tamaño del archivo estimado comprimiendo el primer lote
+                'bytes': len(comprimir(muestra)) * cantidad // max(1, len(muestra)),
+            }
+    if rechazadas_dias is not None:
+        resultado['rechazadas'] = rechazadas_viejas(rechazadas_dias).count()
+    return resultado
@@ -0,0 +1,245 @@
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import perfiles
+from .models import Usuario, Version
+
+LOTE = 1000
+MAX_ERRORES = 100  # Se cuentan todos, pero solo se guarda el detalle de los primeros
+# Desde el admin: con más contraseñas que esto el roster se importa en segundo plano
+ROSTER_ADMIN_MAX_CONTRASENAS = getattr(settings, 'ROSTER_ADMIN_MAX_CONTRASENAS', 20)
+ROSTER_PENDIENTES_DIR = getattr(settings, 'ROSTER_PENDIENTES_DIR', Path(settings.BASE_DIR) / '.roster')
+
+# Columnas que se actualizan si el correo ya existe y la fila las trae (la contraseña solo si
+# trae una); las que no están en el archivo conservan lo que había
+CAMPOS = ('nombres', 'apellidos', 'carrera', 'semestre', 'biografia')
+_ALIAS = {'email': 'email_institucional', 'correo': 'email_institucional', 'contrasena': 'password'}
+
+
+class ResultadoImportacion:
+    def __init__(self):
+        self.leidas = 0
+        self.creados = 0
+        self.actualizados = 0
+        self.invalidas = 0
+        self.errores = []  # (línea, mensaje), como mucho MAX_ERRORES
+
+    def error(self, linea, mensaje):
+        self.invalidas += 1
+        if len(self.errores) < MAX_ERRORES:
+            self.errores.append((linea, mensaje))
+
+    def __str__(self):
+        return (f'{self.leidas} filas: {self.creados} creados, {self.actualizados} actualizados, '
+                f'{self.invalidas} inválidas')
+
+
+def leer_roster(archivo, formato=None):
+    """
+    Recorre un roster CSV (con encabezado) o JSONL fila por fila, sin cargarlo entero.
+    Devuelve (número de línea, dict). `archivo` puede estar abierto en binario o en texto.
+    """
+    if isinstance(archivo, (io.BufferedIOBase, io.RawIOBase)) or 'b' in getattr(archivo, 'mode', ''):
+        archivo = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+    if formato is None:
+        nombre = getattr(archivo, 'name', '') or ''
+        formato = 'jsonl' if str(nombre).endswith(('.jsonl', '.ndjson')) else 'csv'
+
+    if formato == 'jsonl':
+        for linea, texto in enumerate(archivo, start=1):
+            if not texto.strip():
+                continue
+            try:
+                fila = json.loads(texto)
+            except ValueError:
+                fila = None
+            yield linea, fila if isinstance(fila, dict) else None
+    else:
+        lector = csv.DictReader(archivo)
+        for fila in lector:
+            yield lector.line_num, fila
+
+
+def _normalizar(fila):
+    return {_ALIAS.get(clave.strip().lower(), clave.strip().lower()): (valor.strip() if isinstance(valor, str) else valor)
+            for clave, valor in fila.items() if clave}
+
+
+def limpiar_fila(fila):
+    """
+    Usuario sin guardar (con la contraseña en claro en .password, o None) o ValidationError.
+    En ._columnas quedan los CAMPOS que trae la fila.
+    """
+    if fila is None:
+        raise ValidationError('La línea no es un objeto JSON válido')
+    datos = _normalizar(fila)
+
+    email = Usuario.objects.normalize_email(datos.get('email_institucional') or '')
+    if not email:  # run_validators no revisa los valores vacíos
+        raise ValidationError('Falta el correo institucional')
+    campo_email = Usuario._meta.get_field('email_institucional')
+    campo_email.run_validators(email)  # Incluye la regex de @eafit.edu.co
+    if not datos.get('nombres') or not datos.get('apellidos'):
+        raise ValidationError('Faltan nombres o apellidos')
+
+    semestre = datos.get('semestre') or None
+    if semestre is not None:
+        try:
+            semestre = int(semestre)
+        except (TypeError, ValueError):
+            raise ValidationError(f'Semestre inválido: {semestre!r}')
+
+    usuario = Usuario(
+        email_institucional=email,
+        nombres=datos['nombres'][:100],
+        apellidos=datos['apellidos'][:100],
+        carrera=(datos.get('carrera') or None),
+        semestre=semestre,
+        biografia=datos.get('biografia') or None,
+    )
+    usuario.password = datos.get('password') or None
+    usuario._columnas = tuple(campo for campo in CAMPOS if campo in datos)
+    return usuario
+
+
+def contar_contrasenas(archivo, formato=None):
+    """Filas que traen contraseña, que son las que cuestan: cada hash tarda a propósito"""
+    return sum(1 for _, fila in leer_roster(archivo, formato) if fila and _normalizar(fila).get('password'))
+
+
+def guardar_pendiente(archivo, formato):
+    """Copia un roster subido a ROSTER_PENDIENTES_DIR, legible solo por este usuario (trae contraseñas)"""
+    os.makedirs(ROSTER_PENDIENTES_DIR, exist_ok=True)
+    ruta = Path(ROSTER_PENDIENTES_DIR) / f'{uuid.uuid4().hex}.{formato}'
+    with os.fdopen(os.open(ruta, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as salida:
+        for chunk in archivo.chunks():
+            salida.write(chunk)
+    return ruta
+
+
+def importar_en_segundo_plano(ruta, formato=None):
+    """
+    Lanza manage.py importar_roster sobre `ruta` en otro proceso, que la borra al terminar. La
+    salida queda en <ruta>.log.
+    """
+    comando = [sys.executable, str(Path(settings.BASE_DIR) / 'manage.py'), 'importar_roster', str(ruta), '--borrar']
+    if formato:
+        comando += ['--formato', formato]
+    with open(f'{ruta}.log', 'wb') as registro:
+        subprocess.Popen(comando, stdin=subprocess.DEVNULL, stdout=registro, stderr=subprocess.STDOUT,
+                         start_new_session=True)
+
+
+def _hashear(contrasenas):
+    # Sin contraseña la cuenta queda inutilizable hasta que el estudiante la restablezca
+    return [make_password(contrasena) for contrasena in contrasenas]
+
+
+def _guardar(usuarios, traen_contrasena, resultado):
+    correos = [usuario.email_institucional for usuario in usuarios]
+    existentes = set(Usuario.objects.filter(email_institucional__in=correos).values_list('email_institucional', flat=True))
+    # Un upsert por combinación de columnas: en un CSV todas las filas traen las mismas, en JSONL
+    # puede variar. Los que ya existen y no traen contraseña conservan la suya.
+    grupos = {}
+    for usuario, trae in zip(usuarios, traen_contrasena):
+        con_contrasena = trae or usuario.email_institucional not in existentes
+        grupos.setdefault((usuario._columnas, con_contrasena), []).append(usuario)
+
+    with transaction.atomic():
+        for (columnas, con_contrasena), grupo in grupos.items():
+            Usuario.objects.bulk_create(
+                grupo, update_conflicts=True, unique_fields=['email_institucional'],
+                update_fields=[*columnas, 'fecha_actualizacion', *(['password'] if con_contrasena else [])],
+            )
+    if existentes:
+        # bulk_create no manda post_save: las tarjetas de los actualizados se invalidan aquí
+        perfiles.invalidar(Usuario.objects.filter(email_institucional__in=existentes).values_list('id', flat=True))
+        Version.subir('foros')  # La lista de foros muestra los nombres de los creadores
+    resultado.actualizados += len(existentes)
+    resultado.creados += len(usuarios) - len(existentes)
+
+
+class _EnEsteProceso:
+    """Se usa como el pool, pero cada submit corre en el momento en el proceso que llama"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *error):
+        return False
+
+    def submit(self, funcion, *args):
+        futuro = Future()
+        try:
+            futuro.set_result(funcion(*args))
+        except Exception as error:
+            futuro.set_exception(error)
+        return futuro
+
+
+def importar_roster(archivo, formato=None, lote=LOTE, procesos=None, validar=False, progreso=None):
+    """
+    Crea o actualiza (por email_institucional) los usuarios del roster, de a `lote` filas.
+
+    La memoria no depende del tamaño del archivo: solo se tiene un lote en mano. Mientras se
+    escribe un lote, el siguiente ya se está hasheando en el pool de procesos. Con procesos=1
+    hashea en este mismo proceso, sin pool (así lo usa el admin con los rosters chicos: una
+    petición web no lanza un pool). Con `validar` no escribe nada. `progreso(resultado)` se llama después de cada lote.
+    """
+    resultado = ResultadoImportacion()
+    procesos = procesos or os.cpu_count() or 1
+
+    def lotes():
+        usuarios = {}
+        for linea, fila in leer_roster(archivo, formato):
+            resultado.leidas += 1
+            try:
+                usuario = limpiar_fila(fila)
+            except ValidationError as error:
+                resultado.error(linea, '; '.join(error.messages))
+                continue
+            usuarios[usuario.email_institucional] = usuario  # Si el correo se repite gana la última fila
+            if len(usuarios) >= lote:
+                yield list(usuarios.values())
+                usuarios = {}
+        if usuarios:
+            yield list(usuarios.values())
+
+    with ProcessPoolExecutor(procesos) if procesos > 1 else _EnEsteProceso() as pool:
+        pendiente = None  # (usuarios, futuros con sus hashes)
+        for usuarios in lotes():
+            if validar:
+                if progreso:
+                    progreso(resultado)
+                continue
+            contrasenas = [usuario.password for usuario in usuarios]
+            trozo = max(1, len(contrasenas) // procesos)
+            futuros = [pool.submit(_hashear, contrasenas[i:i + trozo]) for i in range(0, len(contrasenas), trozo)]
+            if pendiente:
+                _terminar(*pendiente, resultado, progreso)
+            pendiente = (usuarios, futuros)
+        if pendiente:
+            _terminar(*pendiente, resultado, progreso)
+    return resultado
+
+
+def _terminar(usuarios, futuros, resultado, progreso):
+    traen_contrasena = [usuario.password is not None for usuario in usuarios]
+    hashes = [hash_ for futuro in futuros for hash_ in futuro.result()]
+    for usuario, hash_ in zip(usuarios, hashes):
+        usuario.password = hash_
+    _guardar(usuarios, traen_contrasena, resultado)
+    if progreso:
+        progreso(resultado)
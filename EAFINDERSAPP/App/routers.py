@@ -0,0 +1,196 @@
+"""
+Routers de base de datos: RouterMensajes manda cada Mensaje al shard de su conversación y
+RouterReplica manda las lecturas a la réplica y las escrituras al primario.
+
+Réplica:
+
+Solo leen de la réplica las vistas marcadas con @usar_replica (o el código dentro de
+`with replica():`), y mientras no hayan escrito nada: después de la primera escritura el
+resto de la petición lee del primario, para ver lo que acaba de guardar. ReplicaMiddleware
+extiende eso a las peticiones de los segundos siguientes (el redirect después de un POST),
+por si la réplica va atrasada.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import shards
+from .middleware import MiddlewareHibrido
+
+ALIAS_REPLICA = 'replica'
+COOKIE = 'escribio_hasta'
+PEGAJOSO_SEGUNDOS = getattr(settings, 'REPLICA_PEGAJOSO_SEGUNDOS', 5)
+
+
+class _Estado:
+    """Si ya se escribió en la petición (o en el bloque replica() fuera de una petición)"""
+    __slots__ = ('escribio',)
+
+    def __init__(self, escribio=False):
+        self.escribio = escribio
+
+
+_en_replica = ContextVar('en_replica', default=False)
+_estado = ContextVar('estado_replica', default=None)
+
+
+def hay_replica():
+    # En los tests la réplica es un espejo (TEST MIRROR) con el mismo NAME que default: abrirle
+    # otra conexión no vería los datos de la transacción del test, así que se lee de default
+    return (
+        ALIAS_REPLICA in settings.DATABASES
+        and connections[ALIAS_REPLICA].settings_dict['NAME'] != connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+    )
+
+
+@contextmanager
+def replica():
+    """Las lecturas dentro del bloque van a la réplica (si existe y no se escribió antes)"""
+    token = _en_replica.set(True)
+    # Fuera de ReplicaMiddleware (comandos, shell) cada bloque lleva su propia cuenta
+    token_estado = _estado.set(_Estado()) if _estado.get() is None else None
+    try:
+        yield
+    finally:
+        if token_estado:
+            _estado.reset(token_estado)
+        _en_replica.reset(token)
+
+
+def usar_replica(vista):
+    """Decorador para vistas de solo lectura. En vistas de clase: method_decorator(..., name='dispatch')"""
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        with replica():
+            return vista(*args, **kwargs)
+    return envoltura
+
+
+def _es_mensaje(model):
+    return model._meta.label == 'App.Mensaje'
+
+
+def _en_shards(model):
+    # Los lotes archivados por retencion quedan en el shard de sus mensajes
+    return model._meta.label in ('App.Mensaje', 'App.ArchivoMensajes')
+
+
+class RouterMensajes:
+    """
+    Mensaje va al shard de su conversación según la instancia (al guardar o borrar). Las
+    consultas tienen que decir de qué conversación son: Mensaje.objects.conversacion(a, b), o
+    .using(alias) para recorrer un shard. Los shards solo tienen las tablas de mensajes y de
+    mensajes archivados (ArchivoMensajes, siempre con .using(alias)).
+    """
+
+    def _shard(self, model, hints):
+        aliases = shards.aliases()
+        instancia = hints.get('instance')
+        if instancia is not None and _es_mensaje(type(instancia)) and instancia.remitente_id and instancia.destinatario_id:
+            return shards.shard_de(instancia.remitente_id, instancia.destinatario_id, aliases)
+        if instancia is not None and instancia._state.db in aliases:
+            return instancia._state.db
+        if len(aliases) == 1:
+            return aliases[0]
+        return None
+
+    def _fuera_del_shard(self, hints):
+        # mensaje.remitente: sin esto Django buscaría al usuario en la base del mensaje
+        instancia = hints.get('instance')
+        if instancia is not None and _es_mensaje(type(instancia)):
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        if not _en_shards(model):
+            return self._fuera_del_shard(hints)
+        alias = self._shard(model, hints)
+        if alias is None:
+            raise ValueError(
+                f'{model.__name__} está particionado en varios shards: usa .using(alias) para elegir '
+                'uno (o Mensaje.objects.conversacion(a, b))'
+            )
+        return alias
+
+    def db_for_write(self, model, **hints):
+        if not _en_shards(model):
+            return self._fuera_del_shard(hints)
+        # Al armar un Mensaje (asignar remitente sin destinatario todavía) no se puede saber:
+        # save() vuelve a preguntar con la instancia completa
+        return self._shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # La FK de Mensaje a Usuario cruza bases: se resuelve con una consulta aparte
+        if _es_mensaje(type(obj1)) or _es_mensaje(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        aliases = shards.aliases()
+        if app_label == 'App' and model_name in ('mensaje', 'archivomensajes'):
+            return db in aliases
+        if db in aliases and db != DEFAULT_DB_ALIAS:
+            return False
+        return None
+
+
+class RouterReplica:
+    """Va antes que RouterMensajes; los mensajes no tienen réplica y se los deja a ese"""
+
+    def db_for_read(self, model, **hints):
+        if _en_shards(model):
+            return None
+        estado = _estado.get()
+        if _en_replica.get() and estado and not estado.escribio and hay_replica():
+            return ALIAS_REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        if _en_shards(model):
+            return None
+        estado = _estado.get()
+        if estado:
+            estado.escribio = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Son la misma base: un objeto leído de la réplica se puede relacionar con uno del primario
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, ALIAS_REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # La réplica recibe el esquema del primario, no se migra aparte
+        return False if db == ALIAS_REPLICA else None
+
+
+class ReplicaMiddleware(MiddlewareHibrido):
+    """Lectura de lo propio entre peticiones: después de escribir, unos segundos sin réplica"""
+
+    def antes(self, request):
+        try:
+            reciente = float(request.COOKIES.get(COOKIE, 0)) > time.time()
+        except ValueError:
+            reciente = False
+        return _Estado(reciente), reciente
+
+    @contextmanager
+    def envolver(self, request, estado):
+        token = _estado.set(estado[0])
+        try:
+            yield
+        finally:
+            _estado.reset(token)
+
+    def despues(self, request, response, estado):
+        estado, reciente = estado
+        if estado.escribio and not reciente:
+            response.set_cookie(
+                COOKIE, f'{time.time() + PEGAJOSO_SEGUNDOS:.0f}', max_age=PEGAJOSO_SEGUNDOS,
+                httponly=True, samesite='Lax',
+            )
+        return response
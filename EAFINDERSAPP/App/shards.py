@@ -0,0 +1,75 @@
+"""
+Particionado de Mensaje por conversación entre las bases de MENSAJES_SHARDS.
+
+Cada conversación (el par de usuarios, sin importar quién envía) vive entera en un shard,
+elegido con jump consistent hash (Lamping y Veach, 2014): al agregar un shard al final de la
+lista solo se mueve la fracción de conversaciones que le toca al nuevo (1/N), y
+rebalancear_mensajes se encarga de moverlas. Los shards no se pueden reordenar ni quitar del
+medio de la lista sin mover casi todo.
+
+Los ids de Mensaje no se repiten entre shards: cada uno numera desde primer_id(alias), así que
+una conversación se mueve con sus ids (los cursores ?desde= y los de la bandeja siguen valiendo).
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_MASCARA = (1 << 64) - 1
+BITS_RANGO = 40  # Ids por shard: 2**40
+
+
+def aliases():
+    return list(getattr(settings, 'MENSAJES_SHARDS', [DEFAULT_DB_ALIAS]))
+
+
+def primer_id(alias, shards=None):
+    """
+    Primer id de los mensajes de `alias`: (posición + 1) << BITS_RANGO. La tabla vieja de default
+    (fuera de la lista) queda en el rango 0, y un shard agregado al final tiene el rango más
+    alto, así que lo que se mueve al rebalancear va a un rango mayor que el de los que ya estaban.
+    """
+    shards = shards or aliases()
+    return (shards.index(alias) + 1) << BITS_RANGO if alias in shards else 1
+
+
+def reservar_rango(conexion, tabla):
+    """Sube (nunca baja) el contador de ids de `tabla` en la base hasta el rango de su shard"""
+    ultimo = primer_id(conexion.alias) - 1
+    if ultimo <= 0:
+        return
+    with conexion.cursor() as cursor:
+        if conexion.vendor == 'sqlite':
+            cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s', [ultimo, tabla])
+            if not cursor.rowcount:
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [tabla, ultimo])
+        elif conexion.vendor == 'postgresql':
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                f"GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {conexion.ops.quote_name(tabla)})))",
+                [conexion.ops.quote_name(tabla), ultimo],
+            )
+
+
+def salto(clave, cubetas):
+    """Jump consistent hash: cubeta en [0, cubetas) para una clave de 64 bits"""
+    cubeta, siguiente = -1, 0
+    while siguiente < cubetas:
+        cubeta = siguiente
+        clave = (clave * 2862933555777941757 + 1) & _MASCARA
+        siguiente = int((cubeta + 1) * ((1 << 31) / ((clave >> 33) + 1)))
+    return cubeta
+
+
+def clave_conversacion(usuario_a, usuario_b):
+    # hash() de Python cambia entre procesos: se usa un digest estable
+    par = f'{min(usuario_a, usuario_b)}:{max(usuario_a, usuario_b)}'.encode()
+    return int.from_bytes(hashlib.blake2b(par, digest_size=8).digest(), 'big')
+
+
+def shard_de(usuario_a, usuario_b, shards=None):
+    """Alias de la base donde vive la conversación entre los dos usuarios (ids)"""
+    shards = shards or aliases()
+    if len(shards) == 1:
+        return shards[0]
+    return shards[salto(clave_conversacion(usuario_a, usuario_b), len(shards))]
@@ -0,0 +1,169 @@
+import logging
+
+from django.db.models import F, Q
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from . import eventos, perfiles
+from .imagenes import generar_derivados
+from .models import Blob, Comentario, Etiqueta, Foro, Mensaje, Usuario, Version
+from .shards import aliases
+from .storage import es_blob
+
+logger = logging.getLogger(__name__)
+
+
+def _generar_si_cambio(instance, campo, update_fields):
+    # Los save() parciales que no tocan la imagen (p. ej. last_login al iniciar sesión) no cuentan
+    if update_fields is not None and campo not in update_fields:
+        return
+    archivo = getattr(instance, campo)
+    if not archivo:
+        return
+    try:
+        generar_derivados(archivo)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning('No se pudieron generar las miniaturas de %s', archivo.name)
+
+
+@receiver(post_save, sender=Usuario)
+def miniaturas_foto_perfil(sender, instance, update_fields=None, **kwargs):
+    _generar_si_cambio(instance, 'foto_perfil', update_fields)
+
+
+@receiver(post_save, sender=Foro)
+def miniaturas_foto_foro(sender, instance, update_fields=None, **kwargs):
+    _generar_si_cambio(instance, 'foto_foro', update_fields)
+
+
+@receiver(post_save, sender=Usuario)
+def invalidar_tarjeta(sender, instance, update_fields=None, **kwargs):
+    # Iniciar sesión guarda solo last_login, que no sale en la tarjeta
+    if update_fields is not None and not set(update_fields) & set(perfiles.CAMPOS):
+        return
+    perfiles.invalidar([instance.pk])
+
+
+@receiver(post_delete, sender=Usuario)
+def borrar_tarjeta(sender, instance, **kwargs):
+    perfiles.invalidar([instance.pk])
+
+
+@receiver(post_delete, sender=Usuario)
+def borrar_mensajes(sender, instance, **kwargs):
+    # Mensaje no tiene FK en la base (puede estar en otro shard): el CASCADE se hace a mano
+    for alias in aliases():
+        Mensaje.objects.using(alias).filter(
+            Q(remitente_id=instance.pk) | Q(destinatario_id=instance.pk)
+        ).delete()
+
+
+@receiver(post_save, sender=Mensaje)
+def avisar_mensaje(sender, instance, created, **kwargs):
+    if created:
+        eventos.publicar([instance.remitente_id, instance.destinatario_id], {
+            'tipo': 'mensaje',
+            'id': instance.id,
+            'remitente': instance.remitente_id,
+            'destinatario': instance.destinatario_id,
+        }, using=instance._state.db)
+
+
+def _tocar_foros(ids):
+    # Lo que se muestra del foro cambió aunque su fila no: el ETag de las páginas depende de la fecha
+    Foro.objects.filter(id__in=ids).update(fecha_actualizacion=timezone.now())
+    Version.subir('foros')
+
+
+@receiver(post_save, sender=Foro)
+@receiver(post_delete, sender=Foro)
+def subir_version_foros(sender, **kwargs):
+    Version.subir('foros')
+
+
+@receiver(post_save, sender=Usuario)
+def subir_version_foros_creador(sender, instance, created, update_fields=None, **kwargs):
+    # La lista de foros muestra el nombre del creador; uno recién creado todavía no tiene foros
+    if created or update_fields is not None and not {'nombres', 'apellidos'} & set(update_fields):
+        return
+    Version.subir('foros')
+
+
+@receiver(post_save, sender=Comentario)
+@receiver(post_delete, sender=Comentario)
+def tocar_foro_comentado(sender, instance, **kwargs):
+    _tocar_foros([instance.foro_id])
+
+
+@receiver(post_save, sender=Etiqueta)
+@receiver(pre_delete, sender=Etiqueta)
+def tocar_foros_etiquetados(sender, instance, **kwargs):
+    _tocar_foros(instance.foros.values('id'))
+
+
+_RELACIONES_FORO = {Foro.likes.through: 'likes', Foro.etiquetas.through: 'etiquetas'}
+
+
+@receiver(m2m_changed, sender=Foro.likes.through)
+@receiver(m2m_changed, sender=Foro.etiquetas.through)
+def tocar_foro_relacionado(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            _tocar_foros([instance.pk])
+    elif action == 'pre_clear':
+        # Desde el otro lado (usuario.foros_likes.clear()) después ya no se sabe qué foros eran
+        _tocar_foros(Foro.objects.filter(**{_RELACIONES_FORO[sender]: instance}).values('id'))
+    elif action in ('post_add', 'post_remove'):
+        _tocar_foros(pk_set)
+
+
+# Campos guardados con AlmacenamientoPorContenido, cuyas referencias se cuentan en Blob
+CAMPOS_BLOB = {
+    Usuario: ('foto_perfil',),
+    Foro: ('foto_foro',),
+    Comentario: ('archivo',),
+}
+
+
+def _ajustar_referencias(nombre, delta):
+    if es_blob(nombre):
+        Blob.objects.filter(nombre=nombre).update(referencias=F('referencias') + delta)
+
+
+def _nombre_actual(instance, campo):
+    # Se lee de __dict__ para no crear el FieldFile; con only()/defer() el campo puede faltar
+    valor = instance.__dict__.get(campo)
+    return getattr(valor, 'name', valor) or None
+
+
+def recordar_blobs(sender, instance, **kwargs):
+    instance._blobs_originales = {
+        campo: _nombre_actual(instance, campo) for campo in CAMPOS_BLOB[sender]
+        if campo in instance.__dict__
+    }
+
+
+def contar_referencias(sender, instance, created, **kwargs):
+    originales = getattr(instance, '_blobs_originales', {})
+    for campo in CAMPOS_BLOB[sender]:
+        if campo not in instance.__dict__:
+            continue
+        anterior = None if created else originales.get(campo)
+        actual = _nombre_actual(instance, campo)
+        if anterior != actual:
+            _ajustar_referencias(actual, 1)
+            _ajustar_referencias(anterior, -1)
+    recordar_blobs(sender, instance)
+
+
+def soltar_referencias(sender, instance, **kwargs):
+    for nombre in getattr(instance, '_blobs_originales', {}).values():
+        _ajustar_referencias(nombre, -1)
+
+
+for modelo in CAMPOS_BLOB:
+    post_init.connect(recordar_blobs, sender=modelo)
+    post_save.connect(contar_referencias, sender=modelo)
+    post_delete.connect(soltar_referencias, sender=modelo)
@@ -0,0 +1,217 @@
+// Bandeja de mensajes compartida entre pestañas.
+//
+// Cada pestaña dice qué conversaciones sigue (Bandeja.seguir) y una sola, la líder, consulta
+// /chat/bandeja/ cada 2 segundos por todas; las novedades llegan a las demás por
+// BroadcastChannel. La líder se elige con Web Locks: el lock lo tiene una pestaña a la vez y al
+// cerrarse pasa a otra. Sin esas APIs cada pestaña consulta por su cuenta (igual una sola
+// petición por todas sus conversaciones).
+//
+// Con data-eventos la líder espera en /eventos/ (long-poll) y consulta cuando llega un mensaje,
+// más cada tantos segundos por si acaso: los dice el servidor (respaldo), 30 si los eventos
+// llegan a todos sus workers y 2 si no. Los eventos se repiten en todas las pestañas como
+// 'eventos' en document (p. ej. solicitudes de amistad).
+(function () {
+    const script = document.currentScript;
+    const URL_BANDEJA = script.dataset.url;
+    const URL_EVENTOS = script.dataset.eventos;
+    const USUARIO = script.dataset.usuario;
+    const INTERVALO = 2000;
+    const VIGENCIA = 10000; // Lo que sigue otra pestaña se olvida si no lo repite en este tiempo
+
+    const pestana = Math.random().toString(36).slice(2);
+    const canal = 'BroadcastChannel' in window ? new BroadcastChannel('bandeja:' + USUARIO) : null;
+    const propias = {}; // amigo -> {desde, avisos}
+    const ajenas = {};  // pestaña -> {conversaciones: {amigo: desde}, hasta} (solo en la líder)
+    let lider = false;
+    let respaldo = null; // Consulta periódica cuando hay long-poll
+
+    function claveVisto(amigo) {
+        return 'chat:' + USUARIO + ':visto:' + amigo;
+    }
+
+    function visto(amigo, porDefecto) {
+        const valor = localStorage.getItem(claveVisto(amigo));
+        return valor === null ? porDefecto : Number(valor);
+    }
+
+    function marcarVisto(amigo, id) {
+        if (id > visto(amigo, 0)) {
+            localStorage.setItem(claveVisto(amigo), id);
+        }
+    }
+
+    function interes() {
+        const conversaciones = {};
+        for (const amigo in propias) {
+            conversaciones[amigo] = propias[amigo].desde;
+        }
+        return conversaciones;
+    }
+
+    function anunciar() {
+        if (canal && !lider) {
+            canal.postMessage({tipo: 'interes', pestana: pestana, conversaciones: interes()});
+        }
+    }
+
+    function entregar(conversaciones) {
+        for (const amigo in conversaciones) {
+            const propia = propias[amigo];
+            if (!propia) {
+                continue;
+            }
+            // Filas [id, remitente_id, fecha_epoch, contenido]; puede llegar algo ya visto
+            const mensajes = conversaciones[amigo].mensajes.filter(function (fila) { return fila[0] > propia.desde; });
+            if (!mensajes.length) {
+                continue;
+            }
+            propia.desde = mensajes[mensajes.length - 1][0];
+            const novedad = {
+                mensajes: mensajes,
+                no_leidos: mensajes.filter(function (fila) { return String(fila[1]) === amigo; }).length,
+                ultimo: propia.desde,
+            };
+            propia.avisos.forEach(function (aviso) { aviso(novedad); });
+        }
+    }
+
+    function consultar() {
+        // La menor posición de cada conversación entre todas las pestañas
+        const union = interes();
+        const ahora = Date.now();
+        for (const otra in ajenas) {
+            if (ajenas[otra].hasta < ahora) {
+                delete ajenas[otra];
+                continue;
+            }
+            for (const amigo in ajenas[otra].conversaciones) {
+                const desde = ajenas[otra].conversaciones[amigo];
+                union[amigo] = amigo in union ? Math.min(union[amigo], desde) : desde;
+            }
+        }
+        const parametros = new URLSearchParams();
+        for (const amigo in union) {
+            parametros.append('c', amigo + ':' + union[amigo]);
+        }
+        if (!parametros.toString()) {
+            return;
+        }
+        fetch(URL_BANDEJA + '?' + parametros, {credentials: 'same-origin', headers: {'Accept': 'application/json'}})
+            .then(function (response) { return response.ok ? response.json() : Promise.reject(response.status); })
+            .then(function (datos) {
+                entregar(datos.conversaciones);
+                if (canal) {
+                    canal.postMessage({tipo: 'novedades', conversaciones: datos.conversaciones});
+                }
+                // Las demás ya las recibieron: no se les vuelven a pedir aunque no hayan avisado
+                for (const otra in ajenas) {
+                    for (const amigo in datos.conversaciones) {
+                        if (amigo in ajenas[otra].conversaciones) {
+                            ajenas[otra].conversaciones[amigo] = Math.max(
+                                ajenas[otra].conversaciones[amigo], datos.conversaciones[amigo].ultimo
+                            );
+                        }
+                    }
+                }
+            })
+            .catch(function (error) { console.error('Error en la bandeja:', error); });
+    }
+
+    function avisarEventos(eventos) {
+        eventos.forEach(function (evento) {
+            document.dispatchEvent(new CustomEvent('eventos', {detail: evento}));
+        });
+    }
+
+    function escuchar(cursor) {
+        const url = URL_EVENTOS + (cursor ? '?cursor=' + encodeURIComponent(cursor) : '');
+        fetch(url, {credentials: 'same-origin', headers: {'Accept': 'application/json'}})
+            .then(function (response) { return response.ok ? response.json() : Promise.reject(response.status); })
+            .then(function (datos) {
+                // Sin cursor todavía, o si el servidor perdió la cuenta (otro worker), se consulta
+                // igual: lo que llegue desde ahora ya viene por eventos
+                if (!cursor || !datos.al_dia || datos.eventos.some(function (evento) { return evento.tipo === 'mensaje'; })) {
+                    consultar();
+                }
+                avisarEventos(datos.eventos);
+                if (canal && datos.eventos.length) {
+                    canal.postMessage({tipo: 'eventos', eventos: datos.eventos});
+                }
+                if (respaldo === null) {
+                    respaldo = setInterval(consultar, datos.respaldo * 1000);
+                }
+                escuchar(datos.cursor);
+            })
+            .catch(function (error) {
+                console.error('Error en los eventos:', error);
+                setTimeout(function () {
+                    consultar();
+                    escuchar(cursor);
+                }, INTERVALO);
+            });
+    }
+
+    function liderar() {
+        lider = true;
+        if (URL_EVENTOS) {
+            escuchar(null);
+        } else {
+            consultar();
+            setInterval(consultar, INTERVALO);
+        }
+    }
+
+    if (canal) {
+        canal.onmessage = function (evento) {
+            const mensaje = evento.data;
+            if (mensaje.tipo === 'novedades') {
+                entregar(mensaje.conversaciones);
+            } else if (mensaje.tipo === 'eventos') {
+                avisarEventos(mensaje.eventos);
+            } else if (lider && mensaje.tipo === 'interes') {
+                ajenas[mensaje.pestana] = {conversaciones: mensaje.conversaciones, hasta: Date.now() + VIGENCIA};
+            } else if (lider && mensaje.tipo === 'adios') {
+                delete ajenas[mensaje.pestana];
+            } else if (lider && mensaje.tipo === 'ahora') {
+                consultar();
+            }
+        };
+        setInterval(anunciar, VIGENCIA / 3);
+        window.addEventListener('pagehide', function () {
+            canal.postMessage({tipo: 'adios', pestana: pestana});
+        });
+    }
+
+    if (canal && navigator.locks) {
+        // La promesa no se resuelve nunca: el lock se suelta al cerrar la pestaña
+        navigator.locks.request('bandeja:' + USUARIO, function () {
+            liderar();
+            return new Promise(function () {});
+        });
+    } else {
+        liderar();
+    }
+
+    window.Bandeja = {
+        // aviso({mensajes, no_leidos, ultimo}) con los mensajes posteriores a `desde`
+        seguir: function (amigo, desde, aviso) {
+            amigo = String(amigo);
+            if (!propias[amigo]) {
+                propias[amigo] = {desde: desde, avisos: []};
+            }
+            propias[amigo].avisos.push(aviso);
+            anunciar();
+        },
+        // Pide una consulta ya (p. ej. después de enviar un mensaje)
+        ahora: function () {
+            if (lider) {
+                consultar();
+            } else {
+                anunciar();
+                canal.postMessage({tipo: 'ahora'});
+            }
+        },
+        visto: visto,
+        marcarVisto: marcarVisto,
+    };
+})();
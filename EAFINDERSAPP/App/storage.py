@@ -0,0 +1,91 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+
+PREFIJO_BLOBS = 'blobs/'
+
+
+def nombre_blob(digest, extension):
+    """blobs/ab/cd/abcd...ef.png: dos niveles para no tener millones de archivos en un directorio"""
+    return f'{PREFIJO_BLOBS}{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def es_blob(nombre):
+    return bool(nombre) and nombre.startswith(PREFIJO_BLOBS)
+
+
+class AlmacenamientoPorContenido(FileSystemStorage):
+    """
+    Storage que nombra cada archivo por el SHA-256 de su contenido.
+
+    Dos subidas iguales (p. ej. R.png y R_1.png) terminan en el mismo blob. El hash se
+    calcula mientras el archivo se copia a un temporal dentro de blobs/, que luego se
+    renombra (o se descarta si el blob ya existía), así que el contenido se lee una sola vez.
+    Cada blob tiene una fila Blob; las referencias las llevan las señales de App.signals.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # _save decide el nombre final y dos archivos con el mismo nombre son el mismo archivo
+        return name
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        extension = os.path.splitext(name)[1].lower()
+        directorio_temporal = self.path(f'{PREFIJO_BLOBS}tmp')
+        os.makedirs(directorio_temporal, exist_ok=True)
+
+        digest = getattr(content, 'sha256', None)
+        ruta_subida = getattr(content, 'temporary_file_path', None)
+        if digest and ruta_subida:
+            # Ya hasheado por el upload handler (App.uploadhandlers): se mueve sin volver a leerlo
+            content.file.close()  # En Windows no se puede renombrar un archivo abierto
+            temporal = ruta_subida()
+            tamano = os.path.getsize(temporal)
+        else:
+            descriptor, temporal = tempfile.mkstemp(dir=directorio_temporal, suffix='.part')
+            sha256 = hashlib.sha256()
+            tamano = 0
+            try:
+                with os.fdopen(descriptor, 'wb') as salida:
+                    if hasattr(content, 'seek'):
+                        content.seek(0)
+                    for chunk in content.chunks():
+                        sha256.update(chunk)
+                        salida.write(chunk)
+                        tamano += len(chunk)
+            except BaseException:
+                os.remove(temporal)
+                raise
+            digest = sha256.hexdigest()
+
+        nombre = nombre_blob(digest, extension)
+        destino = self.path(nombre)
+        # Primero la fila: un blob sin referencias que se vuelve a subir se marca como usado antes
+        # de que post_save lo cuente, así limpiar_blobs (que respeta la gracia desde fecha_uso) no
+        # lo borra en el medio. Si limpiar_blobs ya se lo llevó, la fila se crea de nuevo.
+        nuevo = not Blob.objects.filter(nombre=nombre).update(fecha_uso=timezone.now())
+        if nuevo:
+            nuevo = Blob.objects.get_or_create(nombre=nombre, defaults={'tamano': tamano})[1]
+        if os.path.exists(destino) and not nuevo:
+            os.remove(temporal)
+        else:
+            # Con la fila recién creada se escribe igual: el archivo puede ser uno que limpiar_blobs
+            # está por borrar
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            os.replace(temporal, destino)
+            if self.file_permissions_mode is not None:
+                os.chmod(destino, self.file_permissions_mode)
+        return nombre
+
+
+# Sin location/base_url explícitos sigue a MEDIA_ROOT/MEDIA_URL aunque cambien (p. ej. en tests)
+_almacenamiento = AlmacenamientoPorContenido()
+
+
+def almacenamiento_por_contenido():
+    """Callable para el parámetro storage= de los campos (así las migraciones no lo congelan)"""
+    return _almacenamiento
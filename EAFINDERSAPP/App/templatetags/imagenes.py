@@ -0,0 +1,43 @@
+from django import template
+from django.forms.utils import flatatt
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+from .. import imagenes
+
+register = template.Library()
+
+
+@register.filter
+def srcset(archivo, formato='jpeg'):
+    """{{ user.foto_perfil|srcset:'webp' }} -> "url_64 64w, url_128 128w, ..." """
+    if not archivo:
+        return ''
+    return imagenes.srcset(archivo, formato)
+
+
+@register.simple_tag
+def imagen(archivo, ancho, alt='', defecto='default_profile.jpg', **atributos):
+    """
+    <picture> con miniaturas WebP y JPEG para mostrar `archivo` a `ancho` px.
+
+    {% imagen user.foto_perfil 100 alt="Foto de perfil" class="rounded-circle" %}
+    Si el campo está vacío se muestra la imagen estática `defecto`.
+    """
+    if not archivo:
+        return format_html('<img src="{}" alt="{}"{}>', static(defecto), alt, flatatt(atributos))
+
+    # Sin miniaturas en disco (todavía) se muestra la original
+    fuentes = ''
+    webp = imagenes.srcset(archivo, 'webp') if 'webp' in imagenes.FORMATOS else ''
+    if webp:
+        fuentes = format_html('<source type="image/webp" srcset="{}" sizes="{}px">', webp, ancho)
+    jpeg = imagenes.srcset(archivo, 'jpeg')
+    return format_html(
+        '<picture>{}<img src="{}"{} alt="{}" loading="lazy"{}></picture>',
+        fuentes,
+        imagenes.url_derivado(archivo, imagenes.tamano_para(ancho)),
+        flatatt({'srcset': jpeg, 'sizes': f'{ancho}px'} if jpeg else {}),
+        alt,
+        flatatt(atributos),
+    )
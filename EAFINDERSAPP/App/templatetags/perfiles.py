@@ -0,0 +1,12 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def tarjeta(tarjetas, usuario_id):
+    """
+    {% with autor=autores|tarjeta:comentario.autor_id %} — busca en el dict que la vista armó
+    con perfiles.obtener_tarjetas, en vez de seguir la FK (una consulta por comentario)
+    """
+    return tarjetas.get(usuario_id)
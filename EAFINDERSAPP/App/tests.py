@@ -1,3 +1,1453 @@
-from django.test import TestCase
+import asyncio
+import contextvars
+import difflib
+import importlib
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.exceptions import ChannelFull
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import cache_sqlite, chat, descubrir, eventos, feed, imagenes, metricas, perfiles, shards, uploadhandlers, urls
+from .backends.sqlite_wal.base import PRAGMAS_CONEXION, DatabaseWrapper
+from .admin import PaginadorEstimado
+from .cache_sqlite import CacheSQLite
+from .canales import CapaSQLite
+from .contadores import ContadorVistas, vistas_foro
+from .templatetags.imagenes import imagen as etiqueta_imagen
+from .middleware import plantilla_sql
+from .observers import actividad_subject, amistad_subject
+from .roster import importar_roster, limpiar_fila
+from .routers import RouterReplica, replica
+from .storage import almacenamiento_por_contenido
+from .models import Actividad, Amistad, ArchivoMensajes, Blob, Comentario, Etiqueta, FeedItem, Foro, Mensaje, Usuario
+
+# Los tests no escriben en la caché SQLite del servidor de desarrollo (settings.CACHES): los ids
+# de la base de pruebas pisarían las tarjetas de los usuarios de verdad
+_cache_de_prueba = override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+
+
+# La instrumentación SQL sigue activa (la miden algunos tests), pero su línea JSON por petición no
+# llena la salida de manage.py test; assertLogs('App.sql') baja el nivel mientras dura
+_log_sql = logging.getLogger('App.sql')
+_nivel_log_sql = _log_sql.level
+
+
+# Ni las métricas de las peticiones de prueba en el METRICAS_DIR del servidor: /metrics las sumaría.
+# Al terminar vuelve a quedar inactivo (el cliente de pruebas lo activa) y atexit no vuelca nada
+_metricas_de_prueba = tempfile.TemporaryDirectory()
+_directorio_metricas = mock.patch.multiple(metricas.registro, directorio=Path(_metricas_de_prueba.name), activo=False)
+
+
+# Las vistas de foros se vuelcan a mano en los tests (sin temporizador que escriba desde otro
+# hilo), y lo pendiente se vuelca al terminar, mientras la base de pruebas existe: el atexit del
+# proceso ya apuntaría a la base de desarrollo
+_vistas_sin_temporizador = mock.patch.object(vistas_foro, 'intervalo', None)
+
+
+def setUpModule():
+    _cache_de_prueba.enable()
+    _directorio_metricas.start()
+    _vistas_sin_temporizador.start()
+    _log_sql.setLevel(logging.CRITICAL)
+
+
+def tearDownModule():
+    vistas_foro.volcar()
+    _vistas_sin_temporizador.stop()
+    _cache_de_prueba.disable()
+    _directorio_metricas.stop()
+    _metricas_de_prueba.cleanup()
+    _log_sql.setLevel(_nivel_log_sql)
+
+
+# Consultas máximas por vista (con sesión iniciada, incluidas las de sesión, usuario y navbar).
+# Si una vista necesita más, que sea una decisión consciente y no un N+1 que se coló.
+# Se mide con la caché vacía: las vistas que leen tarjetas de perfil hacen una consulta menos en caliente.
+PRESUPUESTOS = {
+    'home': 6,  # En modo aleatorio, con el id máximo sin cachear
+    'home_api': 4,
+    'register': 3,
+    'login': 3,
+    'Cuenta': 4,
+    'EditProfile': 3,
+    'profile': 5,
+    'Notificaciones': 4,
+    'buscar_usuarios': 5,
+    'lista_conversaciones': 7,  # Más el último mensaje de cada conversación: una por shard
+    'chat_view': 6,
+    'obtener_mensajes': 4,
+    'bandeja': 4,  # Una consulta por shard
+    'eventos': 2,  # La sesión y el usuario; después espera sin base
+    'crear_foro': 4,
+    'detalle_foro': 8,  # Una es la del ETag (App/condicional.py); con 304 son 4
+    'lista_foros': 8,  # Una es la del ETag y otra el COUNT de la paginación; con 304 son 4
+    'feed': 10,
+    'metricas': 2,
+    'admin_changelist': 6,  # Con PaginadorEstimado: MAX(id) o un COUNT hasta CONTEO_MAXIMO, nunca COUNT(*) entero
+}
+
+# Acciones que solo redirigen después de un POST, y los archivos de media: no renderizan plantillas
+SIN_PRESUPUESTO = {
+    'logout', 'enviar_solicitud_amistad', 'aceptar_solicitud', 'rechazar_solicitud',
+    'eliminar_amistad', 'like_foro', 'seguir_etiqueta', 'media',
+}
+
+HASH = make_password('Password123')
+
+
+class Escenario:
+    """Datos alrededor de un usuario principal que se pueden hacer crecer entre mediciones"""
+
+    def __init__(self):
+        self.creados = 0
+        self.yo = self.usuarios(1)[0]
+        self.amigo = self.usuarios(1)[0]
+        Amistad.objects.create(user1=self.yo, user2=self.amigo, estado='aceptada')
+        self.foro = Foro.objects.create(titulo='Principal', descripcion='Foro medido', creador=self.amigo)
+
+    def usuarios(self, n):
+        inicio, self.creados = self.creados, self.creados + n
+        return Usuario.objects.bulk_create(
+            Usuario(nombres=f'Nombre{i}', apellidos=f'Apellido{i}', email_institucional=f'u{i}@eafit.edu.co',
+                    password=HASH, carrera='Derecho', semestre=1 + i % 10)
+            for i in range(inicio, self.creados)
+        )
+
+    def crecer(self, n):
+        """Agrega n amigos, solicitudes, mensajes, foros, comentarios con respuestas y actividades"""
+        amigos = self.usuarios(n)
+        Amistad.objects.bulk_create(
+            # La mitad de las amistades las inició el otro, para cubrir los dos lados de la relación
+            Amistad(user1=self.yo, user2=amigo, estado='aceptada') if i % 2
+            else Amistad(user1=amigo, user2=self.yo, estado='aceptada')
+            for i, amigo in enumerate(amigos)
+        )
+        Amistad.objects.bulk_create(
+            Amistad(user1=otro, user2=self.yo, estado='pendiente') for otro in self.usuarios(n)
+        )
+        Mensaje.objects.bulk_create(
+            Mensaje(remitente=self.yo, destinatario=self.amigo, contenido=f'hola {i}') if i % 2
+            else Mensaje(remitente=self.amigo, destinatario=self.yo, contenido=f'hola {i}')
+            for i in range(n)
+        )
+
+        etiquetas = Etiqueta.objects.bulk_create(
+            Etiqueta(nombre=f'etiqueta{self.creados}-{i}') for i in range(n)
+        )
+        foros = Foro.objects.bulk_create(
+            Foro(titulo=f'Foro {i}', descripcion='...', creador=amigo) for i, amigo in enumerate(amigos)
+        )
+        Foro.etiquetas.through.objects.bulk_create(
+            Foro.etiquetas.through(foro_id=foro.id, etiqueta_id=etiqueta.id)
+            for foro in foros + [self.foro] for etiqueta in etiquetas[:3]
+        )
+        Foro.likes.through.objects.bulk_create(
+            Foro.likes.through(foro_id=foro.id, usuario_id=amigo.id) for foro in foros for amigo in amigos[:3]
+        )
+
+        raices = Comentario.objects.bulk_create(
+            Comentario(foro=self.foro, autor=amigo, contenido='raíz') for amigo in amigos
+        )
+        Comentario.objects.bulk_create(
+            Comentario(foro=self.foro, autor=amigo, contenido='respuesta', parent=raiz)
+            for raiz in raices for amigo in amigos[:2]
+        )
+
+        actividades = Actividad.objects.bulk_create(
+            Actividad(actor=amigo, foro=foro, verbo='creo') for amigo, foro in zip(amigos, foros)
+        )
+        FeedItem.objects.bulk_create(
+            FeedItem(usuario=self.yo, actividad=actividad, fecha=actividad.fecha) for actividad in actividades
+        )
+        self.yo.etiquetas_seguidas.add(*etiquetas[:2])
+
+
+@override_settings(SQL_INSTRUMENTACION=False)
+class PresupuestoConsultasTests(TestCase):
+    """
+    Cada vista se mide con pocos datos y con muchos más: el número de consultas tiene que ser
+    el mismo (si crece con los datos es un N+1) y no pasar de su presupuesto.
+    """
+
+    databases = {'default', *shards.aliases()}
+    POCOS = 2
+    MUCHOS = 12
+
+    def setUp(self):
+        self.escenario = Escenario()
+        self.client.force_login(self.escenario.yo)
+
+    def medir(self, url):
+        # Nada de lo que quedó de otra petición debe cambiar la cuenta
+        cache.clear()
+        vistas_foro.volcar()
+        with ExitStack() as pila:
+            # También las consultas a los shards de mensajes
+            capturas = [pila.enter_context(CaptureQueriesContext(connections[alias])) for alias in sorted(self.databases)]
+            response = self.client.get(url)
+        self.assertLess(response.status_code, 400, f'{url} respondió {response.status_code}')
+        return [consulta for captura in capturas for consulta in captura.captured_queries]
+
+    def verificar(self, nombre, url, crecer=None):
+        crecer = crecer or self.escenario.crecer
+        crecer(self.POCOS)
+        pocas = self.medir(url)
+        crecer(self.MUCHOS - self.POCOS)
+        muchas = self.medir(url)
+
+        if len(pocas) != len(muchas):
+            self.fail(
+                f'{nombre}: {len(pocas)} consultas con {self.POCOS} elementos y {len(muchas)} con '
+                f'{self.MUCHOS}; crece con los datos (¿N+1?)\n{diferencia(pocas, muchas)}'
+            )
+        presupuesto = PRESUPUESTOS[nombre]
+        if len(muchas) > presupuesto:
+            self.fail(f'{nombre}: {len(muchas)} consultas, presupuesto {presupuesto}\n{listar(muchas)}')
+
+    def test_todas_las_vistas_tienen_presupuesto(self):
+        nombres = {patron.name for patron in urls.urlpatterns if patron.name}
+        self.assertEqual(nombres - set(PRESUPUESTOS) - SIN_PRESUPUESTO, set())
+
+    def test_home(self):
+        self.verificar('home', reverse('home'))
+
+    def test_home_aleatorio(self):
+        self.verificar('home', reverse('home') + '?modo=aleatorio')
+
+    def test_home_api(self):
+        self.verificar('home_api', reverse('home_api') + '?cursor=1000000')
+
+    def test_register(self):
+        self.verificar('register', reverse('register'))
+
+    def test_login(self):
+        self.verificar('login', reverse('login'))
+
+    def test_cuenta(self):
+        self.verificar('Cuenta', reverse('Cuenta'))
+
+    def test_edit_profile(self):
+        self.verificar('EditProfile', reverse('EditProfile'))
+
+    def test_profile(self):
+        self.verificar('profile', reverse('profile', args=[self.escenario.amigo.id]))
+
+    def test_notificaciones(self):
+        self.verificar('Notificaciones', reverse('Notificaciones'))
+
+    def test_buscar_usuarios(self):
+        self.verificar('buscar_usuarios', reverse('buscar_usuarios') + '?query=Nombre')
+
+    def test_lista_conversaciones(self):
+        self.verificar('lista_conversaciones', reverse('lista_conversaciones'))
+
+    def test_chat_view(self):
+        self.verificar('chat_view', reverse('chat_view', args=[self.escenario.amigo.id]))
+
+    def test_obtener_mensajes(self):
+        self.verificar('obtener_mensajes', reverse('obtener_mensajes', args=[self.escenario.amigo.id]))
+
+    def test_bandeja(self):
+        # Conversaciones repartidas en los dos shards, existan o no
+        self.verificar('bandeja', reverse('bandeja') + '?' + '&'.join(f'c={i}:0' for i in range(1, 40)))
+
+    def test_eventos(self):
+        self.verificar('eventos', reverse('eventos'))
+
+    def test_crear_foro(self):
+        self.verificar('crear_foro', reverse('crear_foro'))
+
+    def test_detalle_foro(self):
+        self.verificar('detalle_foro', reverse('detalle_foro', args=[self.escenario.foro.id]))
+
+    def test_lista_foros(self):
+        self.verificar('lista_foros', reverse('lista_foros'))
+
+    def test_lista_foros_tendencia(self):
+        self.verificar('lista_foros', reverse('lista_foros') + '?orden=tendencia')
+
+    def test_feed(self):
+        self.verificar('feed', reverse('feed'))
+
+    def test_metricas(self):
+        self.verificar('metricas', reverse('metricas'))
+
+    def verificar_admin(self, modelo, consulta='', crecer=None):
+        Usuario.objects.filter(id=self.escenario.yo.id).update(is_staff=True, is_superuser=True)
+        self.verificar('admin_changelist', reverse(f'admin:App_{modelo}_changelist') + consulta, crecer)
+
+    def test_admin_usuarios(self):
+        self.verificar_admin('usuario', '?date_joined__gte=2000-01-01')
+
+    def test_admin_amistades(self):
+        self.verificar_admin('amistad')
+
+    def test_admin_foros(self):
+        self.verificar_admin('foro')
+
+    def test_admin_comentarios(self):
+        self.verificar_admin('comentario')
+
+    def test_admin_mensajes(self):
+        # Cada mensaje con remitente distinto: las tarjetas de la página salen juntas, no por fila
+        alias = shards.aliases()[-1]
+
+        def crecer(n):
+            Mensaje.objects.using(alias).bulk_create(
+                Mensaje(remitente=otro, destinatario=self.escenario.yo, contenido='hola')
+                for otro in self.escenario.usuarios(n)
+            )
+        self.verificar_admin('mensaje', f'?shard={alias}', crecer)
+
+
+class PaginadorEstimadoTests(TestCase):
+    def setUp(self):
+        creador = Escenario().amigo
+        Foro.objects.bulk_create(Foro(titulo=f'Foro {i}', descripcion='...', creador=creador) for i in range(5))
+
+    def test_sin_filtros_estima_con_el_id_maximo(self):
+        maximo = Foro.objects.order_by('-id').values_list('id', flat=True).first()
+        paginador = PaginadorEstimado(Foro.objects.order_by('id'), 2)
+        with CaptureQueriesContext(connections['default']) as captura:
+            self.assertEqual(paginador.count, maximo)
+            self.assertEqual(paginador.num_pages, (maximo + 1) // 2)
+        self.assertEqual(len(captura), 1)
+        self.assertIn('MAX(', captura[0]['sql'])
+
+    def test_con_filtros_cuenta_hasta_el_maximo(self):
+        with mock.patch.object(PaginadorEstimado, 'CONTEO_MAXIMO', 3), self.assertNumQueries(1):
+            self.assertEqual(PaginadorEstimado(Foro.objects.filter(titulo__startswith='Foro'), 2).count, 3)
+        self.assertEqual(PaginadorEstimado(Foro.objects.filter(titulo__startswith='Foro'), 2).count, 5)
+
+
+class BlobsTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = Path(media.name)
+        ajustes = override_settings(MEDIA_ROOT=media.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def imagen(self, lado):
+        salida = BytesIO()
+        Image.new('RGB', (lado, lado), 'red').save(salida, 'JPEG')
+        return salida.getvalue()
+
+    def test_reprocesar_media_no_reescribe_blobs(self):
+        foto = self.imagen(64)
+        yo, otro = Escenario().usuarios(2)
+        for usuario in (yo, otro):
+            usuario.foto_perfil = ContentFile(foto, name='foto.jpg')
+            usuario.save()
+        viejo = yo.foto_perfil.name
+        self.assertEqual(Blob.objects.get(nombre=viejo).referencias, 2)
+
+        call_command('reprocesar_media', procesos=1, max_lado=32, sin_derivados=True,
+                     checkpoint=str(self.media / 'checkpoint'), stdout=StringIO())
+
+        # El blob viejo sigue teniendo el contenido de su hash; las filas apuntan al nuevo
+        self.assertEqual((self.media / viejo).read_bytes(), foto)
+        nombres = set(Usuario.objects.filter(id__in=[yo.id, otro.id]).values_list('foto_perfil', flat=True))
+        self.assertEqual(len(nombres), 1)
+        nuevo = nombres.pop()
+        self.assertNotEqual(nuevo, viejo)
+        self.assertEqual(Image.open(self.media / nuevo).size, (32, 32))
+        self.assertEqual(Blob.objects.get(nombre=viejo).referencias, 0)
+        self.assertEqual(Blob.objects.get(nombre=nuevo).referencias, 2)
+        self.assertEqual(set((self.media / 'checkpoint').read_text().split()), {viejo, nuevo})
+
+    def test_limpiar_blobs_respeta_los_que_se_vuelven_a_subir(self):
+        almacenamiento = almacenamiento_por_contenido()
+        nombre = almacenamiento.save('foto.jpg', ContentFile(self.imagen(8)))
+        hace_un_dia = timezone.now() - timezone.timedelta(days=1)
+        Blob.objects.filter(nombre=nombre).update(fecha_creacion=hace_un_dia, fecha_uso=hace_un_dia)
+        # Otra subida del mismo contenido que todavía no llegó a post_save (referencias sigue en 0)
+        self.assertEqual(almacenamiento.save('otra.jpg', ContentFile(self.imagen(8))), nombre)
+
+        call_command('limpiar_blobs', stdout=StringIO())
+        self.assertTrue(Blob.objects.filter(nombre=nombre, referencias=0).exists())
+        self.assertTrue(almacenamiento.exists(nombre))
+
+        Blob.objects.filter(nombre=nombre).update(fecha_uso=hace_un_dia)
+        call_command('limpiar_blobs', stdout=StringIO())
+        self.assertFalse(Blob.objects.filter(nombre=nombre).exists())
+        self.assertFalse(almacenamiento.exists(nombre))
+
+
+class AdjuntosTests(TestCase):
+    """AdjuntoUploadHandler a través del formulario de comentarios de ForoDetailView"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = Path(media.name)
+        ajustes = override_settings(MEDIA_ROOT=media.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.escenario = Escenario()
+        self.client.force_login(self.escenario.yo)
+        self.url = reverse('detalle_foro', args=[self.escenario.foro.id])
+
+    def jpeg(self, lado=32):
+        salida = BytesIO()
+        Image.effect_noise((lado, lado), 64).convert('RGB').save(salida, 'JPEG')
+        return salida.getvalue()
+
+    def comentar(self, datos, nombre='foto.jpg'):
+        return self.client.post(self.url, {
+            'contenido': 'hola', 'archivo': SimpleUploadedFile(nombre, datos, content_type='image/jpeg'),
+        })
+
+    def temporales(self):
+        return list((self.media / 'blobs' / 'tmp').glob('*'))
+
+    def test_guarda_el_blob_hasheado(self):
+        datos = self.jpeg()
+        self.assertRedirects(self.comentar(datos), self.url, fetch_redirect_response=False)
+        comentario = Comentario.objects.get(foro=self.escenario.foro)
+        self.assertEqual(comentario.archivo.name, f'blobs/{hashlib.sha256(datos).hexdigest()[:2]}/'
+                         f'{hashlib.sha256(datos).hexdigest()[2:4]}/{hashlib.sha256(datos).hexdigest()}.jpg')
+        self.assertEqual((self.media / comentario.archivo.name).read_bytes(), datos)
+        self.assertEqual(self.temporales(), [])
+
+    def test_rechaza_por_los_primeros_bytes(self):
+        # Se anuncia como JPEG pero es un PDF (y uno de menos de 12 bytes)
+        for datos in (b'%PDF-1.7\n' + b'x' * 4096, b'MZ\x90\x00'):
+            response = self.comentar(datos)
+            self.assertContains(response, 'Tipo de archivo no permitido.')
+        self.assertFalse(Comentario.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(self.temporales(), [])
+
+    def test_corta_al_pasar_el_limite_del_tipo(self):
+        datos = self.jpeg(256)
+        with mock.patch.dict(uploadhandlers.ADJUNTOS_LIMITES, {'image/jpeg': len(datos) - 1}):
+            response = self.comentar(datos)
+        self.assertContains(response, 'El archivo supera el máximo')
+        self.assertFalse(Comentario.objects.exists())
+        self.assertEqual(self.temporales(), [])
+
+    def test_stop_upload_si_el_cuerpo_ya_es_demasiado_grande(self):
+        datos = self.jpeg(512)
+        self.assertGreater(len(datos), 64 * 1024 + 1024)
+        with mock.patch.dict(uploadhandlers.ADJUNTOS_LIMITES, {'image/jpeg': 1024}, clear=True), \
+                mock.patch.object(uploadhandlers.AdjuntoUploadHandler, 'receive_data_chunk') as recibir:
+            response = self.comentar(datos)
+        recibir.assert_not_called()  # Ni se empezó a leer el archivo
+        self.assertContains(response, 'El archivo supera el máximo de 0.0 MB.')
+        self.assertFalse(Comentario.objects.exists())
+        self.assertFalse((self.media / 'blobs').exists())
+
+    def test_subida_cortada_no_deja_temporales(self):
+        datos = self.jpeg(128)
+        cuerpo = encode_multipart(BOUNDARY, {
+            'contenido': 'hola', 'archivo': SimpleUploadedFile('foto.jpg', datos, content_type='image/jpeg'),
+        })
+        # La conexión se cae a mitad del archivo: nunca llega el boundary que lo cierra
+        cortado = cuerpo[:cuerpo.index(datos) + len(datos) // 2]
+        with mock.patch.object(uploadhandlers.AdjuntoUploadHandler, 'upload_interrupted',
+                               autospec=True, side_effect=uploadhandlers.AdjuntoUploadHandler.upload_interrupted) as interrumpida:
+            self.client.generic('POST', self.url, cortado, content_type=MULTIPART_CONTENT)
+        interrumpida.assert_called_once()
+        self.assertEqual(self.temporales(), [])
+        self.assertFalse(Blob.objects.exists())
+
+    def test_post_sin_token_csrf_rechazado(self):
+        # dispatch está exento para poder instalar el handler; _post sigue protegido
+        cliente = Client(enforce_csrf_checks=True)
+        cliente.force_login(self.escenario.yo)
+        self.assertEqual(cliente.post(self.url, {'contenido': 'hola'}).status_code, 403)
+        cliente.get(self.url)
+        token = cliente.cookies['csrftoken'].value
+        response = cliente.post(self.url, {'contenido': 'hola', 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Comentario.objects.count(), 1)
+
+
+class ServirMediaTests(SimpleTestCase):
+    def setUp(self):
+        raiz = tempfile.TemporaryDirectory()
+        self.addCleanup(raiz.cleanup)
+        self.media = Path(raiz.name) / 'media'
+        (self.media / 'blobs' / 'tmp').mkdir(parents=True)
+        (Path(raiz.name) / 'secreto.txt').write_text('fuera de MEDIA_ROOT')
+        ajustes = override_settings(MEDIA_ROOT=str(self.media))
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.contenido = bytes(range(256)) * 4
+        (self.media / 'blobs' / 'ab.png').write_bytes(self.contenido)
+        (self.media / 'notas.txt').write_text('hola')
+
+    def pedir(self, path, **cabeceras):
+        return self.client.get(settings.MEDIA_URL + path, headers=cabeceras)
+
+    def cuerpo(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_archivo_completo(self):
+        response = self.pedir('blobs/ab.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cuerpo(response), self.contenido)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(response['Content-Disposition'].startswith('inline'))
+        self.assertEqual(self.pedir('notas.txt')['Content-Disposition'], 'attachment')
+
+    def test_un_rango(self):
+        for rango, inicio, fin in (('bytes=10-19', 10, 19), ('bytes=-5', 1019, 1023), ('bytes=1000-', 1000, 1023),
+                                   ('bytes=1020-5000', 1020, 1023)):
+            response = self.pedir('blobs/ab.png', Range=rango)
+            self.assertEqual(response.status_code, 206, rango)
+            self.assertEqual(self.cuerpo(response), self.contenido[inicio:fin + 1])
+            self.assertEqual(response['Content-Range'], f'bytes {inicio}-{fin}/1024')
+            self.assertEqual(response['Content-Length'], str(fin - inicio + 1))
+
+    def test_rango_imposible(self):
+        for rango in ('bytes=1024-', 'bytes=20-10'):
+            response = self.pedir('blobs/ab.png', Range=rango)
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_if_range_desactualizado_sirve_completo(self):
+        response = self.pedir('blobs/ab.png', Range='bytes=0-9', **{'If-Range': '"otro"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cuerpo(response), self.contenido)
+        etag = response['ETag']
+        self.assertEqual(self.pedir('blobs/ab.png', Range='bytes=0-9', **{'If-Range': etag}).status_code, 206)
+
+    def test_if_none_match(self):
+        etag = self.pedir('blobs/ab.png')['ETag']
+        response = self.pedir('blobs/ab.png', **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        # Con otro contenido (otro tamaño u otra fecha) el ETag ya no coincide
+        (self.media / 'blobs' / 'ab.png').write_bytes(self.contenido * 2)
+        self.assertEqual(self.pedir('blobs/ab.png', **{'If-None-Match': etag}).status_code, 200)
+
+    def test_fuera_de_media_y_privados(self):
+        (self.media / 'blobs' / 'tmp' / 'subida.part').write_bytes(b'a medias')
+        (self.media / '.reprocesar_media.checkpoint').write_text('blobs/ab.png')
+        for path in ('../secreto.txt', '%2e%2e/secreto.txt', 'blobs/../../secreto.txt', str(self.media.parent / 'secreto.txt'),
+                     'blobs/tmp/subida.part', '.reprocesar_media.checkpoint', 'blobs', 'no-existe.png'):
+            self.assertEqual(self.pedir(path).status_code, 404, path)
+
+    def test_solo_get_y_head(self):
+        self.assertEqual(self.client.post(settings.MEDIA_URL + 'blobs/ab.png').status_code, 405)
+        response = self.client.head(settings.MEDIA_URL + 'blobs/ab.png')
+        self.assertEqual(response['Content-Length'], '1024')
+
+
+class DerivadosTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = Path(media.name)
+        ajustes = override_settings(MEDIA_ROOT=media.name)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        anchos = mock.patch.dict(imagenes._anchos, clear=True)
+        anchos.start()
+        self.addCleanup(anchos.stop)
+        self.usuario = Escenario().yo
+
+    def subir(self, ancho, alto):
+        salida = BytesIO()
+        Image.new('RGB', (ancho, alto), 'blue').save(salida, 'PNG')
+        self.usuario.foto_perfil = ContentFile(salida.getvalue(), name='foto.png')
+        self.usuario.save()
+        return self.usuario.foto_perfil
+
+    def anchos(self, srcset):
+        return [int(parte.rsplit(' ', 1)[1].rstrip('w')) for parte in srcset.split(', ')]
+
+    def test_se_generan_al_subir(self):
+        foto = self.subir(300, 600)
+        for tamano in imagenes.TAMANOS:
+            for formato in imagenes.FORMATOS:
+                derivado = self.media / imagenes.nombre_derivado(foto.name, tamano, formato)
+                self.assertEqual(Image.open(derivado).height, min(tamano, 600))
+
+    def test_srcset_con_el_ancho_real(self):
+        foto = self.subir(300, 600)  # Vertical: la de 512 mide 256 de ancho
+        self.assertEqual(self.anchos(imagenes.srcset(foto)), [32, 64, 128, 256])
+        imagenes._anchos.clear()  # Otro worker: los lee de la cabecera de los archivos
+        self.assertEqual(self.anchos(imagenes.srcset(foto, 'jpeg')), [32, 64, 128, 256])
+        # Más chica que algunos tamaños: no se agranda y cada ancho va una vez
+        self.assertEqual(self.anchos(imagenes.srcset(self.subir(100, 50))), [64, 100])
+
+    def test_sin_derivados_no_se_generan_al_renderizar(self):
+        foto = self.subir(300, 600)
+        for derivado in (self.media / 'derivados').rglob('*.*'):
+            derivado.unlink()
+        imagenes._anchos.clear()
+
+        self.assertEqual(imagenes.url_derivado(foto, 128), foto.url)
+        self.assertEqual(imagenes.srcset(foto), '')
+        html = etiqueta_imagen(foto, 100, alt='Foto')
+        self.assertEqual(html, f'<picture><img src="{foto.url}" alt="Foto" loading="lazy"></picture>')
+        self.assertEqual(list((self.media / 'derivados').rglob('*.*')), [])
+
+
+class TarjetasPerfilTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuarios = Escenario().usuarios(3)
+
+    def test_segunda_lectura_sin_consultas(self):
+        ids = [u.id for u in self.usuarios]
+        with self.assertNumQueries(1):
+            perfiles.obtener_tarjetas(ids)
+        with self.assertNumQueries(0):
+            tarjetas = perfiles.obtener_tarjetas(ids)
+        self.assertEqual(list(tarjetas), ids)
+        self.assertEqual(tarjetas[ids[0]].nombres, self.usuarios[0].nombres)
+
+    def test_editar_perfil_invalida(self):
+        usuario = self.usuarios[0]
+        perfiles.obtener_tarjeta(usuario.id)
+        usuario.nombres = 'Cambiado'
+        usuario.save()
+        self.assertEqual(perfiles.obtener_tarjeta(usuario.id).nombres, 'Cambiado')
+
+    def test_iniciar_sesion_no_invalida(self):
+        usuario = self.usuarios[0]
+        perfiles.obtener_tarjeta(usuario.id)
+        usuario.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            perfiles.obtener_tarjeta(usuario.id)
+
+
+class GenerarDatosTests(TransactionTestCase):
+    # generar_datos cambia PRAGMA synchronous, que SQLite no deja tocar dentro de una transacción
+    databases = {'default', *shards.aliases()}
+
+    def test_populate_users_se_puede_repetir(self):
+        for _ in range(2):
+            call_command('populate_users', cantidad=2, stdout=StringIO())
+        self.assertEqual(
+            sorted(Usuario.objects.values_list('email_institucional', flat=True)),
+            [f'usuario{i}@eafit.edu.co' for i in range(4)],
+        )
+
+    def test_generar_datos_dos_veces_agrega(self):
+        totales = {'usuarios': 6, 'amistades': 10, 'mensajes': 5, 'etiquetas': 3, 'foros': 2, 'comentarios': 4}
+        for _ in range(2):
+            call_command('generar_datos', **totales, stdout=StringIO())
+        self.assertEqual(Usuario.objects.count(), 12)
+        self.assertEqual(Etiqueta.objects.count(), 6)
+        pares = [tuple(sorted(par)) for par in Amistad.objects.values_list('user1_id', 'user2_id')]
+        self.assertEqual(len(pares), 20)
+        self.assertEqual(len(set(pares)), 20)
+
+
+class RosterTests(TestCase):
+    def setUp(self):
+        pendientes = tempfile.TemporaryDirectory()
+        self.addCleanup(pendientes.cleanup)
+        self.pendientes = Path(pendientes.name)
+        directorio = mock.patch('App.roster.ROSTER_PENDIENTES_DIR', self.pendientes)
+        directorio.start()
+        self.addCleanup(directorio.stop)
+
+    def subir(self, contenido):
+        admin = Usuario.objects.create_superuser(
+            email_institucional='admin@eafit.edu.co', password='x', nombres='Ad', apellidos='Min')
+        self.client.force_login(admin)
+        archivo = SimpleUploadedFile('roster.csv', contenido.encode())
+        return self.client.post(reverse('admin:App_usuario_importar_roster'), {'archivo': archivo})
+
+    def test_fila_sin_correo(self):
+        for fila in ({'nombres': 'Ana', 'apellidos': 'Gómez'},
+                     {'email_institucional': '  ', 'nombres': 'Ana', 'apellidos': 'Gómez'}):
+            with self.assertRaises(ValidationError):
+                limpiar_fila(fila)
+
+    def test_filas_sin_correo_no_se_importan(self):
+        archivo = StringIO(
+            'nombres,apellidos,email\n'
+            'Ana,Gómez,\n'
+            'Luis,Pérez,\n'
+            'Eva,Ríos,eva@eafit.edu.co\n'
+        )
+        resultado = importar_roster(archivo, formato='csv', validar=True)
+        self.assertEqual((resultado.leidas, resultado.invalidas), (3, 2))
+        self.assertEqual([linea for linea, _ in resultado.errores], [2, 3])
+
+    def test_roster_parcial_conserva_las_columnas_que_no_trae(self):
+        Usuario.objects.create_user('ana@eafit.edu.co', 'clave', nombres='Ana', apellidos='Gómez',
+                                    carrera='Derecho', semestre=4, biografia='Hola')
+        resultado = importar_roster(StringIO('email,nombres,apellidos\nana@eafit.edu.co,Ana María,Gómez\n'),
+                                    formato='csv', procesos=1)
+        self.assertEqual(resultado.actualizados, 1)
+        ana = Usuario.objects.get(email_institucional='ana@eafit.edu.co')
+        self.assertEqual((ana.nombres, ana.carrera, ana.semestre, ana.biografia), ('Ana María', 'Derecho', 4, 'Hola'))
+        self.assertTrue(ana.check_password('clave'))
+
+        # En JSONL cada fila trae lo suyo; una columna que viene vacía sí se borra
+        importar_roster(StringIO('{"email": "ana@eafit.edu.co", "nombres": "Ana", "apellidos": "Gómez", "carrera": ""}\n'),
+                        formato='jsonl', procesos=1)
+        ana.refresh_from_db()
+        self.assertEqual((ana.carrera, ana.semestre), (None, 4))
+
+    def test_admin_hashea_sin_pool(self):
+        with mock.patch('App.roster.os.cpu_count', return_value=8), \
+                mock.patch('App.roster.ProcessPoolExecutor') as pool:
+            self.subir('nombres,apellidos,email,password\nAna,Gómez,ana@eafit.edu.co,clave\n')
+        pool.assert_not_called()
+        self.assertTrue(Usuario.objects.get(email_institucional='ana@eafit.edu.co').check_password('clave'))
+        self.assertEqual(list(self.pendientes.iterdir()), [])
+
+    def test_admin_pasa_los_rosters_grandes_al_comando(self):
+        filas = ''.join(f'N{i},A{i},u{i}@eafit.edu.co,clave{i}\n' for i in range(3))
+        with mock.patch('App.roster.ROSTER_ADMIN_MAX_CONTRASENAS', 2), \
+                mock.patch('App.admin.ROSTER_ADMIN_MAX_CONTRASENAS', 2), \
+                mock.patch('App.roster.subprocess.Popen') as popen:
+            self.subir('nombres,apellidos,email,password\n' + filas)
+        comando = popen.call_args.args[0]
+        self.assertEqual(comando[2], 'importar_roster')
+        self.assertIn('--borrar', comando)
+        self.assertFalse(Usuario.objects.filter(email_institucional='u0@eafit.edu.co').exists())
+
+        ruta = Path(comando[3])
+        self.assertEqual(ruta.stat().st_mode & 0o777, 0o600)
+        call_command('importar_roster', str(ruta), '--borrar', '--procesos', '1', stdout=StringIO())
+        self.assertFalse(ruta.exists())
+        self.assertEqual(Usuario.objects.filter(email_institucional__in=['u0@eafit.edu.co', 'u2@eafit.edu.co']).count(), 2)
+
+
+class DescubrirTests(TestCase):
+    databases = {'default', *shards.aliases()}  # Borrar usuarios borra sus mensajes en los shards
+
+    def setUp(self):
+        cache.clear()
+        self.escenario = Escenario()
+        self.escenario.usuarios(30)
+
+    def test_paginas_sin_repetir_ni_saltar(self):
+        vistos, cursor = [], None
+        while True:
+            tarjetas, cursor = descubrir.pagina(self.escenario.yo.id, cursor, limite=7)
+            vistos += [t.id for t in tarjetas]
+            if not cursor:
+                break
+        esperados = list(Usuario.objects.exclude(id=self.escenario.yo.id).order_by('-id').values_list('id', flat=True))
+        self.assertEqual(vistos, esperados)
+
+    def test_muestra_con_huecos(self):
+        # Con ids borrados y una tabla más grande que el sobremuestreo se sortean candidatos
+        Usuario.objects.filter(id__in=Usuario.objects.order_by('id').values('id')[:10]).delete()
+        tarjetas = descubrir.muestra(self.escenario.yo.id, cantidad=5, rng=random.Random(1))
+        ids = [t.id for t in tarjetas]
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+        self.assertNotIn(self.escenario.yo.id, ids)
+
+
+class RouterReplicaTests(SimpleTestCase):
+    def test_lee_de_replica_hasta_la_primera_escritura(self):
+        router = RouterReplica()
+
+        def peticion():
+            self.assertIsNone(router.db_for_read(Usuario))  # Fuera de una vista marcada
+            with replica():
+                self.assertEqual(router.db_for_read(Usuario), 'replica')
+                self.assertEqual(router.db_for_write(Usuario), 'default')
+                self.assertIsNone(router.db_for_read(Usuario))
+
+        with mock.patch('App.routers.hay_replica', return_value=True):
+            contextvars.copy_context().run(peticion)
+
+    def test_no_migra_la_replica(self):
+        self.assertFalse(RouterReplica().allow_migrate('replica', 'App'))
+        self.assertIsNone(RouterReplica().allow_migrate('default', 'App'))
+
+
+class FeedTests(TestCase):
+    def setUp(self):
+        self.escenario = Escenario()
+        self.actor, self.lector = self.escenario.amigo, self.escenario.yo
+        limite = mock.patch.object(feed, 'FEED_FANOUT_MAX_AMIGOS', 1)
+        limite.start()
+        self.addCleanup(limite.stop)
+
+    def ids_feed(self, usuario):
+        return [actividad.id for actividad in feed.obtener_feed(usuario)[0]]
+
+    def test_alto_grado_que_deja_de_serlo(self):
+        otro = self.escenario.usuarios(1)[0]
+        amistad = Amistad.objects.create(user1=self.actor, user2=otro, estado='aceptada')
+        actividad = actividad_subject.registrar(self.actor, 'creo', self.escenario.foro)
+        self.assertFalse(Actividad.objects.get(id=actividad.id).difundida)
+        self.assertFalse(FeedItem.objects.exists())
+        amistad.delete()
+        self.assertEqual(self.ids_feed(self.lector), [actividad.id])
+
+    def test_bajo_grado_que_deja_de_serlo(self):
+        actividad = actividad_subject.registrar(self.actor, 'creo', self.escenario.foro)
+        self.assertTrue(FeedItem.objects.filter(usuario=self.lector, actividad=actividad).exists())
+        Amistad.objects.create(user1=self.actor, user2=self.escenario.usuarios(1)[0], estado='aceptada')
+        self.assertEqual(self.ids_feed(self.lector), [actividad.id])
+
+
+class ShardsMensajesTests(TestCase):
+    databases = {'default', *shards.aliases()}
+
+    def setUp(self):
+        self.a, self.b, self.c = Escenario().usuarios(3)
+
+    def test_conversacion_en_su_shard(self):
+        Mensaje.objects.create(remitente=self.a, destinatario=self.b, contenido='hola')
+        Mensaje.objects.bulk_create([Mensaje(remitente=self.b, destinatario=self.a, contenido='chao')])
+        alias = shards.shard_de(self.a.id, self.b.id)
+        for otro in shards.aliases():
+            self.assertEqual(Mensaje.objects.using(otro).count(), 2 if otro == alias else 0)
+        self.assertEqual(
+            list(Mensaje.objects.conversacion(self.b, self.a).order_by('id').values_list('contenido', flat=True)),
+            ['hola', 'chao'],
+        )
+        # La FK a Usuario se resuelve en default, no en el shard del mensaje
+        self.assertEqual(Mensaje.objects.conversacion(self.a, self.b).first().remitente, self.a)
+
+    def test_agregar_un_shard_mueve_una_fraccion(self):
+        claves = [shards.clave_conversacion(i, i + 1) for i in range(2000)]
+        movidas = sum(shards.salto(clave, 4) != shards.salto(clave, 5) for clave in claves)
+        self.assertLess(abs(movidas / len(claves) - 1 / 5), 0.05)
+
+    def test_rebalancear(self):
+        # Mensajes que quedaron en el shard equivocado (p. ej. antes de agregar uno)
+        alias = shards.shard_de(self.a.id, self.c.id)
+        otro = next(s for s in shards.aliases() if s != alias)
+        Mensaje.objects.using(otro).bulk_create(
+            Mensaje(remitente=self.a, destinatario=self.c, contenido=str(i)) for i in range(5)
+        )
+        call_command('rebalancear_mensajes', dry_run=True, stdout=StringIO())
+        self.assertEqual(Mensaje.objects.using(otro).count(), 5)
+        ids = list(Mensaje.objects.using(otro).order_by('id').values_list('id', flat=True))
+        self.assertEqual(ids[0], shards.primer_id(otro))
+        call_command('rebalancear_mensajes', lote=2, stdout=StringIO())
+        self.assertEqual(Mensaje.objects.using(otro).count(), 0)
+        # Con los mismos ids: ?desde= y los cursores de la bandeja siguen apuntando al mismo mensaje
+        self.assertEqual(list(Mensaje.objects.conversacion(self.a, self.c).order_by('id').values_list('id', flat=True)), ids)
+        nuevo = Mensaje.objects.create(remitente=self.c, destinatario=self.a, contenido='después')
+        self.assertGreater(nuevo.id, ids[-1])
+        self.assertEqual(list(Mensaje.objects.conversacion(self.a, self.c).filter(id__gt=ids[-1])), [nuevo])
+
+    def test_rebalancear_no_pisa_ids(self):
+        alias = shards.shard_de(self.a.id, self.c.id)
+        otro = next(s for s in shards.aliases() if s != alias)
+        movido = Mensaje.objects.using(otro).create(remitente=self.a, destinatario=self.c, contenido='movido')
+        Mensaje.objects.using(alias).create(id=movido.id, remitente=self.b, destinatario=self.c, contenido='ajeno')
+        with self.assertRaises(CommandError):
+            call_command('rebalancear_mensajes', stdout=StringIO())
+        self.assertTrue(Mensaje.objects.using(otro).filter(id=movido.id, contenido='movido').exists())
+        self.assertEqual(Mensaje.objects.using(alias).get(id=movido.id).contenido, 'ajeno')
+
+    def test_borrar_usuario_borra_sus_mensajes(self):
+        Mensaje.objects.create(remitente=self.a, destinatario=self.b, contenido='hola')
+        Mensaje.objects.create(remitente=self.c, destinatario=self.a, contenido='hola')
+        self.a.delete()
+        self.assertFalse(any(Mensaje.objects.using(alias).exists() for alias in shards.aliases()))
+
+
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def normalizar(sql):
+    """La consulta capturada trae los parámetros ya puestos: se vuelven %s para comparar"""
+    return plantilla_sql(_LITERALES.sub('%s', sql))
+
+
+def diferencia(antes, despues):
+    """Diff de las consultas (sin literales y con los IN (...) colapsados) entre las dos mediciones"""
+    return '\n'.join(difflib.unified_diff(
+        [normalizar(q['sql']) for q in antes],
+        [normalizar(q['sql']) for q in despues],
+        'pocos datos', 'muchos datos', lineterm='',
+    ))
+
+
+def listar(consultas):
+    repetidas = Counter(normalizar(q['sql']) for q in consultas)
+    return '\n'.join(
+        f'{veces}x {sql}' for sql, veces in sorted(repetidas.items(), key=lambda item: -item[1])
+    )
+
+
+class RetencionTests(TestCase):
+    databases = {'default', *shards.aliases()}
+
+    def setUp(self):
+        self.a, self.b, self.c = Escenario().usuarios(3)
+        hace_tres_anios = timezone.now() - timezone.timedelta(days=3 * 365)
+        for i in range(5):
+            Mensaje.objects.create(remitente=self.a, destinatario=self.b, contenido=f'viejo {i} ñ')
+        Mensaje.objects.conversacion(self.a, self.b).update(fecha_enviado=hace_tres_anios)
+        Mensaje.objects.create(remitente=self.b, destinatario=self.a, contenido='nuevo')
+        Amistad.objects.create(user1=self.a, user2=self.c, estado='rechazada')
+        Amistad.objects.update(fecha_amistad=hace_tres_anios)
+        Amistad.objects.create(user1=self.b, user2=self.c, estado='rechazada')
+        self.alias = shards.shard_de(self.a.id, self.b.id)
+
+    def test_dry_run_no_cambia_nada(self):
+        salida = StringIO()
+        call_command('retencion', dry_run=True, stdout=salida)
+        self.assertIn(f'{self.alias}: se archivarían 5 mensajes', salida.getvalue())
+        self.assertIn('Se borrarían 1 solicitudes rechazadas', salida.getvalue())
+        self.assertEqual(Mensaje.objects.conversacion(self.a, self.b).count(), 6)
+        self.assertEqual(Amistad.objects.filter(estado='rechazada').count(), 2)
+
+    def test_archiva_por_lotes_y_purga(self):
+        call_command('retencion', lote=2, pausa=0, stdout=StringIO())
+        self.assertEqual(
+            list(Mensaje.objects.conversacion(self.a, self.b).values_list('contenido', flat=True)), ['nuevo']
+        )
+        lotes = ArchivoMensajes.objects.using(self.alias).order_by('primer_id')
+        self.assertEqual([lote.cantidad for lote in lotes], [2, 2, 1])
+        archivados = [mensaje for lote in lotes for mensaje in lote.mensajes()]
+        self.assertEqual([m['contenido'] for m in archivados], [f'viejo {i} ñ' for i in range(5)])
+        self.assertEqual(archivados[0]['remitente_id'], self.a.id)
+        self.assertEqual(list(Amistad.objects.filter(estado='rechazada').values_list('user1_id', flat=True)), [self.b.id])
+
+    def test_politica_desactivada(self):
+        call_command('retencion', mensajes_dias=None, pausa=0, stdout=StringIO())
+        self.assertEqual(Mensaje.objects.conversacion(self.a, self.b).count(), 6)
+        self.assertEqual(Amistad.objects.filter(estado='rechazada').count(), 1)
+
+
+class ContadorVistasTests(TransactionTestCase):
+    # El temporizador vuelca desde su propio hilo y conexión: no puede ir dentro de la transacción de TestCase
+
+    def test_vuelca_por_tiempo_sin_mas_visitas(self):
+        foro = Escenario().foro
+        contador = ContadorVistas(intervalo=0.05, maximo=100)
+        # Se espera a que termine el volcado: la base de pruebas en memoria bloquea la tabla entera
+        volcado, volcar = threading.Event(), contador.volcar
+        with mock.patch.object(contador, 'volcar', side_effect=lambda: (volcar(), volcado.set())):
+            contador.incrementar(foro.id, 3)
+            self.assertEqual(contador.pendientes(foro.id), 3)
+            self.assertTrue(volcado.wait(5))
+        self.assertEqual(contador.pendientes(foro.id), 0)
+        self.assertEqual(Foro.objects.get(id=foro.id).vistas, 3)
+
+    def test_por_cantidad_vuelca_enseguida(self):
+        foro = Escenario().foro
+        contador = ContadorVistas(intervalo=None, maximo=3)
+        contador.incrementar(foro.id, 2)
+        self.assertEqual(Foro.objects.get(id=foro.id).vistas, 0)
+        contador.incrementar(foro.id)
+        self.assertEqual(Foro.objects.get(id=foro.id).vistas, 3)
+
+
+class GetCondicionalTests(TestCase):
+    def setUp(self):
+        self.escenario = Escenario()
+        self.client.force_login(self.escenario.yo)
+
+    def revalidar(self, url):
+        """ETag de un GET normal y respuesta del GET condicional que lo sigue"""
+        etag = self.client.get(url)['ETag']
+        return etag, self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_304_mientras_no_cambie(self):
+        url = reverse('lista_foros')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+        with self.assertNumQueries(4):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_las_visitas_cuentan_con_304_pero_no_en_foros_inexistentes(self):
+        foro = self.escenario.foro
+        vistas_foro.volcar()
+        etag, response = self.revalidar(reverse('detalle_foro', args=[foro.id]))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(vistas_foro.pendientes(foro.id), 2)
+
+        inexistente = Foro.objects.order_by('-id').values_list('id', flat=True).first() + 1000
+        self.assertEqual(self.client.get(reverse('detalle_foro', args=[inexistente])).status_code, 404)
+        self.assertEqual(vistas_foro.pendientes(inexistente), 0)
+
+    def test_comentarios_y_likes_cambian_el_foro(self):
+        url = reverse('detalle_foro', args=[self.escenario.foro.id])
+        foro = self.escenario.foro
+        for cambio in (
+            lambda: Comentario.objects.create(foro=foro, autor=self.escenario.amigo, contenido='nuevo'),
+            lambda: foro.likes.add(self.escenario.yo),
+            lambda: self.escenario.yo.foros_likes.clear(),
+        ):
+            etag, _ = self.revalidar(url)
+            Foro.objects.filter(id=foro.id).update(fecha_actualizacion=timezone.now() - timezone.timedelta(days=1))
+            cambio()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_lista_de_foros_cambia_con_la_version(self):
+        url = reverse('lista_foros')
+        foro, amigo = self.escenario.foro, self.escenario.amigo
+        for cambio in (
+            lambda: Foro.objects.create(titulo='Otro', descripcion='...', creador=amigo),
+            lambda: foro.likes.add(self.escenario.yo),
+            lambda: Comentario.objects.create(foro=foro, autor=amigo, contenido='nuevo'),
+            lambda: (vistas_foro.incrementar(foro.id), vistas_foro.volcar()),
+            lambda: Usuario.objects.get(id=amigo.id).save(update_fields=['nombres']),
+            lambda: Foro.objects.filter(titulo='Otro').delete(),
+        ):
+            etag, response = self.revalidar(url)
+            self.assertEqual(response.status_code, 304)
+            cambio()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag, _ = self.revalidar(url)
+        self.escenario.yo.save(update_fields=['last_login'])  # No sale en la lista
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_lista_de_foros_paginada(self):
+        Foro.objects.bulk_create(
+            Foro(titulo=f'Foro {i}', descripcion='...', creador=self.escenario.amigo) for i in range(4)
+        )
+        with mock.patch('App.views.ForoListView.paginate_by', 2):
+            response = self.client.get(reverse('lista_foros'), {'orden': 'tendencia', 'page': 2})
+        self.assertEqual(len(response.context['foros']), 2)
+        self.assertContains(response, 'Página 2 de 3')
+        self.assertContains(response, '?orden=tendencia&amp;page=3')
+
+    def test_perfil_cambia_con_la_amistad(self):
+        otro = self.escenario.usuarios(1)[0]
+        url = reverse('profile', args=[otro.id])
+        etag, response = self.revalidar(url)
+        self.assertEqual(response.status_code, 304)
+        Amistad.objects.create(user1=otro, user2=self.escenario.yo, estado='pendiente')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_anonimo_cacheable_por_proxies(self):
+        self.client.logout()
+        response = self.client.get(reverse('lista_foros'))
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age', response['Cache-Control'])
+
+
+class FormatoChatTests(TestCase):
+    databases = {'default', *shards.aliases()}
+
+    def setUp(self):
+        # Mismo nombre: el lado de cada mensaje se decide por id
+        self.yo, self.amigo = Escenario().usuarios(2)
+        Usuario.objects.filter(id__in=[self.yo.id, self.amigo.id]).update(nombres='Ana')
+        self.client.force_login(self.yo)
+        self.url = reverse('obtener_mensajes', args=[self.amigo.id])
+        self.primero = Mensaje.objects.create(remitente=self.yo, destinatario=self.amigo, contenido='hola')
+        self.segundo = Mensaje.objects.create(remitente=self.amigo, destinatario=self.yo, contenido='<b>chao</b>')
+
+    def test_carga_completa(self):
+        datos = self.client.get(self.url).json()
+        self.assertEqual(datos['participantes'], {str(self.yo.id): 'Ana', str(self.amigo.id): 'Ana'})
+        self.assertEqual(
+            [fila[:2] + fila[3:] for fila in datos['mensajes']],
+            [[self.primero.id, self.yo.id, 'hola'], [self.segundo.id, self.amigo.id, '<b>chao</b>']],
+        )
+        self.assertEqual(datos['mensajes'][0][2], int(self.primero.fecha_enviado.timestamp()))
+        self.assertEqual(datos['ultimo'], self.segundo.id)
+
+    def test_solo_los_nuevos(self):
+        datos = self.client.get(self.url, {'desde': self.primero.id}).json()
+        self.assertNotIn('participantes', datos)
+        self.assertEqual([fila[0] for fila in datos['mensajes']], [self.segundo.id])
+        datos = self.client.get(self.url, {'desde': self.segundo.id}).json()
+        self.assertEqual(datos, {'mensajes': [], 'ultimo': self.segundo.id})
+
+    def test_msgpack_si_se_prefiere(self):
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT='application/msgpack')['Content-Type'], 'application/json')
+        falso = mock.Mock(packb=lambda datos, use_bin_type: repr(datos).encode())
+        with mock.patch.object(chat, 'msgpack', falso):
+            response = self.client.get(self.url, HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            # jQuery manda */* con menos peso que JSON
+            response = self.client.get(self.url, HTTP_ACCEPT='application/json, */*; q=0.01')
+            self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class BandejaTests(TestCase):
+    databases = {'default', *shards.aliases()}
+
+    def setUp(self):
+        self.yo, self.ana, self.luis, self.eva = Escenario().usuarios(4)
+        self.client.force_login(self.yo)
+        self.viejo = Mensaje.objects.create(remitente=self.ana, destinatario=self.yo, contenido='viejo')
+        self.nuevos = [
+            Mensaje.objects.create(remitente=self.ana, destinatario=self.yo, contenido='uno'),
+            Mensaje.objects.create(remitente=self.yo, destinatario=self.ana, contenido='dos'),
+        ]
+        self.de_luis = Mensaje.objects.create(remitente=self.luis, destinatario=self.yo, contenido='hola')
+
+    def test_solo_las_conversaciones_con_novedades(self):
+        response = self.client.get(reverse('bandeja'), {'c': [
+            f'{self.ana.id}:{self.viejo.id}', f'{self.luis.id}:{self.de_luis.id}', f'{self.eva.id}:0',
+        ]})
+        conversaciones = response.json()['conversaciones']
+        self.assertEqual(list(conversaciones), [str(self.ana.id)])
+        ana = conversaciones[str(self.ana.id)]
+        self.assertEqual([fila[0] for fila in ana['mensajes']], [m.id for m in self.nuevos])
+        self.assertEqual(ana['no_leidos'], 1)
+        self.assertEqual(ana['ultimo'], self.nuevos[-1].id)
+
+    def test_conversacion_invalida(self):
+        self.assertEqual(self.client.get(reverse('bandeja'), {'c': 'ana:1'}).status_code, 400)
+
+    def test_ultimos_de_la_lista(self):
+        self.assertEqual(
+            chat.ultimos(self.yo.id, [self.ana.id, self.luis.id, self.eva.id]),
+            {self.ana.id: self.nuevos[-1].id, self.luis.id: self.de_luis.id},
+        )
+
+
+class EventosTests(TestCase):
+    databases = {'default', *shards.aliases()}
+
+    def setUp(self):
+        self.yo, self.ana, self.luis = Escenario().usuarios(3)
+        self.buzon = eventos.Buzon(recientes=3, usuarios=2)
+        self.esperar = async_to_sync(self.buzon.esperar)
+
+    def test_lo_posterior_al_cursor(self):
+        cursor = self.esperar(self.yo.id, None)['cursor']
+        self.buzon.publicar(self.yo.id, {'n': 1})
+        self.buzon.publicar(self.ana.id, {'n': 2})
+        respuesta = self.esperar(self.yo.id, cursor, 1)
+        self.assertEqual((respuesta['eventos'], respuesta['al_dia']), ([{'n': 1}], True))
+        self.assertEqual(self.esperar(self.yo.id, respuesta['cursor'], 0.01)['eventos'], [])
+
+    def test_despierta_desde_otro_hilo(self):
+        cursor = self.buzon.cursor()
+
+        async def esperar():
+            tarea = asyncio.ensure_future(self.buzon.esperar(self.yo.id, cursor, 5))
+            await asyncio.sleep(0.01)
+            self.assertEqual(self.buzon.esperando(), 1)
+            threading.Thread(target=self.buzon.publicar, args=(self.yo.id, {'n': 1})).start()
+            return await tarea
+
+        inicio = time.monotonic()
+        self.assertEqual(async_to_sync(esperar)()['eventos'], [{'n': 1}])
+        self.assertLess(time.monotonic() - inicio, 1)
+        self.assertEqual(self.buzon.esperando(), 0)
+
+    def test_cursor_que_no_sirve(self):
+        # De otro proceso, y con eventos que ya se olvidaron (por usuario y por usuarios)
+        self.assertFalse(self.esperar(self.yo.id, 'otro:0', 5)['al_dia'])
+        cursor = self.buzon.cursor()
+        for n in range(4):
+            self.buzon.publicar(self.yo.id, {'n': n})
+        self.assertEqual(self.esperar(self.yo.id, cursor, 5), {'cursor': self.buzon.cursor(), 'eventos': [], 'al_dia': False})
+        cursor = self.buzon.cursor()
+        self.buzon.publicar(self.yo.id, {'n': 4})
+        self.buzon.publicar(self.ana.id, {'n': 5})
+        self.buzon.publicar(self.luis.id, {'n': 6})
+        self.assertFalse(self.esperar(self.yo.id, cursor, 5)['al_dia'])
+        self.assertEqual(self.esperar(self.luis.id, cursor, 5)['eventos'], [{'n': 6}])
+
+    def test_mensajes_y_solicitudes(self):
+        cursor = self.buzon.cursor()
+        with mock.patch.object(eventos, 'buzon', self.buzon):
+            with self.captureOnCommitCallbacks(using=shards.shard_de(self.yo.id, self.ana.id), execute=True):
+                mensaje = Mensaje.objects.create(remitente=self.yo, destinatario=self.ana, contenido='hola')
+            with self.captureOnCommitCallbacks(execute=True):
+                amistad = amistad_subject.enviar_solicitud(self.yo, self.ana)
+        recibidos = self.esperar(self.ana.id, cursor, 1)['eventos']
+        self.assertEqual(recibidos, [
+            {'tipo': 'mensaje', 'id': mensaje.id, 'remitente': self.yo.id, 'destinatario': self.ana.id},
+            {'tipo': 'solicitud_enviada', 'amistad': amistad.id, 'remitente': self.yo.id, 'destinatario': self.ana.id},
+        ])
+        self.assertEqual(self.esperar(self.yo.id, cursor, 1)['eventos'], recibidos)
+
+    async def test_vista(self):
+        await self.async_client.aforce_login(self.yo)
+        with mock.patch.object(eventos, 'buzon', self.buzon), mock.patch.object(eventos, 'LONGPOLL_SEGUNDOS', 0.05):
+            with self.assertLogs('App.sql', 'INFO') as registro:
+                primera = (await self.async_client.get(reverse('eventos'))).json()
+            cursor = primera['cursor']
+            # Sin LONGPOLL_CAPA los eventos de otros workers solo llegan por la consulta de respaldo
+            self.assertEqual(primera['respaldo'], 2)
+            # Las consultas de la sesión y el usuario corren en otro hilo y también se miden
+            self.assertIn('"consultas": 2', registro.output[0])
+            self.assertEqual((await self.async_client.get(reverse('eventos'), {'cursor': cursor})).json()['eventos'], [])
+            asyncio.get_running_loop().call_later(0.01, self.buzon.publicar, self.yo.id, {'n': 1})
+            with mock.patch.object(eventos, 'LONGPOLL_SEGUNDOS', 5):
+                response = await self.async_client.get(reverse('eventos'), {'cursor': cursor})
+        self.assertEqual(response.json()['eventos'], [{'n': 1}])
+
+    @override_settings(DEBUG=True)
+    def test_middleware_async_sin_hilos(self):
+        # Con un middleware solo síncrono Django corre la vista async dentro de un hilo
+        with self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+
+class CapaSQLiteTests(SimpleTestCase):
+    """Dos capas sobre el mismo archivo hacen de dos workers"""
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.ruta = Path(directorio.name) / 'canales.sqlite3'
+
+    def capa(self, **opciones):
+        return CapaSQLite(self.ruta, **{'intervalo_maximo': 0.01, **opciones})
+
+    def correr(self, corrutina):
+        return async_to_sync(corrutina)()
+
+    def test_canales_y_grupos_entre_procesos(self):
+        a, b = self.capa(), self.capa()
+
+        async def probar():
+            canal_a, canal_b = await a.new_channel(), await b.new_channel()
+            await a.group_add('chat', canal_a)
+            await b.group_add('chat', canal_b)
+            await a.group_send('chat', {'type': 'chat.mensaje', 'n': 1})
+            recibidos = [await asyncio.wait_for(capa.receive(canal), 1) for capa, canal in ((a, canal_a), (b, canal_b))]
+            await b.group_discard('chat', canal_b)
+            await b.group_send('chat', {'n': 2})
+            await b.send(canal_a, {'n': 3})
+            await a.send('trabajos', {'n': 4})
+            recibidos += [await a.receive(canal_a), await a.receive(canal_a), await b.receive('trabajos')]
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(b.receive(canal_b), 0.05)
+            return recibidos
+
+        self.assertEqual(self.correr(probar), [
+            {'type': 'chat.mensaje', 'n': 1}, {'type': 'chat.mensaje', 'n': 1}, {'n': 2}, {'n': 3}, {'n': 4},
+        ])
+
+    def test_capacidad(self):
+        capa = self.capa(capacity=2, channel_capacity={'grande*': 3})
+
+        async def probar():
+            canal = await capa.new_channel()
+            await capa.group_add('g', canal)
+            for n in range(2):
+                await capa.send(canal, {'n': n})
+            with self.assertRaises(ChannelFull):
+                await capa.send(canal, {'n': 2})
+            await capa.group_send('g', {'n': 3})  # Se salta el canal lleno
+            for n in range(3):
+                await capa.send('grande', {'n': n})
+            with self.assertRaises(ChannelFull):
+                await capa.send('grande', {'n': 3})
+            return [await capa.receive(canal), await capa.receive(canal)]
+
+        self.assertEqual(self.correr(probar), [{'n': 0}, {'n': 1}])
+
+    def test_vencimiento(self):
+        capa = self.capa(expiry=0.05)
+
+        async def probar():
+            canal = await capa.new_channel()
+            await capa.group_add('g', canal)
+            await capa.send(canal, {'n': 1})
+            await asyncio.sleep(0.1)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(capa.receive(canal), 0.05)
+            # El canal con un mensaje vencido sale de los grupos, como en la capa en memoria
+            await capa.group_send('g', {'n': 2})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(capa.receive(canal), 0.05)
+
+        self.correr(probar)
+
+    def test_flush(self):
+        capa = self.capa()
+
+        async def probar():
+            await capa.send('trabajos', {'n': 1})
+            await capa.flush()
+            await capa.send('trabajos', {'n': 2})
+            return await capa.receive('trabajos')
+
+        self.assertEqual(self.correr(probar), {'n': 2})
+
+    def test_eventos_del_long_poll_entre_procesos(self):
+        # El worker b publica un mensaje nuevo; la espera está en el worker a
+        a, b = self.capa(), self.capa()
+        buzon = eventos.Buzon()
+        cursor = buzon.cursor()
+
+        async def esperar():
+            with mock.patch.object(eventos, 'capa', lambda: a):
+                await eventos.escuchar()
+            espera = asyncio.ensure_future(buzon.esperar(7, cursor, 2))
+            with mock.patch.object(eventos, 'capa', lambda: b):
+                await sync_to_async(eventos.entregar)([7], {'tipo': 'mensaje', 'id': 1})
+            respuesta = await espera
+            eventos._escucha[0].cancel()
+            return respuesta
+
+        with mock.patch.object(eventos, 'buzon', buzon), mock.patch.object(eventos, '_escucha', None):
+            self.assertEqual(async_to_sync(esperar)()['eventos'], [{'tipo': 'mensaje', 'id': 1}])
+
+
+class PragmasSQLiteTests(SimpleTestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.ajustes = {**connections['default'].settings_dict, 'NAME': str(Path(directorio.name) / 'db.sqlite3')}
+
+    def pragmas(self, *nombres):
+        conexion = DatabaseWrapper(self.ajustes, alias='pragmas')
+        try:
+            with conexion.cursor() as cursor:
+                return {nombre: cursor.execute(f'PRAGMA {nombre}').fetchone()[0] for nombre in nombres}
+        finally:
+            conexion.close()
+
+    def test_conexion_nueva_con_los_pragmas(self):
+        self.assertEqual(self.pragmas(*PRAGMAS_CONEXION), {
+            'synchronous': 1,  # NORMAL
+            'busy_timeout': 5000,
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,
+            'temp_store': 2,  # MEMORY
+        })
+
+    def test_wal_se_fija_una_vez_en_el_archivo(self):
+        # Abrir una conexión no cambia el journal del archivo (ni deja -wal/-shm)
+        self.assertEqual(self.pragmas('journal_mode'), {'journal_mode': 'delete'})
+        self.assertEqual(sorted(p.name for p in Path(self.ajustes['NAME']).parent.iterdir()), ['db.sqlite3'])
+
+        conexion = DatabaseWrapper(self.ajustes, alias='pragmas')
+        self.addCleanup(conexion.close)
+        migracion = importlib.import_module('App.migrations.0045_journal_mode_wal')
+        migracion.activar_wal(None, mock.Mock(connection=conexion))
+        self.assertEqual(self.pragmas('journal_mode'), {'journal_mode': 'wal'})
+
+
+class CacheSQLiteTests(SimpleTestCase):
+    """Dos backends sobre el mismo archivo hacen de dos workers"""
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.ruta = Path(directorio.name) / 'cache.sqlite3'
+        self.addCleanup(lambda: cache_sqlite._conexiones.por_ruta.pop(str(self.ruta)).close())
+
+    def cache(self, **opciones):
+        return CacheSQLite(self.ruta, {'TIMEOUT': 60, 'OPTIONS': opciones})
+
+    def test_compartida_entre_workers(self):
+        a, b = self.cache(), self.cache()
+        a.set_many({'perfil:1': {'nombre': 'Ana'}, 'perfil:2': {'nombre': 'Beto'}})
+        self.assertEqual(b.get_many(['perfil:1', 'perfil:2', 'perfil:3']), {
+            'perfil:1': {'nombre': 'Ana'}, 'perfil:2': {'nombre': 'Beto'},
+        })
+        b.delete_many(['perfil:1'])
+        self.assertIsNone(a.get('perfil:1'))
+        self.assertEqual(a.get('perfil:2'), {'nombre': 'Beto'})
+        a.clear()
+        self.assertFalse(b.has_key('perfil:2'))
+
+    def test_get_many_en_una_consulta(self):
+        cache = self.cache(MAX_ENTRIES=10_000)
+        cache.set_many({f'perfil:{i}': i for i in range(1200)})
+        sentencias = []
+        cache._db().set_trace_callback(sentencias.append)
+        self.assertEqual(len(cache.get_many([f'perfil:{i}' for i in range(1500)])), 1200)
+        self.assertEqual(len(sentencias), 3)  # trozos de _MAX_PARAMETROS claves
+
+    def test_vencimiento_add_incr_touch(self):
+        cache = self.cache()
+        cache.set('vencida', 1, timeout=0)
+        cache.set('eterna', 1, timeout=None)
+        self.assertIsNone(cache.get('vencida'))
+        self.assertTrue(cache.add('vencida', 2))
+        self.assertFalse(cache.add('vencida', 3))
+        self.assertEqual(cache.get('vencida'), 2)
+        self.assertEqual(cache.incr('eterna', 4), 5)
+        self.assertTrue(cache.touch('eterna', timeout=0))
+        self.assertNotIn('eterna', cache)
+        self.assertFalse(cache.touch('eterna'))
+
+    def test_poda_el_exceso(self):
+        cache = self.cache(MAX_ENTRIES=10, CULL_FREQUENCY=2, LIMPIEZA=0)
+        cache.set('vieja', 0, timeout=1)
+        cache.set_many({f'k{i}': i for i in range(10)})
+        cache.set('nueva', 0)
+        restantes = cache.get_many(['vieja', 'nueva', *(f'k{i}' for i in range(10))])
+        self.assertEqual(len(restantes), 7)  # 11 > 10: se borran 11 // 2, primero la que vence antes
+        self.assertNotIn('vieja', restantes)
+        self.assertIn('nueva', restantes)
+
+
+class MetricasTests(SimpleTestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.directorio = Path(directorio.name)
+
+    def registro(self, activo=True):
+        registro = metricas.RegistroMetricas(self.directorio, intervalo=0)
+        with mock.patch('App.metricas.atexit.register') as registrar:
+            if activo:
+                registro.activar()
+        self.assertEqual(registrar.called, activo)
+        return registro
+
+    def test_sin_activar_no_vuelca(self):
+        registro = self.registro(activo=False)
+        registro.incrementar('eafinders_peticiones_total', vista='home')
+        registro.volcar()
+        self.assertEqual(list(self.directorio.iterdir()), [])
+
+    def test_absorbe_los_archivos_de_procesos_terminados(self):
+        registro = self.registro()
+        registro.incrementar('eafinders_peticiones_total', vista='home')
+        proceso = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+        muerto = self.directorio / f'{proceso.stdout.strip()}.json'
+        muerto.write_text(json.dumps({
+            'contadores': {metricas._clave('eafinders_peticiones_total', {'vista': 'home'}): 2},
+            'histogramas': {},
+        }))
+        vivo = self.directorio / f'{os.getppid()}.json'
+        vivo.write_text(muerto.read_text())
+
+        contadores, _ = registro.agregado()
+        self.assertEqual(list(contadores.values()), [5])
+        self.assertFalse(muerto.exists())
+        self.assertEqual(sorted(archivo.name for archivo in self.directorio.iterdir()), sorted([
+            vivo.name, f'{os.getpid()}.json',
+        ]))
+        # Lo absorbido ya está en el archivo propio, que es lo que suman los demás workers
+        propio = json.loads((self.directorio / f'{os.getpid()}.json').read_text())
+        self.assertEqual(list(propio['contadores'].values()), [3])
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers, StopUpload
+
+from .storage import PREFIJO_BLOBS, almacenamiento_por_contenido
+
+# Tipo MIME -> tamaño máximo en bytes de los adjuntos de comentarios
+ADJUNTOS_LIMITES = getattr(settings, 'ADJUNTOS_LIMITES', {
+    'image/jpeg': 5 * 2**20,
+    'image/png': 5 * 2**20,
+    'image/gif': 5 * 2**20,
+    'image/webp': 5 * 2**20,
+})
+
+# Firmas de los primeros bytes: no se confía en el Content-Type que manda el navegador
+_FIRMAS = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+)
+
+
+def detectar_tipo(cabecera):
+    if cabecera[:4] == b'RIFF' and cabecera[8:12] == b'WEBP':
+        return 'image/webp'
+    for firma, tipo in _FIRMAS:
+        if cabecera.startswith(firma):
+            return tipo
+    return None
+
+
+class AdjuntoSubido(UploadedFile):
+    """Adjunto ya escrito en blobs/tmp y hasheado; AlmacenamientoPorContenido solo lo renombra."""
+
+    def __init__(self, ruta, name, content_type, size, sha256):
+        super().__init__(open(ruta, 'rb'), name, content_type, size)
+        self.ruta = ruta
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.ruta
+
+    def close(self):
+        # Si el storage no se lo llevó (p. ej. el formulario no fue válido) no se deja basura
+        try:
+            return self.file.close()
+        finally:
+            try:
+                os.remove(self.ruta)
+            except FileNotFoundError:
+                pass
+
+
+class AdjuntoUploadHandler(FileUploadHandler):
+    """
+    Escribe el adjunto directamente en el directorio de blobs mientras calcula su SHA-256.
+
+    Sin pasar por el /tmp del sistema ni copiar de nuevo al guardar. El tipo se detecta con
+    los primeros bytes y la subida se corta en cuanto supera el límite de su tipo, borrando
+    lo escrito. El motivo del rechazo queda en request.adjunto_error para el formulario.
+    """
+
+    def __init__(self, request=None, campo='archivo', limites=None):
+        super().__init__(request)
+        self.campo = campo
+        self.limites = limites or ADJUNTOS_LIMITES
+        self.activo = False
+        self.ruta = None
+        self.destino = None
+        self.longitud_total = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.longitud_total = content_length
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None,
+                 content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.activo = field_name == self.campo
+        if not self.activo:
+            return
+
+        maximo = max(self.limites.values())
+        if self.longitud_total and self.longitud_total > maximo + 64 * 1024:
+            # El cuerpo entero ya es más grande que cualquier adjunto permitido: ni se lee
+            self._rechazar(f'El archivo supera el máximo de {maximo / 2**20:.1f} MB.')
+            raise StopUpload(connection_reset=True)
+
+        directorio = almacenamiento_por_contenido().path(f'{PREFIJO_BLOBS}tmp')
+        os.makedirs(directorio, exist_ok=True)
+        descriptor, self.ruta = tempfile.mkstemp(dir=directorio, suffix='.part')
+        self.destino = os.fdopen(descriptor, 'wb')
+        self.hash = hashlib.sha256()
+        self.tamano = 0
+        self.tipo = None
+        self.cabecera = b''
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.activo:
+            return raw_data
+
+        if self.tipo is None:
+            self.cabecera += raw_data[:16]
+            if len(self.cabecera) < 12:
+                self._escribir(raw_data)
+                return None
+            self.tipo = detectar_tipo(self.cabecera)
+            if self.tipo not in self.limites:
+                self._rechazar('Tipo de archivo no permitido.')
+                raise SkipFile()
+
+        if self.tamano + len(raw_data) > self.limites[self.tipo]:
+            self._rechazar(f'El archivo supera el máximo de {self.limites[self.tipo] / 2**20:.1f} MB para {self.tipo}.')
+            raise SkipFile()
+        self._escribir(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.activo:
+            return None
+        self.activo = False
+        self.destino.close()
+        self.destino = None  # Desde aquí el temporal es del AdjuntoSubido
+        if file_size == 0:
+            os.remove(self.ruta)
+            return None
+        if self.tipo is None:
+            # Archivo de menos de 12 bytes: se decide con lo que haya
+            self.tipo = detectar_tipo(self.cabecera)
+            if self.tipo not in self.limites:
+                os.remove(self.ruta)
+                self._rechazar('Tipo de archivo no permitido.')
+                return None
+        return AdjuntoSubido(self.ruta, self.file_name, self.tipo, file_size, self.hash.hexdigest())
+
+    def upload_interrupted(self):
+        if self.destino is not None:
+            self._borrar_temporal()
+
+    def _escribir(self, datos):
+        self.destino.write(datos)
+        self.hash.update(datos)
+        self.tamano += len(datos)
+
+    def _rechazar(self, motivo):
+        self.activo = False
+        if self.destino is not None:
+            self._borrar_temporal()
+        if self.request is not None:
+            self.request.adjunto_error = motivo
+
+    def _borrar_temporal(self):
+        self.destino.close()
+        try:
+            os.remove(self.ruta)
+        except FileNotFoundError:
+            pass
+        self.destino = None
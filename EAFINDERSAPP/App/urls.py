@@ -1,12 +1,16 @@
-from django.urls import path
+import re
+
+from django.urls import path, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 from . import views
+from .media import servir_media
+from .metricas import exponer_metricas
 from .views import ForoCreateView, ForoDetailView, ForoListView
 
 urlpatterns = [
     path('', views.home, name='home'),
     path('home/', views.home, name='home'),
+    path('api/usuarios/', views.home_api, name='home_api'),
     path('registro/', views.registro_usuario, name='register'),
     path('login/', views.login, name='login'),
     path('api/logout/', views.logout_user, name='logout'),
@@ -22,10 +26,18 @@ urlpatterns = [
     path('conversaciones/', views.lista_conversaciones, name='lista_conversaciones'),
     path('chat/<int:amigo_id>/', views.chat_view, name='chat_view'),
     path('chat/<int:amigo_id>/obtener-mensajes/', views.obtener_mensajes, name='obtener_mensajes'),
+    path('chat/bandeja/', views.bandeja, name='bandeja'),
+    path('eventos/', views.esperar_eventos, name='eventos'),
 
     path('crear_foro/', ForoCreateView.as_view(), name='crear_foro'),
     path('foro/<int:foro_id>/', ForoDetailView.as_view(), name='detalle_foro'),
     path('foros/', ForoListView.as_view(), name='lista_foros'),
 
     path('foros/<int:foro_id>/like/', views.like_foro, name='like_foro'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+    path('feed/', views.feed, name='feed'),
+    path('etiquetas/<int:etiqueta_id>/seguir/', views.seguir_etiqueta, name='seguir_etiqueta'),
+
+    path('metrics', exponer_metricas, name='metricas'),
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), servir_media, name='media'),
+]
@@ -1,17 +1,31 @@
 from abc import ABC, abstractmethod
-from .models import Usuario, Amistad, Mensaje, Foro, Comentario, Etiqueta
+from asgiref.sync import sync_to_async
+from .models import Usuario, Amistad, Mensaje, Foro, Comentario, Etiqueta, Version
 from django.contrib.auth import login as auth_login, authenticate, logout
 from .forms import RegistroUsuarioForm, LoginForm, EditarPerfilForm, BuscarUsuarioForm, ForoForm, ComentarioForm
 from django.contrib.auth.hashers import make_password
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
-from django.http import JsonResponse
-from .observers import amistad_subject
+from django.conf import settings
+from django.db.models import Max, Q
+from django.http import Http404, JsonResponse
+from .observers import amistad_subject, actividad_subject
+from .feed import obtener_feed, desconectar_amigos
+from .contadores import vistas_foro
+from .perfiles import obtener_tarjetas
+from . import chat, descubrir, eventos
+from .imagenes import tamano_para, url_derivado
+from .routers import usar_replica
+from .condicional import condicional
 from django.views.generic import CreateView, DetailView, ListView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from .uploadhandlers import AdjuntoUploadHandler
+
+FOROS_POR_PAGINA = getattr(settings, 'FOROS_POR_PAGINA', 24)
 
 def logout_user(request):
     """View to log out the user."""
@@ -20,18 +34,37 @@ def logout_user(request):
         return redirect('login')  # Redirect to the login page
     return redirect('home')  # If not POST, redirect to home or another page
 
+def _perfil_y_relacion(request, user_id):
+    """El usuario del perfil y sus amistades con quien lo mira; se calcula una vez por petición"""
+    if not hasattr(request, '_perfil_y_relacion'):
+        profile_user = Usuario.objects.filter(id=user_id).first()
+        relacion = list(
+            Amistad.objects.filter(Q(user1=request.user, user2_id=user_id) | Q(user1_id=user_id, user2=request.user))
+            .order_by('id')
+        ) if profile_user else []
+        request._perfil_y_relacion = profile_user, relacion
+    return request._perfil_y_relacion
+
+
+def _version_perfil(request, user_id):
+    profile_user, relacion = _perfil_y_relacion(request, user_id)
+    if profile_user is None:
+        return None
+    # Los botones de amistad dependen de la relación entre los dos
+    return profile_user.fecha_actualizacion, [(a.id, a.user1_id, a.estado) for a in relacion]
+
+
 @login_required
+@condicional(_version_perfil)
 def profile_view(request, user_id):
-    profile_user = get_object_or_404(Usuario, id=user_id)
+    profile_user, relacion = _perfil_y_relacion(request, user_id)
+    if profile_user is None:
+        raise Http404
 
     # Verifica si ya hay una solicitud enviada o recibida
-    solicitud_enviada = Amistad.objects.filter(user1=request.user, user2=profile_user, estado='pendiente').exists()
-    solicitud_recibida = Amistad.objects.filter(user1=profile_user, user2=request.user, estado='pendiente').first()
-    son_amigos = Amistad.objects.filter(
-        (Q(user1=request.user) & Q(user2=profile_user)) |
-        (Q(user1=profile_user) & Q(user2=request.user)),
-        estado='aceptada'
-    ).exists()
+    solicitud_enviada = any(a.user1_id == request.user.id and a.estado == 'pendiente' for a in relacion)
+    solicitud_recibida = next((a for a in relacion if a.user1_id == profile_user.id and a.estado == 'pendiente'), None)
+    son_amigos = any(a.estado == 'aceptada' for a in relacion)
 
     contexto = {
         'profile_user': profile_user,
@@ -48,12 +81,12 @@ def account(request):
     # Obtener las amistades donde el usuario sea user1 o user2 y la solicitud haya sido aceptada
     amistades = Amistad.objects.filter(
         Q(user1=request.user, estado='aceptada') | Q(user2=request.user, estado='aceptada')
-    )
+    ).select_related('user1', 'user2')
 
     amigos = []
     for amistad in amistades:
         # Si el usuario es user1, el amigo es user2, y viceversa
-        if amistad.user1 == request.user:
+        if amistad.user1_id == request.user.id:
             amigos.append(amistad.user2)
         else:
             amigos.append(amistad.user1)
@@ -61,10 +94,37 @@ def account(request):
     return render(request, 'Cuenta.html', {'amigos': amigos})
 
 
+def _grilla_home(request):
+    if request.GET.get('modo') == 'aleatorio':
+        return descubrir.muestra(request.user.id), None
+    return descubrir.pagina(request.user.id, request.GET.get('cursor'))
+
+@usar_replica
 def home(request):
-    """View to display home page with all users except the logged-in user."""
-    users = Usuario.objects.exclude(id=request.user.id)
-    return render(request, 'home.html', {'users': users})
+    """Grilla de usuarios para descubrir (sin el que inició sesión), paginada o al azar"""
+    users, siguiente_cursor = _grilla_home(request)
+    return render(request, 'home.html', {
+        'users': users,
+        'siguiente_cursor': siguiente_cursor,
+        'aleatorio': request.GET.get('modo') == 'aleatorio',
+    })
+
+@usar_replica
+def home_api(request):
+    """Siguiente página de la grilla de home en JSON, para el scroll infinito"""
+    users, siguiente_cursor = _grilla_home(request)
+    tamano = tamano_para(100)
+    return JsonResponse({
+        'usuarios': [{
+            'id': user.id,
+            'nombre': user.nombre_completo,
+            'carrera': user.carrera,
+            'semestre': user.semestre,
+            'foto': url_derivado(user.foto_perfil, tamano) if user.foto_perfil else None,
+            'perfil': reverse('profile', args=[user.id]),
+        } for user in users],
+        'siguiente': siguiente_cursor,
+    })
 
 @login_required
 def EditProfile(request):
@@ -101,7 +161,7 @@ def login(request):
     else:
         form = LoginForm()
 
-    return render(request, 'login.html', {'form': form})
+    return render(request, 'Login.html', {'form': form})
 
 def registro_usuario(request):
     """View for user registration."""
@@ -173,6 +233,7 @@ class DjangoUsuarioRepository(IUsuarioRepository):
         return queryset.filter(semestre=semestre)
 
 # vista que inyecta las dependencias
+@usar_replica
 def buscar_usuarios(request):
     form = BuscarUsuarioForm(request.GET)
     
@@ -188,6 +249,7 @@ def buscar_usuarios(request):
             carrera=form.cleaned_data.get('carrera'),
             semestre=form.cleaned_data.get('semestre')
         )
+    usuarios = obtener_tarjetas(usuarios.values_list('id', flat=True)).values()
     
     return render(request, 'buscar_usuarios.html', {'form': form, 'usuarios': usuarios}) 
 
@@ -246,6 +308,7 @@ def eliminar_amistad(request, user_id):
     )
     if amistad.exists():
         amistad.delete()
+        desconectar_amigos(request.user, amigo)
         messages.success(request, f'Amistad eliminada con {amigo}.')
     else:
         messages.error(request, 'No tienes una amistad con este usuario.')
@@ -255,7 +318,7 @@ def eliminar_amistad(request, user_id):
 @login_required
 def Notificaciones(request):
     # Solo solicitudes de amistad pendientes
-    solicitudes = Amistad.objects.filter(user2=request.user, estado='pendiente')
+    solicitudes = Amistad.objects.filter(user2=request.user, estado='pendiente').select_related('user1')
     
     contexto = {
         'solicitudes': solicitudes,
@@ -274,10 +337,8 @@ def chat_view(request, amigo_id):
     if not amistad:
         return redirect('home')  # Redirigir si no son amigos
 
-    # Obtener los mensajes entre el usuario actual y el amigo
-    mensajes = Mensaje.objects.filter(
-        Q(remitente=request.user, destinatario=amigo) | Q(remitente=amigo, destinatario=request.user)
-    ).order_by('fecha_enviado')
+    # Obtener los mensajes entre el usuario actual y el amigo (del shard de la conversación)
+    mensajes = list(Mensaje.objects.conversacion(request.user, amigo).order_by('id'))
 
     if request.method == 'POST':
         contenido = request.POST.get('contenido')
@@ -285,35 +346,76 @@ def chat_view(request, amigo_id):
             Mensaje.objects.create(remitente=request.user, destinatario=amigo, contenido=contenido)
             return redirect('chat_view', amigo_id=amigo.id)  # Redirigir para actualizar la conversación
 
-    return render(request, 'chat.html', {'amigo': amigo, 'mensajes': mensajes})
+    return render(request, 'chat.html', {
+        'amigo': amigo, 'mensajes': mensajes, 'ultimo': mensajes[-1].id if mensajes else 0,
+    })
 
 
 @login_required
+@usar_replica
 def obtener_mensajes(request, amigo_id):
+    """Mensajes de la conversación en el formato compacto de App/chat.py; ?desde=<id> para los nuevos"""
     amigo = get_object_or_404(Usuario, id=amigo_id)
+    try:
+        desde = max(int(request.GET.get('desde', 0)), 0)
+    except ValueError:
+        desde = 0
 
-    # Obtener mensajes entre el usuario actual y el amigo
-    mensajes = Mensaje.objects.filter(
-        Q(remitente=request.user, destinatario=amigo) | Q(remitente=amigo, destinatario=request.user)
-    ).order_by('fecha_enviado')
+    # Del shard de la conversación, donde los ids crecen con el tiempo
+    mensajes = chat.filas(
+        Mensaje.objects.conversacion(request.user, amigo).filter(id__gt=desde).order_by('id')
+    )
+    # El shard no tiene la tabla de usuarios: los nombres salen de los dos que ya están cargados
+    participantes = None if desde else {request.user.id: request.user.nombres, amigo.id: amigo.nombres}
+    return chat.responder(request, chat.paquete(mensajes, participantes, desde))
+
+
+@login_required
+@usar_replica
+def bandeja(request):
+    """
+    Un solo poll para todas las conversaciones abiertas: ?c=<amigo_id>:<último id visto> (una
+    por conversación). Responde solo las que tienen mensajes nuevos, en el formato de App/chat.py.
+    """
+    desde = {}
+    for valor in request.GET.getlist('c')[:chat.BANDEJA_MAX_CONVERSACIONES]:
+        amigo, _, ultimo = valor.partition(':')
+        try:
+            desde[int(amigo)] = max(int(ultimo or 0), 0)
+        except ValueError:
+            return JsonResponse({'error': f'Conversación inválida: {valor}'}, status=400)
+    conversaciones = chat.novedades(request.user.id, desde)
+    return chat.responder(request, {'conversaciones': {str(amigo): datos for amigo, datos in conversaciones.items()}})
+
+
+@login_required
+async def esperar_eventos(request):
+    """
+    Long-poll de mensajes y solicitudes de amistad (App/eventos.py): ?cursor=<el de la respuesta
+    anterior>. Responde en cuanto hay algo, o a los LONGPOLL_SEGUNDOS con la lista vacía. Sirve
+    con ASGI; con WSGI funciona pero cada espera ocupa un hilo. `respaldo` son los segundos entre
+    las consultas a la bandeja que el cliente hace igual.
+    """
+    usuario = await request.auser()
+    await sync_to_async(eventos.soltar_conexiones)()
+    await eventos.escuchar()
+    respuesta = await eventos.buzon.esperar(usuario.id, request.GET.get('cursor'))
+    return JsonResponse({**respuesta, 'respaldo': eventos.LONGPOLL_RESPALDO_SEGUNDOS})
 
-    # Formatear los mensajes para JSON
-    mensajes_json = []
-    for mensaje in mensajes:
-        mensajes_json.append({
-            'remitente': mensaje.remitente.nombres,  # Asegúrate de que este campo exista en tu modelo
-            'contenido': mensaje.contenido,
-        })
 
-    return JsonResponse(mensajes_json, safe=False)
 @login_required
 def lista_conversaciones(request):
     # Obtener amigos con los que tienes amistad aceptada
-    amigos = Amistad.objects.filter(
+    amistades = Amistad.objects.filter(
         (Q(user1=request.user) | Q(user2=request.user)),
         estado='aceptada'
-    )
-    return render(request, 'lista_Chats.html', {'amigos': amigos})
+    ).values_list('user1_id', 'user2_id')
+    ids = [user2 if user1 == request.user.id else user1 for user1, user2 in amistades]
+    amigos = obtener_tarjetas(ids).values()
+    # Último mensaje de cada conversación: desde ahí la bandeja cuenta los no leídos
+    ultimos = chat.ultimos(request.user.id, ids)
+    conversaciones = [(amigo, ultimos.get(amigo.id, 0)) for amigo in amigos]
+    return render(request, 'Lista_Chats.html', {'conversaciones': conversaciones})
 
 
 class ForoCreateView(LoginRequiredMixin, CreateView):
@@ -324,25 +426,71 @@ class ForoCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.creador = self.request.user
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        actividad_subject.registrar(self.request.user, 'creo', self.object)
+        return response
+
+
+def _version_foro(request, foro_id):
+    # Los comentarios tocan fecha_actualizacion del foro; los autores pueden cambiar de nombre
+    return (
+        Foro.objects.filter(id=foro_id)
+        .annotate(autores=Max("comentarios__autor__fecha_actualizacion"))
+        .values_list("fecha_actualizacion", "creador__fecha_actualizacion", "autores")
+        .first()
+    )
 
 
+# CsrfViewMiddleware lee request.POST antes de la vista y con eso ya no se pueden cambiar los
+# upload handlers; por eso se exime el dispatch y se protege post después de instalarlos
+@method_decorator(csrf_exempt, name="dispatch")
 class ForoDetailView(DetailView):
     model = Foro
     pk_url_kwarg = "foro_id"  # Para mantener compatibilidad con tu URL
     template_name = "detalle_foro.html"
     context_object_name = "foro"
 
+    def get(self, request, *args, **kwargs):
+        # La visita cuenta aunque se responda 304; un foro que no existe sale antes con Http404
+        response = self._get(request, *args, **kwargs)
+        vistas_foro.incrementar(kwargs[self.pk_url_kwarg])
+        return response
+
+    @method_decorator(condicional(_version_foro))
+    def _get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         foro = self.object
-        context["comentarios"] = foro.comentarios.filter(parent=None).order_by("-fecha_creacion")
-        context["form"] = ComentarioForm()
+        # Comentarios y respuestas en dos consultas; los autores salen de la caché de perfiles
+        comentarios = list(
+            foro.comentarios.filter(parent=None)
+            .prefetch_related("respuestas")
+            .order_by("-fecha_creacion")
+        )
+        context["comentarios"] = comentarios
+        context["autores"] = obtener_tarjetas([
+            foro.creador_id,
+            *(c.autor_id for c in comentarios),
+            *(r.autor_id for c in comentarios for r in c.respuestas.all()),
+        ])
+        context.setdefault("form", ComentarioForm())  # En un POST inválido llega el form con errores
         return context
 
     def post(self, request, *args, **kwargs):
+        # El adjunto va directo al storage, hasheado y con límite de tamaño por tipo. Es el único
+        # handler: si rechaza un archivo al terminarlo (file_complete devuelve None) Django se lo
+        # pasaría a los de settings, que nunca recibieron new_file
+        request.upload_handlers = [AdjuntoUploadHandler(request)]
+        return self._post(request, *args, **kwargs)
+
+    @method_decorator(csrf_protect)
+    def _post(self, request, *args, **kwargs):
         self.object = self.get_object()
         form = ComentarioForm(request.POST, request.FILES)
+        if getattr(request, "adjunto_error", None):
+            form.add_error("archivo", request.adjunto_error)
         if form.is_valid():
             comentario = form.save(commit=False)
             comentario.foro = self.object
@@ -353,21 +501,32 @@ class ForoDetailView(DetailView):
                 comentario.parent = Comentario.objects.get(id=parent_id)
 
             comentario.save()
+            actividad_subject.registrar(request.user, 'comento', self.object)
             return redirect("detalle_foro", foro_id=self.object.id)
 
         context = self.get_context_data(form=form)
         return self.render_to_response(context)
 
 
+def _version_foros(request):
+    # La suben los signals de foros, comentarios, likes, etiquetas y nombres de los creadores, y el
+    # volcado de las vistas (App/contadores.py)
+    return Version.actual("foros")
+
+
+@method_decorator(usar_replica, name="dispatch")
+@method_decorator(condicional(_version_foros), name="get")
 class ForoListView(ListView):
     model = Foro
     template_name = "lista_foros.html"
     context_object_name = "foros"
+    paginate_by = FOROS_POR_PAGINA
 
     def get_queryset(self):
-        qs = super().get_queryset()
+        qs = super().get_queryset().select_related("creador").prefetch_related("etiquetas")
         query = self.request.GET.get("q")
         etiquetas_ids = self.request.GET.getlist("etiquetas")
+        orden = self.request.GET.get("orden")
 
         if query:
             qs = qs.filter(
@@ -383,11 +542,24 @@ class ForoListView(ListView):
                 etiquetas_q |= Q(etiquetas__id=etiqueta_id)
             qs = qs.filter(etiquetas_q).distinct()
 
+        self.filtrados = qs
+        if orden == "tendencia":
+            qs = qs.con_puntaje().order_by("-puntaje", "-fecha_creacion")
+        else:
+            qs = qs.order_by("-fecha_creacion")
+
         return qs
 
+    def get_paginator(self, queryset, per_page, **kwargs):
+        paginator = super().get_paginator(queryset, per_page, **kwargs)
+        # Para contar basta el filtro, sin el GROUP BY del puntaje de tendencia ni los joins
+        paginator.count = self.filtrados.order_by().count()
+        return paginator
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["etiquetas"] = Etiqueta.objects.all()
+        context["orden"] = self.request.GET.get("orden", "")
         return context
 
 @login_required
@@ -397,8 +569,33 @@ def like_foro(request, foro_id):
 
     if usuario in foro.likes.all():
         foro.likes.remove(usuario)  # Quitar el like si ya lo ha dado
+        actividad_subject.retirar(usuario, 'like', foro)
     else:
         foro.likes.add(usuario)  # Añadir el like
+        actividad_subject.registrar(usuario, 'like', foro)
 
     return redirect('lista_foros')
 
+@login_required
+def feed(request):
+    """Foros creados, con like o comentados por los amigos y de las etiquetas seguidas"""
+    actividades, siguiente_cursor = obtener_feed(request.user, request.GET.get('cursor'))
+    contexto = {
+        'actividades': actividades,
+        'siguiente_cursor': siguiente_cursor,
+        'etiquetas': Etiqueta.objects.all(),
+        'etiquetas_seguidas': set(request.user.etiquetas_seguidas.values_list('id', flat=True)),
+    }
+    return render(request, 'feed.html', contexto)
+
+@login_required
+def seguir_etiqueta(request, etiqueta_id):
+    etiqueta = get_object_or_404(Etiqueta, id=etiqueta_id)
+
+    if request.method == 'POST':
+        if etiqueta.seguidores.filter(id=request.user.id).exists():
+            etiqueta.seguidores.remove(request.user)  # Dejar de seguir
+        else:
+            etiqueta.seguidores.add(request.user)
+
+    return redirect('feed')
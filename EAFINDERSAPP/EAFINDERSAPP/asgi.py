@@ -0,0 +1,18 @@
+"""
+ASGI config for EAFINDERSAPP project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (uvicorn, daphne) so the long-poll view in
+App/eventos.py waits without holding a thread.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'EAFINDERSAPP.settings')
+
+application = get_asgi_application()
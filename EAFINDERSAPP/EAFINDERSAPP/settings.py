@@ -51,12 +51,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'App.middleware.MetricasMiddleware',
+    'App.middleware.SQLInstrumentacionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'App.routers.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -66,7 +69,8 @@ ROOT_URLCONF = 'EAFINDERSAPP.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
+        # La carpeta de la app es Templates (con mayúscula) y APP_DIRS solo busca templates/
+        'DIRS': [BASE_DIR / 'App' / 'Templates'],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -86,13 +90,56 @@ WSGI_APPLICATION = 'EAFINDERSAPP.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# SQLite en modo WAL con pragmas por conexión (App/backends/sqlite_wal). Las transacciones
+# empiezan con BEGIN IMMEDIATE: toman el lock de escritura de entrada y esperan busy_timeout,
+# en vez de fallar con "database is locked" al pasar de lectura a escritura a mitad de camino.
+# Las conexiones se reusan entre peticiones y se revisan antes de reusarlas.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'App.backends.sqlite_wal',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {'busy_timeout': 5000},
+        },
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # Réplica de lectura (App/routers.py). En desarrollo es el mismo archivo abierto en solo
+    # lectura; en producción se apunta a la réplica de verdad. En los tests es un espejo de default.
+    'replica': {
+        'ENGINE': 'App.backends.sqlite_wal',
+        'NAME': f'file:{BASE_DIR / "db.sqlite3"}?mode=ro',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    },
+    # Shards de Mensaje (ver MENSAJES_SHARDS): solo tienen la tabla de mensajes.
+    # python manage.py migrate --database mensajes_0 (y _1) la crea.
+    'mensajes_0': {
+        'ENGINE': 'App.backends.sqlite_wal',
+        'NAME': BASE_DIR / 'mensajes_0.sqlite3',
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    'mensajes_1': {
+        'ENGINE': 'App.backends.sqlite_wal',
+        'NAME': BASE_DIR / 'mensajes_1.sqlite3',
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
 }
 
+# Cada conversación vive en uno de estos alias (App/shards.py). Los nuevos se agregan al final
+# y después se corre rebalancear_mensajes; con ['default'] no hay particionado.
+MENSAJES_SHARDS = ['mensajes_0', 'mensajes_1']
+
+DATABASE_ROUTERS = ['App.routers.RouterReplica', 'App.routers.RouterMensajes']
+# Después de escribir, las peticiones de los siguientes segundos leen del primario
+REPLICA_PEGAJOSO_SEGUNDOS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -136,3 +183,123 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Feed de foros: por encima de este número de amigos no se hace fan-out en escritura
+FEED_FANOUT_MAX_AMIGOS = 1000
+
+# Vistas de foros: se vuelcan a la base de datos cada tantos segundos (None: nunca por tiempo) o vistas acumuladas
+FORO_VISTAS_INTERVALO = 10
+FORO_VISTAS_MAXIMO = 500
+
+# Archivos subidos: None los sirve Django por chunks; 'x-sendfile' o 'x-accel-redirect' los delega al servidor web
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_PREFIJO = '/media-interno/'
+
+# Adjuntos de comentarios: tipo MIME (detectado por contenido) -> tamaño máximo en bytes
+ADJUNTOS_LIMITES = {
+    'image/jpeg': 5 * 1024 * 1024,
+    'image/png': 5 * 1024 * 1024,
+    'image/gif': 5 * 1024 * 1024,
+    'image/webp': 5 * 1024 * 1024,
+}
+
+# Instrumentación SQL por petición (Server-Timing + log JSON en App.sql con posibles N+1).
+# En producción se puede dejar activa midiendo solo una fracción de las peticiones.
+SQL_INSTRUMENTACION = DEBUG
+SQL_INSTRUMENTACION_MUESTREO = 1.0
+SQL_N1_UMBRAL = 5
+
+# Métricas en /metrics (formato Prometheus). Cada worker vuelca las suyas a METRICAS_DIR
+# cada METRICAS_INTERVALO segundos y el endpoint suma todas; fuera de DEBUG solo lo ven
+# el staff y las IPs de METRICAS_IPS_PERMITIDAS
+METRICAS_ACTIVAS = True
+METRICAS_DIR = BASE_DIR / '.metricas'
+METRICAS_INTERVALO = 5
+METRICAS_IPS_PERMITIDAS = ['127.0.0.1', '::1']
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'App.sql': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# Caché compartida por todos los workers del servidor: una tabla en CACHE_DB (App/cache_sqlite.py).
+# Con la caché en memoria de cada proceso, invalidar una tarjeta de perfil solo la borraría en el
+# worker que guardó el cambio y los demás la seguirían mostrando hasta que venciera. get_many trae
+# todas las tarjetas de una página en una consulta. Si los workers corren en varias máquinas hace
+# falta una caché de red (Redis o Memcached).
+CACHE_DB = BASE_DIR / 'cache.sqlite3'
+CACHES = {
+    'default': {
+        'BACKEND': 'App.cache_sqlite.CacheSQLite',
+        'LOCATION': CACHE_DB,
+        # Alcanza para una tarjeta por usuario; al pasarse se borra un tercio, las que vencen antes
+        'OPTIONS': {'MAX_ENTRIES': 200000},
+    },
+}
+
+# Tarjetas de perfil (nombre, foto, carrera...) que usan las listas y comentarios: se cachean
+# por usuario y se invalidan al guardar el perfil
+PERFILES_CACHE_SEGUNDOS = 60 * 60 * 24
+
+# Usuarios por página en la grilla de home (y por cada carga del scroll infinito)
+DESCUBRIR_POR_PAGINA = 24
+
+# Foros por página en la lista de foros
+FOROS_POR_PAGINA = 24
+
+# Foros y perfiles responden 304 si no cambiaron (App/condicional.py). Con sesión son privados y se
+# revalidan siempre; sin sesión un proxy inverso los puede guardar estos segundos
+PAGINAS_PUBLICAS_MAX_AGE = 30
+
+# Bandeja del chat (un poll para todas las conversaciones, App/chat.py): conversaciones por
+# consulta y mensajes por shard en cada respuesta
+BANDEJA_MAX_CONVERSACIONES = 100
+BANDEJA_MAX_MENSAJES = 500
+
+# Long-poll de eventos (App/eventos.py): segundos que espera cada petición, eventos que recuerda
+# cada proceso por usuario y usuarios que recuerda (los que hace más que no reciben nada se olvidan)
+LONGPOLL_SEGUNDOS = 25
+LONGPOLL_RECIENTES = 50
+LONGPOLL_USUARIOS = 10000
+
+# Capa de Channels sin Redis para varios workers ASGI en la misma máquina (App/canales.py)
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'App.canales.CapaSQLite',
+        'CONFIG': {
+            'ruta': BASE_DIR / 'canales.sqlite3',
+            'expiry': 60,  # Segundos que espera un mensaje a que lo reciban
+            'group_expiry': 86400,
+            'capacity': 100,  # Mensajes sin recibir por canal
+        },
+    },
+}
+# Con varios workers ASGI, 'default' para que los eventos del long-poll lleguen a todos. Con un
+# solo proceso no hace falta, y con WSGI (runserver) no sirve: no hay un event loop que quede
+LONGPOLL_CAPA = None
+# Cada cuántos segundos el cliente del long-poll consulta igual la bandeja. Sin LONGPOLL_CAPA un
+# evento solo despierta a los que esperan en el worker que lo publicó; con varios workers el resto
+# se entera por esta consulta, así que queda en 2 (como el polling de antes) y el long-poll solo
+# adelanta lo del mismo worker. Con la capa cada evento llega a todos y la consulta es un respaldo.
+LONGPOLL_RESPALDO_SEGUNDOS = 30 if LONGPOLL_CAPA else 2
+
+# Políticas del comando retencion (App/retencion.py): días que se conservan los mensajes antes de
+# archivarlos comprimidos y las solicitudes rechazadas antes de borrarlas (None: nunca)
+RETENCION = {
+    'mensajes_dias': 365 * 2,
+    'rechazadas_dias': 90,
+    'lote': 500,
+    'pausa': 0.05,
+}
+
+# Importar roster desde el admin (App/roster.py): con más contraseñas que esto no se hashean en la
+# petición; el archivo se copia a ROSTER_PENDIENTES_DIR y lo importa manage.py importar_roster en
+# segundo plano, que lo borra al terminar
+ROSTER_ADMIN_MAX_CONTRASENAS = 20
+ROSTER_PENDIENTES_DIR = BASE_DIR / '.roster'